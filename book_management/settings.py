@@ -98,20 +98,32 @@ WSGI_APPLICATION = 'book_management.wsgi.application'
 #     }
 # }
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': os.getenv('DB_NAME'),
-        'USER': os.getenv('DB_USER'),
-        'PASSWORD': os.getenv('DB_PASSWORD'),
-        'HOST': os.getenv('DB_HOST'),
-        'PORT': os.getenv('DB_PORT'),
-        'OPTIONS': {
-            'charset': 'utf8mb4',
-            'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+if os.getenv('DB_NAME'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': os.getenv('DB_NAME'),
+            'USER': os.getenv('DB_USER'),
+            'PASSWORD': os.getenv('DB_PASSWORD'),
+            'HOST': os.getenv('DB_HOST'),
+            'PORT': os.getenv('DB_PORT'),
+            'OPTIONS': {
+                'charset': 'utf8mb4',
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+            }
+        }
+    }
+else:
+    # 未配置 MySQL 时（本地开发、测试）使用 SQLite 文件库；测试库也用文件而不是内存库，
+    # 并发借还测试的多个连接才会等待写锁，而不是直接报 table is locked
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {'timeout': 20},
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
-}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -162,6 +174,55 @@ AUTH_USER_MODEL = 'library.User'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 书目列表每页显示的图书数量
+BOOK_LIST_PAGE_SIZE = 24
+
+# 封面渲染等后台任务：False 时在事务提交后同步执行
+LIBRARY_ASYNC_TASKS = True
+LIBRARY_TASK_WORKERS = 2
+
+# 上传和导入图片的规范化：最长边像素、输出格式（webp/jpeg）与质量，关闭时保存原图
+LIBRARY_IMAGE_NORMALIZE = True
+LIBRARY_IMAGE_MAX_DIMENSION = 1600
+LIBRARY_IMAGE_FORMAT = 'webp'
+LIBRARY_IMAGE_QUALITY = 85
+
+# 缓存：页面片段和借还幂等记录各用一个别名，大量书目片段的淘汰不会挤掉幂等记录
+#   pages：页面片段。管理命令和后台进程写入的失效标记须对所有 Web 进程生效，
+#     生产环境设置 REDIS_URL（如 redis://127.0.0.1:6379/1）使用共享的 Redis；
+#     未设置时退回进程内 LocMemCache，仅适用于开发环境（单进程）。
+#   idempotency：幂等记录须跨进程共享、原子地占位（add）且在 TTL 内不被淘汰，
+#     使用数据库缓存表（部署时运行 python manage.py createcachetable），
+#     MAX_ENTRIES 应大于 24 小时内的借还请求数，只有过期记录会被清理。
+REDIS_URL = os.getenv('REDIS_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'library-pages',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'idempotency': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'library_idempotency_cache',
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+# 书目列表、详情页正文和轮播图片段的缓存别名与有效期（秒）
+LIBRARY_PAGE_CACHE = 'pages'
+LIBRARY_PAGE_CACHE_TTL = 10 * 60
+
+# 借还请求 Idempotency-Key 的响应缓存：缓存别名（多进程部署应指向共享缓存）与保留秒数
+LIBRARY_IDEMPOTENCY_CACHE = 'idempotency'
+LIBRARY_IDEMPOTENCY_TTL = 24 * 60 * 60
+
 # 在文件末尾添加兼容性修复
 import django
 from django.db.backends.mysql.base import DatabaseWrapper
@@ -1,7 +1,11 @@
 from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
 from .models import Book, BookImage, BookCopy
+from . import exporter, stocktake
+from itertools import islice
 from .forms import BookCopyForm
 from django import forms
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.urls import path
 from django.core.files import File
@@ -10,6 +14,9 @@ import os
 import zipfile
 import json
 from django.utils.html import format_html  # Added import
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
 class BulkUploadForm(forms.Form):
     zip_file = forms.FileField(label='图书资源包(ZIP)')
@@ -20,6 +27,86 @@ class BulkUploadForm(forms.Form):
     )
 
 
+class StocktakeForm(forms.Form):
+    scan_file = forms.FileField(label='扫描结果文件', help_text='每行一个副本ID或二维码内容（bookcopy:N）')
+    book = forms.ModelChoiceField(
+        label='盘点图书',
+        queryset=Book.objects.only('id', 'title'),
+        # 与副本表单相同的自动补全，不把全部图书渲染为下拉选项
+        widget=AutocompleteSelect(BookCopy._meta.get_field('book'), admin.site),
+        required=False,
+        help_text='留空则盘点全部副本'
+    )
+
+# 盘点页面每类异常最多列出的副本数量
+STOCKTAKE_DISPLAY_LIMIT = 200
+
+# 表的估算行数超过该值时，未筛选的列表页使用估算总数
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def estimated_count(model, using='default'):
+    """从数据库统计信息读取表的估算行数，不支持的数据库返回 None"""
+    connection = connections[using]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'mysql':
+        sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """未加筛选和搜索条件时用估算行数分页，避免在大表上执行 COUNT(*)"""
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class BookInputFilter(admin.SimpleListFilter):
+    """按图书ID或书名筛选副本，用输入框代替在侧栏列出全部图书"""
+    title = '所属图书'
+    parameter_name = 'book'
+    template = 'admin/library/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def queryset(self, request, queryset):
+        value = (self.value() or '').strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(book_id=int(value))
+        return queryset.filter(book__title__icontains=value)
+
+    def choices(self, changelist):
+        # 模板用一个 GET 表单提交，其余筛选条件作为隐藏字段保留
+        yield {
+            'value': self.value() or '',
+            'parameter_name': self.parameter_name,
+            'clear_url': changelist.get_query_string(remove=[self.parameter_name]),
+            'hidden_params': [
+                (key, value) for key, values in changelist.filter_params.items()
+                if key != self.parameter_name for value in values
+            ],
+        }
+
+
 class BookImageInline(admin.TabularInline):
     model = BookImage
     extra = 1  # 默认显示1个空表单
@@ -37,10 +124,11 @@ class BookCopyInline(admin.TabularInline):
     form = BookCopyForm
     extra = 1  # 不显示空表单
     readonly_fields = ('qr_code_preview',)  # Added field
+    raw_id_fields = ('borrower',)  # 每行都列出全部用户的下拉框太大
 
     def qr_code_preview(self, obj):
-        if obj.qr_code:
-            return format_html('<img src="{}" style="max-height: 100px;"/>', obj.qr_code.url)
+        if obj.pk:
+            return format_html('<img src="{}" style="max-height: 100px;" loading="lazy"/>', obj.qr_code_url)
         return "-"
     qr_code_preview.short_description = '二维码预览'
 
@@ -48,27 +136,52 @@ class BookCopyInline(admin.TabularInline):
 class BookAdmin(admin.ModelAdmin):
     inlines = [BookCopyInline,BookImageInline]
     list_display = ('title', 'author', 'copies_count', 'available_copies')
-    
+    search_fields = ('title', 'author', 'isbn')  # 同时供副本表单的图书自动补全使用
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
     def available_copies(self, obj):
-        return obj.copies.filter(is_available=True).count()
+        return obj.available_count
     available_copies.short_description = '可借副本'
+    available_copies.admin_order_field = 'available_count'
+
+    actions = ['export_books_action']
+
+    def export_books_action(self, request, queryset):
+        """把选中的图书导出为资源包，边打包边下载"""
+        books = exporter.export_queryset(queryset).iterator(chunk_size=500)
+        response = StreamingHttpResponse(exporter.stream_archive(books), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="books_export.zip"'
+        return response
+    export_books_action.short_description = '导出为资源包(ZIP)'
     
 
 @admin.register(BookCopy)
 class BookCopyAdmin(admin.ModelAdmin):
     form = BookCopyForm  # 使用自定义表单
     list_display = ('id', 'book_title', 'is_available', 'borrower', 'due_date', 'qr_code_preview')  # Added fields
-    list_filter = ('is_available', 'book')  # Added list filter
+    list_filter = ('is_available', BookInputFilter)  # Added list filter
     search_fields = ('book__title', 'book__author', 'borrower__username')  # Added search fields
     readonly_fields = ('qr_code_preview',)  # Added readonly field
+    autocomplete_fields = ('book',)
+    raw_id_fields = ('borrower',)
+    change_list_template = 'admin/library/bookcopy_change_list.html'
+    # 副本表可达十万行：分页用估算总数，不再额外统计全表行数
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # 列表的书名、借阅者列在同一条查询中取出
+        return super().get_queryset(request).select_related('book', 'borrower')
 
     def book_title(self, obj):
         return obj.book.title
     book_title.short_description = '书名'
+    book_title.admin_order_field = 'book__title'
 
     def qr_code_preview(self, obj):
-        if obj.qr_code:
-            return format_html('<img src="{}" style="max-height: 100px;"/>', obj.qr_code.url)
+        if obj.pk:
+            return format_html('<img src="{}" style="max-height: 100px;" loading="lazy"/>', obj.qr_code_url)
         return "-"
     qr_code_preview.short_description = '二维码预览'
 
@@ -96,3 +209,43 @@ class BookCopyAdmin(admin.ModelAdmin):
         self.message_user(request, f'成功为{count}个图书副本生成二维码')
     generate_qr_codes_action.short_description = '生成二维码'
 
+    def get_urls(self):
+        urls = [
+            path('stocktake/', self.admin_site.admin_view(self.stocktake_view), name='library_bookcopy_stocktake'),
+        ]
+        return urls + super().get_urls()
+
+    def stocktake_view(self, request):
+        """上传扫描结果文件，核对书架与系统记录"""
+        results = None
+        if request.method == 'POST':
+            form = StocktakeForm(request.POST, request.FILES)
+            if form.is_valid():
+                queryset = BookCopy.objects.all()
+                if form.cleaned_data['book']:
+                    queryset = queryset.filter(book=form.cleaned_data['book'])
+                report = stocktake.reconcile(form.cleaned_data['scan_file'], queryset)
+                results = {
+                    'report': report,
+                    'held': len(report.held),
+                    'categories': [
+                        {
+                            'label': label,
+                            'count': len(getattr(report, category)) + (report.out_of_range if category == 'unexpected' else 0),
+                            'ids': list(islice(getattr(report, category), STOCKTAKE_DISPLAY_LIMIT)),
+                        }
+                        for category, label in stocktake.REPORT_CATEGORIES
+                    ],
+                }
+        else:
+            form = StocktakeForm()
+
+        return render(request, 'admin/library/stocktake.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': '书架盘点',
+            'form': form,
+            'results': results,
+            'display_limit': STOCKTAKE_DISPLAY_LIMIT,
+        })
+
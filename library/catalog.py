@@ -0,0 +1,129 @@
+# library/catalog.py
+"""书目数据批量导入（CSV / JSONL）
+
+只导入元数据，不含图片：逐行读取文件，按批以 ISBN 为键 upsert 图书，
+一批一个事务，内存占用只与批大小有关，可以直接导入联合目录导出的上百万行数据。
+新图书不在导入时渲染封面，首次显示时才排队渲染，完成前显示占位图。
+"""
+import csv
+import json
+import re
+
+from django.db import connection, transaction
+
+from . import pagecache, search
+from .models import Book, BookCopy
+
+# 列名（英文字段名或中文表头）-> Book 字段
+COLUMNS = {
+    'isbn': 'isbn', 'ISBN': 'isbn',
+    'title': 'title', '书名': 'title',
+    'author': 'author', '作者': 'author',
+    'description': 'description', '简介': 'description',
+    'keywords': 'keywords', '关键字': 'keywords',
+    'recommended_age': 'recommended_age', '推荐年龄': 'recommended_age',
+    'copies_count': 'copies_count', '副本数量': 'copies_count',
+}
+UPDATE_FIELDS = ['title', 'author', 'description', 'keywords', 'recommended_age', 'copies_count']
+ISBN_RE = re.compile(r'^(?:\d{9}[\dX]|\d{13})$')
+
+
+def read_rows(fp, fmt):
+    """逐行读取 CSV 或 JSONL，产出 (行号, 字典)；JSONL 中无法解析的行产出 (行号, None)"""
+    if fmt == 'csv':
+        for number, row in enumerate(csv.DictReader(fp), start=2):
+            yield number, row
+        return
+    for number, line in enumerate(fp, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def normalize_isbn(value):
+    return re.sub(r'[\s-]', '', str(value or '')).upper()
+
+
+def clean_row(row):
+    """把一行数据转换为 Book 字段字典，数据无效时抛出 ValueError"""
+    if row is None:
+        raise ValueError('无法解析')
+    data = {}
+    for column, value in row.items():
+        field = COLUMNS.get((column or '').strip())
+        if field:
+            data[field] = value.strip() if isinstance(value, str) else value
+
+    isbn = normalize_isbn(data.get('isbn'))
+    if not ISBN_RE.match(isbn):
+        raise ValueError(f'ISBN 无效: {data.get("isbn")!r}')
+    if not data.get('title'):
+        raise ValueError('缺少书名')
+    try:
+        age = data.get('recommended_age')
+        copies = data.get('copies_count')
+        recommended_age = int(age) if age not in (None, '') else None
+        copies_count = int(copies) if copies not in (None, '') else 1
+    except (TypeError, ValueError):
+        raise ValueError('推荐年龄或副本数量不是整数')
+    if copies_count < 0:
+        raise ValueError('副本数量不能为负数')
+
+    return {
+        'isbn': isbn,
+        'title': str(data['title'])[:100],
+        'author': str(data.get('author') or '未知')[:100],
+        'description': str(data.get('description') or ''),
+        'keywords': str(data.get('keywords') or '')[:200],
+        'recommended_age': recommended_age,
+        'copies_count': copies_count,
+    }
+
+
+def upsert_batch(rows):
+    """在一个事务中按 ISBN 新增或更新一批图书，返回 (新建数, 更新数)
+
+    副本只增不减（与 Book.save 一致）：新图书按副本数量创建，
+    已有图书的副本数量调大时补足差额。批内重复的 ISBN 以最后一行为准。
+    不渲染封面，新图书在首次显示时才排队渲染。
+    """
+    rows = list({row['isbn']: row for row in rows}.values())
+    isbns = [row['isbn'] for row in rows]
+
+    with transaction.atomic():
+        existing = dict(Book.objects.filter(isbn__in=isbns).values_list('isbn', 'total_count'))
+        books = [
+            Book(total_count=row['copies_count'], available_count=row['copies_count'], **row)
+            if row['isbn'] not in existing else Book(**row)
+            for row in rows
+        ]
+        Book.objects.bulk_create(
+            books, batch_size=1000,
+            update_conflicts=True, update_fields=UPDATE_FIELDS,
+            # MySQL 的 ON DUPLICATE KEY UPDATE 不能指定冲突字段，按唯一索引判断
+            unique_fields=['isbn'] if connection.features.supports_update_conflicts_with_target else None,
+        )
+        # 不是所有数据库都会为 upsert 的对象回填主键，统一按 ISBN 查回
+        ids = dict(Book.objects.filter(isbn__in=isbns).values_list('isbn', 'id'))
+        for book in books:
+            book.pk = ids[book.isbn]
+
+        copies, grown = [], []
+        for book in books:
+            needed = book.copies_count - existing.get(book.isbn, 0)
+            if needed > 0:
+                copies.extend(BookCopy(book_id=book.pk) for _ in range(needed))
+                if book.isbn in existing:
+                    grown.append(book.pk)
+        BookCopy.objects.bulk_create(copies, batch_size=1000)
+        Book.objects.filter(pk__in=grown).refresh_counters()
+        search.index_books(books)
+        # 新图书尚无缓存片段，只需书目列表和已有图书失效
+        pagecache.invalidate_books([book.pk for book in books if book.isbn in existing])
+
+        created = sum(book.isbn not in existing for book in books)
+    return created, len(books) - created
@@ -0,0 +1,304 @@
+# library/circulation.py
+"""借阅/归还服务
+
+所有借还操作都通过带条件的 UPDATE 完成：只有当副本仍处于预期状态时才会被修改，
+因此并发请求不会把同一副本借给两位读者，也不需要先读出整行再 save()。
+每次成功的借还都会在同一事务中追加一条 LoanEvent；归还的副本优先分配给预约队首。
+"""
+from collections import namedtuple
+from contextlib import nullcontext
+
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from . import holds
+from .models import Book, BookCopy, Hold, LoanEvent
+
+DEFAULT_LOAN_DAYS = 7
+
+# 抢占候选副本的最大重试次数（候选被并发请求抢走时重试）
+MAX_CLAIM_ATTEMPTS = 5
+
+Loan = namedtuple('Loan', ['copy_id', 'due_date'])
+
+# 批量借还中单个副本的处理结果
+BORROWED = 'borrowed'
+RETURNED = 'returned'
+UNAVAILABLE = 'unavailable'
+NOT_BORROWED = 'not_borrowed'
+MISSING = 'missing'
+
+
+def get_due_date(days=DEFAULT_LOAN_DAYS):
+    """根据借阅天数计算应还日期"""
+    return timezone.localdate() + timezone.timedelta(days=days)
+
+
+def _adjust_available(copy_id, delta):
+    """在同一事务内调整副本所属图书的可借计数"""
+    Book.objects.filter(copies__pk=copy_id).update(available_count=F('available_count') + delta)
+
+
+def _book_id(copy_id, book_id=None):
+    """副本所属图书ID，调用方已知时省去一次查询"""
+    if book_id is None:
+        book_id = BookCopy.objects.filter(pk=copy_id).values_list('book_id', flat=True).get()
+    return book_id
+
+
+def _log_event(copy_id, user, action, book_id=None, due_date=None):
+    """追加借还事件"""
+    LoanEvent.objects.create(
+        action=action, book_id=_book_id(copy_id, book_id), copy_id=copy_id, user=user, due_date=due_date
+    )
+
+
+def _claim(copy_id, user, days, book_id=None):
+    """对单个副本执行条件更新，成功时返回 True"""
+    due_date = get_due_date(days)
+    with transaction.atomic():
+        claimed = BookCopy.objects.filter(pk=copy_id, is_available=True).update(
+            is_available=False,
+            borrower=user,
+            borrowed_date=timezone.localdate(),
+            due_date=due_date,
+        )
+        if claimed:
+            _adjust_available(copy_id, -1)
+            _log_event(copy_id, user, LoanEvent.BORROW, book_id, due_date)
+    return bool(claimed)
+
+
+def _claim_block():
+    """支持 SKIP LOCKED 的数据库在事务中锁定候选行；
+    SQLite 不支持行锁，在自动提交模式下依靠条件更新保证正确性，避免锁升级死锁"""
+    if connection.features.has_select_for_update_skip_locked:
+        return transaction.atomic()
+    return nullcontext()
+
+
+def borrow_available_copy(book_id, user, days=DEFAULT_LOAN_DAYS):
+    """为用户借出指定图书的任意一个可借副本
+
+    返回 Loan，没有可借副本时返回 None。
+    """
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        with _claim_block():
+            # 跳过已被其他事务锁定的行，不支持的数据库会忽略该子句
+            copy_id = (
+                BookCopy.objects
+                .select_for_update(skip_locked=True)
+                .filter(book_id=book_id, is_available=True)
+                .order_by('id')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if copy_id is None:
+                return None
+            if _claim(copy_id, user, days, book_id):
+                return Loan(copy_id, get_due_date(days))
+    return None
+
+
+def borrow_copy(copy_id, user, days=DEFAULT_LOAN_DAYS):
+    """借出指定副本，副本已被借出时返回 None"""
+    if _claim(copy_id, user, days):
+        return Loan(copy_id, get_due_date(days))
+    return None
+
+
+def borrow_held_copy(user, book_id=None, copy_id=None, days=DEFAULT_LOAN_DAYS):
+    """借出为该读者预约保留的副本（按图书或副本查找），没有待取书的预约时返回 None"""
+    held = Hold.objects.filter(user=user, status=Hold.READY)
+    if book_id is not None:
+        held = held.filter(book_id=book_id)
+    if copy_id is not None:
+        held = held.filter(copy_id=copy_id)
+    hold = held.order_by('id').values_list('id', 'copy_id', 'book_id').first()
+    if hold is None:
+        return None
+    hold_id, copy_id, book_id = hold
+    due_date = get_due_date(days)
+    with transaction.atomic():
+        if not Hold.objects.filter(pk=hold_id, status=Hold.READY).update(status=Hold.FULFILLED):
+            return None
+        # 保留中的副本已计为不可借，只需写入借阅者
+        BookCopy.objects.filter(pk=copy_id, is_available=False, borrower__isnull=True).update(
+            borrower=user,
+            borrowed_date=timezone.localdate(),
+            due_date=due_date,
+        )
+        _log_event(copy_id, user, LoanEvent.BORROW, book_id, due_date)
+    return Loan(copy_id, due_date)
+
+
+def return_copy(copy_id, user, book_id=None):
+    """归还用户借阅的指定副本，成功返回 True
+
+    有读者排队预约时副本直接保留给队首，不计入可借数量。
+    """
+    with transaction.atomic():
+        returned = (
+            BookCopy.objects
+            .filter(pk=copy_id, borrower=user, is_available=False)
+            .update(is_available=True, borrower=None, borrowed_date=None, due_date=None)
+        )
+        if returned:
+            book_id = _book_id(copy_id, book_id)
+            if holds.allocate_copy(copy_id, book_id) is not None:
+                BookCopy.objects.filter(pk=copy_id).update(is_available=False)
+            else:
+                _adjust_available(copy_id, 1)
+            _log_event(copy_id, user, LoanEvent.RETURN, book_id)
+    return bool(returned)
+
+
+def return_book_copy(book_id, user):
+    """归还用户借阅的该图书的一个副本，返回副本ID，未借阅时返回 None"""
+    copy_ids = (
+        BookCopy.objects
+        .filter(book_id=book_id, borrower=user)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    for copy_id in copy_ids[:MAX_CLAIM_ATTEMPTS]:
+        if return_copy(copy_id, user, book_id):
+            return copy_id
+    return None
+
+
+def _adjust_available_bulk(deltas):
+    """用一条 UPDATE 按 {图书ID: 增量} 调整多本图书的可借计数"""
+    deltas = {book_id: delta for book_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    Book.objects.filter(id__in=deltas).update(available_count=F('available_count') + Case(
+        *[When(id=book_id, then=Value(delta)) for book_id, delta in deltas.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    ))
+
+
+def _count_by_book(copy_ids, book_ids, sign=1):
+    deltas = {}
+    for copy_id in copy_ids:
+        deltas[book_ids[copy_id]] = deltas.get(book_ids[copy_id], 0) + sign
+    return deltas
+
+
+def _load_copies(copy_ids):
+    """一次读出副本状态：{副本ID: (图书ID, 是否可借, 借阅者ID)}"""
+    return {
+        copy_id: (book_id, is_available, borrower_id)
+        for copy_id, book_id, is_available, borrower_id in BookCopy.objects
+        .filter(id__in=copy_ids)
+        .values_list('id', 'book_id', 'is_available', 'borrower_id')
+    }
+
+
+def batch_borrow(copy_ids, user, days=DEFAULT_LOAN_DAYS):
+    """在一个事务中为同一读者借出多个副本（含为其预约保留的副本）
+
+    返回 ({副本ID: 处理结果}, 应还日期)，结果为 BORROWED / UNAVAILABLE / MISSING。
+    """
+    copy_ids = list(dict.fromkeys(copy_ids))
+    copies = _load_copies(copy_ids)
+    book_ids = {copy_id: row[0] for copy_id, row in copies.items()}
+    candidates = [copy_id for copy_id, (_, available, _) in copies.items() if available]
+    unassigned = [copy_id for copy_id, (_, available, borrower) in copies.items()
+                  if not available and borrower is None]
+    held = {}
+    if unassigned:
+        held = dict(
+            Hold.objects.filter(user=user, status=Hold.READY, copy_id__in=unassigned)
+            .values_list('copy_id', 'id')
+        )
+
+    today, due_date = timezone.localdate(), get_due_date(days)
+    loan_fields = {'borrower': user, 'borrowed_date': today, 'due_date': due_date}
+    with transaction.atomic():
+        claimed = set()
+        if candidates:
+            updated = BookCopy.objects.filter(id__in=candidates, is_available=True).update(
+                is_available=False, **loan_fields
+            )
+            claimed = set(candidates)
+            if updated < len(candidates):
+                # 部分副本被并发请求抢先借出，重新确认本次借到的副本
+                claimed = set(
+                    BookCopy.objects.filter(id__in=candidates, **loan_fields).values_list('id', flat=True)
+                )
+        fulfilled = set()
+        if held and Hold.objects.filter(id__in=held.values(), status=Hold.READY).update(status=Hold.FULFILLED):
+            fulfilled = set(held)
+            BookCopy.objects.filter(id__in=fulfilled, is_available=False, borrower__isnull=True).update(
+                **loan_fields
+            )
+        # 保留副本已计为不可借，只调整新借出副本的计数
+        _adjust_available_bulk(_count_by_book(claimed, book_ids, -1))
+        LoanEvent.objects.bulk_create([
+            LoanEvent(action=LoanEvent.BORROW, book_id=book_ids[copy_id], copy_id=copy_id,
+                      user=user, due_date=due_date)
+            for copy_id in claimed | fulfilled
+        ])
+
+    results = {}
+    for copy_id in copy_ids:
+        if copy_id not in copies:
+            results[copy_id] = MISSING
+        elif copy_id in claimed or copy_id in fulfilled:
+            results[copy_id] = BORROWED
+        else:
+            results[copy_id] = UNAVAILABLE
+    return results, due_date
+
+
+def batch_return(copy_ids, user):
+    """在一个事务中归还同一读者借阅的多个副本，有预约的图书把副本分配给队首
+
+    返回 {副本ID: 处理结果}，结果为 RETURNED / NOT_BORROWED / MISSING。
+    """
+    copy_ids = list(dict.fromkeys(copy_ids))
+    copies = _load_copies(copy_ids)
+    book_ids = {copy_id: row[0] for copy_id, row in copies.items()}
+    candidates = [copy_id for copy_id, (_, available, borrower) in copies.items()
+                  if not available and borrower == user.pk]
+
+    returned, reserved = set(), set()
+    with transaction.atomic():
+        if candidates:
+            updated = BookCopy.objects.filter(id__in=candidates, borrower=user, is_available=False).update(
+                is_available=True, borrower=None, borrowed_date=None, due_date=None
+            )
+            returned = set(candidates)
+            if updated < len(candidates):
+                returned = set(
+                    BookCopy.objects.filter(id__in=candidates, is_available=True, borrower__isnull=True)
+                    .values_list('id', flat=True)
+                )
+        if returned:
+            waiting = set(
+                Hold.objects.filter(book_id__in={book_ids[copy_id] for copy_id in returned}, status=Hold.WAITING)
+                .values_list('book_id', flat=True).distinct()
+            )
+            for copy_id in sorted(returned):
+                if book_ids[copy_id] in waiting and holds.allocate_copy(copy_id, book_ids[copy_id]) is not None:
+                    reserved.add(copy_id)
+            if reserved:
+                BookCopy.objects.filter(id__in=reserved).update(is_available=False)
+        _adjust_available_bulk(_count_by_book(returned - reserved, book_ids))
+        LoanEvent.objects.bulk_create([
+            LoanEvent(action=LoanEvent.RETURN, book_id=book_ids[copy_id], copy_id=copy_id, user=user)
+            for copy_id in returned
+        ])
+
+    results = {}
+    for copy_id in copy_ids:
+        if copy_id not in copies:
+            results[copy_id] = MISSING
+        elif copy_id in returned:
+            results[copy_id] = RETURNED
+        else:
+            results[copy_id] = NOT_BORROWED
+    return results
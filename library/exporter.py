@@ -0,0 +1,213 @@
+# library/exporter.py
+"""图书资源包导出
+
+按 bulk_upload_books 的资源包格式导出图书，导出的 ZIP 可直接重新导入：
+    <书名>/图书信息.json
+    <书名>/封面.<扩展名>
+    <书名>/轮播/<序号>.<扩展名>      图片标题记录在 图书信息.json 的 captions 中
+
+图片从存储按块复制进 ZIP，内存占用与图书数量无关。图片已是压缩格式，默认不再压缩（STORED）；
+开启压缩时，写入可定位的文件可用进程池并行压缩，压缩好的数据按原样写入 ZIP。
+导入不接受的旧格式图片（如 .bmp）转为 PNG 写入，重新导入时不会丢失。
+"""
+import json
+import os
+import time
+import zipfile
+import zlib
+from collections import namedtuple
+from io import BytesIO, RawIOBase
+
+from django.db.models import Prefetch
+from PIL import Image
+
+from .importer import GALLERY_DIR, IMAGE_EXTS, META_NAMES
+from .models import Book, BookImage
+
+CHUNK_SIZE = 1024 * 1024
+COMPRESS_LEVEL = 6
+
+# ZIP 中的一个条目：data 为内存中的字节（元数据），否则从 storage 读取 name，
+# transcode 表示读取时转为 PNG
+Entry = namedtuple('Entry', ['arcname', 'data', 'storage', 'name', 'transcode'], defaults=(False,))
+
+
+def book_metadata(book, captions):
+    """与导入时读取的字段一致的图书信息"""
+    return {
+        'author': book.author,
+        'description': book.description,
+        'keywords': book.keywords or '',
+        'recommended_age': book.recommended_age,
+        'copies_count': book.total_count,
+        'captions': captions,
+    }
+
+
+def folder_name(book, used):
+    """资源包中的图书目录名；书名即目录名，重名或含路径分隔符时加上图书ID区分"""
+    name = book.title.replace('/', '_').replace('\\', '_').strip() or f'图书{book.pk}'
+    if name in used:
+        name = f'{name}_{book.pk}'
+    used.add(name)
+    return name
+
+
+def export_queryset(queryset=None):
+    """导出用的图书查询集，轮播图一次性预取"""
+    queryset = Book.objects.all() if queryset is None else queryset
+    return queryset.order_by('id').prefetch_related(
+        Prefetch('images', queryset=BookImage.objects.only('id', 'book_id', 'image', 'caption', 'order'))
+    )
+
+
+def image_entry(arcname, file):
+    """图片条目；扩展名不在导入支持的格式中时转为 PNG"""
+    ext = os.path.splitext(file.name)[1].lower()
+    if ext.lstrip('.') in IMAGE_EXTS:
+        return Entry(f'{arcname}{ext}', None, file.storage, file.name)
+    return Entry(f'{arcname}.png', None, file.storage, file.name, True)
+
+
+def open_entry(entry):
+    """打开条目对应的图片，需要转码时返回内存中的 PNG"""
+    if not entry.transcode:
+        return entry.storage.open(entry.name, 'rb')
+    with entry.storage.open(entry.name, 'rb') as f:
+        img = Image.open(f)
+        img.load()
+    if img.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    buffer = BytesIO()
+    img.save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def iter_entries(books):
+    """逐本生成图书的 ZIP 条目：先元数据，再封面和轮播图"""
+    used = set()
+    for book in books:
+        folder = folder_name(book, used)
+        captions = {}
+        entries = []
+        if book.cover_image:
+            entries.append(image_entry(f'{folder}/封面', book.cover_image))
+        for index, image in enumerate(book.images.all()):
+            entry = image_entry(f'{folder}/{GALLERY_DIR}/{index:03d}', image.image)
+            captions[os.path.basename(entry.arcname)] = image.caption
+            entries.append(entry)
+        metadata = json.dumps(book_metadata(book, captions), ensure_ascii=False, indent=2).encode()
+        yield Entry(f'{folder}/{META_NAMES[0]}', metadata, None, None)
+        yield from entries
+
+
+def _zipinfo(arcname, compress):
+    zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+    zinfo.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    zinfo.external_attr = 0o644 << 16
+    return zinfo
+
+
+def _copy_entry(archive, entry, compress):
+    """把条目按块写入 ZIP，每写一块产出一次（供流式响应及时发送）"""
+    with archive.open(_zipinfo(entry.arcname, compress), 'w') as dest:
+        if entry.data is not None:
+            dest.write(entry.data)
+            yield
+            return
+        with open_entry(entry) as src:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                dest.write(chunk)
+                yield
+
+
+def compress_entry(entry):
+    """读取并压缩一个条目（在子进程中执行，不访问数据库），返回 (CRC, 原始大小, 压缩数据)"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    crc, size, parts = 0, 0, []
+    with open_entry(entry) as src:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    return crc, size, b''.join(parts)
+
+
+def _write_compressed(archive, arcname, crc, size, data):
+    """把子进程压缩好的数据原样写入 ZIP
+
+    zipfile 没有写入预压缩数据的接口：先按 STORED 写入，再改正条目信息并重写本地文件头。
+    文件头长度只取决于文件名和 zip64 标记（单个图片不会超过 4GB，不使用 zip64），
+    两次写入一致，只要求输出可定位。
+    """
+    zinfo = _zipinfo(arcname, False)
+    with archive.open(zinfo, 'w') as dest:
+        dest.write(data)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC, zinfo.file_size, zinfo.compress_size = crc, size, len(data)
+    archive.fp.seek(zinfo.header_offset)
+    archive.fp.write(zinfo.FileHeader(False))
+    archive.fp.seek(archive.start_dir)
+
+
+def write_archive(fp, books, compress=False, pool=None, window=32):
+    """把图书写入 ZIP（fp 须可定位以使用进程池），返回写入的图书数量
+
+    使用进程池时每次提交 window 个图片，内存占用以此为上限。
+    """
+    count = 0
+    with zipfile.ZipFile(fp, 'w', allowZip64=True) as archive:
+        entries = iter_entries(books)
+        pending = []
+
+        def flush():
+            for entry, (crc, size, data) in zip(pending, pool.map(compress_entry, pending)):
+                _write_compressed(archive, entry.arcname, crc, size, data)
+            pending.clear()
+
+        for entry in entries:
+            if entry.data is not None:
+                count += 1
+            if pool and compress and entry.data is None:
+                pending.append(entry)
+                if len(pending) >= window:
+                    flush()
+                continue
+            for _ in _copy_entry(archive, entry, compress):
+                pass
+        if pending:
+            flush()
+    return count
+
+
+class _StreamBuffer(RawIOBase):
+    """不可定位的写入缓冲，zipfile 会改用数据描述符，写入的数据可以边生成边发送"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_archive(books, compress=False):
+    """以生成器形式产出 ZIP 数据块，用于 StreamingHttpResponse"""
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for entry in iter_entries(books):
+            for _ in _copy_entry(archive, entry, compress):
+                data = buffer.pop()
+                if data:
+                    yield data
+    yield buffer.pop()
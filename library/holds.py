@@ -0,0 +1,127 @@
+# library/holds.py
+"""图书预约队列
+
+每本图书的等待中预约按ID先后排队（FIFO）。副本归还时通过一次索引查询取得队首、
+一次条件 UPDATE 完成分配，并发归还时被抢走的队首会重试下一位，不会把两个副本
+分配给同一预约；排队位置只统计排在前面的等待预约，不扫描整个队列。
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Book, BookCopy, Hold, User
+
+# 副本保留给预约读者的取书天数
+HOLD_PICKUP_DAYS = 3
+
+# 分配队首时被并发请求抢走后的最大重试次数
+MAX_ALLOCATE_ATTEMPTS = 5
+
+REAP_BATCH_SIZE = 500
+
+
+def active_hold(book_id, user):
+    """读者对该图书的有效预约（排队中或待取书），没有时返回 None"""
+    return Hold.objects.filter(book_id=book_id, user=user, status__in=Hold.ACTIVE_STATUSES).first()
+
+
+def place_hold(book_id, user):
+    """加入预约队列，返回 (预约, 是否新建)；已有有效预约时直接返回该预约
+
+    MySQL 不支持带条件的唯一约束，先锁定读者行再检查，同一读者的并发请求依次执行；
+    SQLite 不支持行锁，由部分唯一索引拦截重复预约。
+    """
+    hold = active_hold(book_id, user)
+    if hold is not None:
+        return hold, False
+    try:
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+            hold = active_hold(book_id, user)
+            if hold is not None:
+                return hold, False
+            return Hold.objects.create(book_id=book_id, user=user), True
+    except IntegrityError:
+        # 同一读者的并发请求已先创建了预约
+        return active_hold(book_id, user), False
+
+
+def queue_position(hold):
+    """排队位置（从1开始），待取书的预约返回0，已结束的预约返回 None"""
+    if hold.status == Hold.READY:
+        return 0
+    if hold.status != Hold.WAITING:
+        return None
+    ahead = Hold.objects.filter(book_id=hold.book_id, status=Hold.WAITING, id__lt=hold.id).count()
+    return ahead + 1
+
+
+def allocate_copy(copy_id, book_id):
+    """把空出的副本分配给队首预约，返回预约ID，队列为空时返回 None
+
+    需在释放副本的同一事务中调用，副本状态由调用方维护。
+    """
+    expires_at = timezone.now() + timezone.timedelta(days=HOLD_PICKUP_DAYS)
+    for _ in range(MAX_ALLOCATE_ATTEMPTS):
+        head = (
+            Hold.objects
+            .filter(book_id=book_id, status=Hold.WAITING)
+            .order_by('id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if head is None:
+            return None
+        if Hold.objects.filter(pk=head, status=Hold.WAITING).update(
+            status=Hold.READY, copy_id=copy_id, expires_at=expires_at
+        ):
+            return head
+    return None
+
+
+def release_copy(copy_id, book_id):
+    """预约保留的副本被放弃时，转给下一位预约读者，队列为空则恢复可借"""
+    if allocate_copy(copy_id, book_id) is not None:
+        return
+    released = BookCopy.objects.filter(
+        pk=copy_id, is_available=False, borrower__isnull=True
+    ).update(is_available=True)
+    if released:
+        Book.objects.filter(pk=book_id).update(available_count=F('available_count') + 1)
+
+
+def cancel_hold(hold_id, user):
+    """取消读者的有效预约，成功返回 True"""
+    hold = Hold.objects.filter(pk=hold_id, user=user, status__in=Hold.ACTIVE_STATUSES).first()
+    if hold is None:
+        return False
+    with transaction.atomic():
+        cancelled = Hold.objects.filter(pk=hold.pk, status=hold.status).update(status=Hold.CANCELLED)
+        if cancelled and hold.status == Hold.READY and hold.copy_id:
+            release_copy(hold.copy_id, hold.book_id)
+    return bool(cancelled)
+
+
+def reap_expired_holds(now=None, batch_size=REAP_BATCH_SIZE):
+    """分批回收逾期未取书的预约并释放其副本，返回回收数量"""
+    now = now or timezone.now()
+    reaped = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Hold.objects
+            .filter(status=Hold.READY, expires_at__lt=now, id__gt=last_id)
+            .order_by('id')
+            .values_list('id', 'copy_id', 'book_id')[:batch_size]
+        )
+        if not batch:
+            break
+        with transaction.atomic():
+            for hold_id, copy_id, book_id in batch:
+                # 条件更新：期间已被借出或取消的预约不会重复释放副本
+                if Hold.objects.filter(pk=hold_id, status=Hold.READY).update(status=Hold.EXPIRED):
+                    reaped += 1
+                    if copy_id:
+                        release_copy(copy_id, book_id)
+        last_id = batch[-1][0]
+    return reaped
@@ -0,0 +1,94 @@
+# library/idempotency.py
+"""借还请求的幂等键
+
+客户端在 POST 请求头中携带 Idempotency-Key，首次请求的响应按 (用户, 路径, 键)
+存入缓存并在 TTL 后自动淘汰；网络重试带着同一个键再次提交时直接返回缓存的响应，
+不会再次执行借还逻辑（例如扫码借阅的重试不会把刚借出的书又还回去）。
+同一个键的请求仍在处理时，重复请求返回 409。
+"""
+import hashlib
+import zlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# 处理中标记的有效期（秒），请求异常中断时标记会自动过期
+PENDING_TTL = 60
+PENDING = b'pending'
+
+# 超过该长度的响应体压缩后再缓存
+COMPRESS_THRESHOLD = 512
+
+
+def _cache():
+    return caches[settings.LIBRARY_IDEMPOTENCY_CACHE]
+
+
+def _cache_key(request, key):
+    digest = hashlib.sha256(f'{request.path}\0{key}'.encode()).hexdigest()[:32]
+    return f'idem:{request.user.pk or 0}:{digest}'
+
+
+def _fingerprint(request):
+    """请求体摘要，用于发现同一个键被用于不同的请求"""
+    return hashlib.blake2b(request.body, digest_size=8).digest()
+
+
+def _pack(fingerprint, response):
+    content = response.content
+    compressed = len(content) > COMPRESS_THRESHOLD
+    if compressed:
+        content = zlib.compress(content)
+    return (fingerprint, response.status_code, response.get('Content-Type'),
+            response.get('Location'), compressed, content)
+
+
+def _unpack(entry):
+    _, status, content_type, location, compressed, content = entry
+    if compressed:
+        content = zlib.decompress(content)
+    response = HttpResponse(content, status=status, content_type=content_type)
+    if location:
+        response['Location'] = location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """为 POST 视图启用 Idempotency-Key 重放；未携带该请求头时行为不变"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if request.method != 'POST' or not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({'success': False, 'error': f'{HEADER} 过长'}, status=400)
+
+        cache = _cache()
+        cache_key = _cache_key(request, key)
+        fingerprint = _fingerprint(request)
+        if not cache.add(cache_key, PENDING, PENDING_TTL):
+            entry = cache.get(cache_key)
+            if entry is None or entry == PENDING:
+                return JsonResponse({'success': False, 'error': '相同请求正在处理中'}, status=409)
+            if entry[0] != fingerprint:
+                return JsonResponse({'success': False, 'error': f'{HEADER} 已用于其他请求'}, status=422)
+            return _unpack(entry)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500 or response.streaming:
+            # 服务端错误允许客户端用同一个键重试
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, _pack(fingerprint, response), settings.LIBRARY_IDEMPOTENCY_TTL)
+        return response
+    return wrapper
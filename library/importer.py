@@ -0,0 +1,453 @@
+# library/importer.py
+"""图书资源包读取
+
+资源包（ZIP 或目录）中每本图书一个目录：
+    <书名>/图书信息.json      元数据（也可为 .txt，内容同为 JSON）
+    <书名>/封面.<jpg|jpeg|png|webp>
+    <书名>/轮播/<图片>          标题为文件名，或由元数据中的 captions（{文件名: 标题}）指定
+
+ZIP 包只遍历一次成员列表，按图书目录建立索引，之后的元数据、封面、轮播图查找都是字典查询；
+成员以流的方式交给存储后端写入，不把整个文件读入内存。
+
+导入分三步：prepare_book 解析元数据并校验图片（可在进程池中并行），
+store_book 把图片写入存储，import_batch 在一个事务中用 bulk_create 写入一批图书、副本和图片。
+
+每本图书导入后在 ImportManifest 中记录各文件的内容哈希，与图书写入同一事务提交。
+再次导入时内容未变的图书直接跳过，变化的图书只重新写入变化的图片；
+中断后重跑时已提交的批次全部命中清单，相当于从断点继续。
+
+开启 LIBRARY_IMAGE_NORMALIZE 时，图片在 prepare_book 中规范化（与后台上传相同的尺寸和格式），
+这一步最耗 CPU，使用进程池时在子进程中完成。
+"""
+import hashlib
+import json
+import os
+import zipfile
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from PIL import Image
+
+from . import pagecache, search, tasks
+from .models import Book, BookCopy, BookImage, ImportManifest
+from .utils import normalize_image
+
+META_NAMES = ('图书信息.json', '图书信息.txt')
+COVER_PREFIXES = ('封面', 'cover')
+IMAGE_EXTS = ('jpg', 'jpeg', 'png', 'webp')
+GALLERY_DIR = '轮播'
+
+# 资源包中的一个文件：相对图书目录的路径、字节数、打开函数（返回二进制文件对象）、
+# 无需读取内容即可得到的变化标识（ZIP 为 CRC32，目录为大小和修改时间），
+# 以及校验图片后得到的宽高
+Member = namedtuple('Member', ['name', 'size', 'open', 'stat', 'width', 'height'], defaults=(None, None))
+
+
+def is_image(name):
+    return name.rsplit('.', 1)[-1].lower() in IMAGE_EXTS if '.' in name else False
+
+
+class BookSource:
+    """资源包中的一本图书，子类提供 members（相对路径 -> Member）"""
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def members(self):
+        raise NotImplementedError
+
+    def metadata(self):
+        for meta_name in META_NAMES:
+            member = self.members.get(meta_name)
+            if member:
+                with member.open() as f:
+                    return json.load(f)
+        return None
+
+    def cover(self):
+        for ext in IMAGE_EXTS:
+            for prefix in COVER_PREFIXES:
+                member = self.members.get(f'{prefix}.{ext}')
+                if member:
+                    return member
+        return None
+
+    def gallery(self):
+        """轮播图片，按文件名排序"""
+        prefix = GALLERY_DIR + '/'
+        return [
+            self.members[name] for name in sorted(self.members)
+            if name.startswith(prefix) and '/' not in name[len(prefix):] and is_image(name)
+        ]
+
+    def has_gallery(self):
+        return any(name.startswith(GALLERY_DIR + '/') for name in self.members)
+
+
+class ZipBookSource(BookSource):
+    def __init__(self, archive, name, infos):
+        super().__init__(name)
+        self._members = {
+            relpath: Member(
+                relpath, info.file_size, lambda info=info: archive.open(info),
+                f'crc32:{info.CRC:08x}:{info.file_size}',
+            )
+            for relpath, info in infos.items()
+        }
+
+    @property
+    def members(self):
+        return self._members
+
+
+class DirBookSource(BookSource):
+    def __init__(self, path, name):
+        super().__init__(name)
+        self.path = path
+        self._members = None
+
+    @property
+    def members(self):
+        if self._members is None:
+            # 每本书只列一次目录
+            self._members = {}
+            for root, _, files in os.walk(self.path):
+                rel_root = os.path.relpath(root, self.path)
+                for filename in files:
+                    full_path = os.path.join(root, filename)
+                    relpath = filename if rel_root == '.' else f'{rel_root.replace(os.sep, "/")}/{filename}'
+                    stat = os.stat(full_path)
+                    self._members[relpath] = Member(
+                        relpath, stat.st_size,
+                        lambda full_path=full_path: open(full_path, 'rb'),
+                        f'{stat.st_size}:{stat.st_mtime_ns}',
+                    )
+        return self._members
+
+
+def index_zip(archive):
+    """遍历一次 ZIP 成员列表，返回 {图书目录名: {相对路径: ZipInfo}}（保持包内顺序）"""
+    books = {}
+    for info in archive.infolist():
+        book_name, sep, relpath = info.filename.partition('/')
+        if not sep or not book_name:
+            continue  # 顶层文件不属于任何图书
+        files = books.setdefault(book_name, {})
+        if relpath and not info.is_dir():
+            files[relpath] = info
+    return books
+
+
+@contextmanager
+def open_source(path):
+    """打开 ZIP 包或目录，返回 BookSource 迭代器；路径无效时抛出 ValueError"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            index = index_zip(archive)
+            yield (ZipBookSource(archive, name, infos) for name, infos in index.items())
+    elif os.path.isdir(path):
+        yield (
+            DirBookSource(entry.path, entry.name)
+            for entry in sorted(os.scandir(path), key=lambda entry: entry.name)
+            if entry.is_dir()
+        )
+    else:
+        raise ValueError(f'无效的源路径: {path}')
+
+
+@contextmanager
+def member_file(member, name=None):
+    """把资源包成员包装为可直接交给存储后端的 File，按块流式读取
+
+    预先给出文件大小，避免 File.size 为求大小而把 ZIP 成员整个解压一遍。
+    """
+    with member.open() as fp:
+        f = File(fp, name=name or os.path.basename(member.name))
+        f.size = member.size
+        yield f
+
+
+def member_hash(member, previous=None):
+    """成员内容哈希：ZIP 直接使用 CRC32；目录文件大小和修改时间未变时沿用上次的哈希"""
+    if member.stat.startswith('crc32:'):
+        return member.stat
+    if previous and previous[0] == member.stat:
+        return previous[1]
+    digest = hashlib.sha1()
+    with member.open() as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def book_digest(hashes):
+    """整本图书的摘要：所有成员路径和哈希"""
+    digest = hashlib.sha1()
+    for relpath in sorted(hashes):
+        digest.update(f'{relpath}\0{hashes[relpath]}\n'.encode())
+    return digest.hexdigest()
+
+
+def manifest_entries(names):
+    """读取一批图书的导入清单，返回 {书名: {'digest', 'members', 'images'}}"""
+    return {
+        name: {'digest': digest, 'members': members, 'images': images}
+        for name, digest, members, images in ImportManifest.objects
+        .filter(name__in=names)
+        .values_list('name', 'digest', 'members', 'images')
+    }
+
+
+# 解析后的图书。cover 为 (相对路径, 成员) ，gallery 为 [(相对路径, 成员), ...]，
+# 成员为 None 表示内容未变沿用已导入的文件；gallery 为 None 表示资源包中没有轮播目录。
+# members 为写入清单的 {相对路径: [变化标识, 哈希]}，unchanged 表示整本书无需处理。
+PreparedBook = namedtuple('PreparedBook', [
+    'name', 'metadata', 'cover', 'gallery', 'size', 'digest', 'members', 'images', 'unchanged',
+])
+
+# 图片已写入存储的图书：cover 为 (新的存储路径, 宽, 高)（None 表示不更新），
+# gallery 为 [(相对路径, 新的存储路径或 None, 标题, 宽, 高), ...]
+StoredBook = namedtuple('StoredBook', [
+    'name', 'metadata', 'cover', 'gallery', 'digest', 'members', 'images',
+])
+
+
+class MemoryMember(namedtuple('MemoryMember', ['name', 'data', 'width', 'height'], defaults=(None, None))):
+    """已读入内存的成员，可在进程间传递"""
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    def open(self):
+        return BytesIO(self.data)
+
+
+def _check_image(member, data=None):
+    """确认图片可以解码并返回宽高，损坏的文件只导致所在图书失败"""
+    with (BytesIO(data) if data is not None else member.open()) as f:
+        try:
+            img = Image.open(f)
+            img.verify()
+            return img.size
+        except Exception as e:
+            raise ValueError(f'图片 {member.name} 无法识别: {e}')
+
+
+def _normalize(member):
+    """规范化图片，返回换上新扩展名的 MemoryMember"""
+    with member.open() as f:
+        try:
+            normalized = normalize_image(f)
+        except Exception as e:
+            raise ValueError(f'图片 {member.name} 无法识别: {e}')
+    name = f'{os.path.splitext(member.name)[0]}.{normalized.ext}'
+    return MemoryMember(name, normalized.data, normalized.width, normalized.height)
+
+
+def prepare_book(book_source, overwrite=False, in_memory=False, previous=None):
+    """解析一本图书，返回 PreparedBook
+
+    previous 为该书上次导入的清单项，内容未变的图片不会被读取和重新写入。
+    in_memory 时把需要写入的图片读入内存（供跨进程传递），规范化后的图片总在内存中。
+    """
+    previous = previous or {'digest': None, 'members': {}, 'images': {}}
+    members = {
+        relpath: [member.stat, member_hash(member, previous['members'].get(relpath))]
+        for relpath, member in book_source.members.items()
+    }
+    digest = book_digest({relpath: value[1] for relpath, value in members.items()})
+    if digest == previous['digest']:
+        return PreparedBook(book_source.name, None, None, None, 0, digest, members, previous['images'], True)
+
+    metadata = book_source.metadata()
+    if not metadata and not overwrite:
+        raise ValueError('无元数据且不覆盖已存在图书')
+
+    def changed(member, kept_ids=None):
+        old = previous['members'].get(member.name)
+        if old is None or old[1] != members[member.name][1]:
+            return True
+        return kept_ids is not None and member.name not in kept_ids
+
+    size = 0
+
+    def load(member):
+        nonlocal size
+        size += member.size
+        if settings.LIBRARY_IMAGE_NORMALIZE:
+            return _normalize(member)
+        if in_memory:
+            with member.open() as f:
+                data = f.read()
+            return MemoryMember(member.name, data, *_check_image(member, data))
+        return member._replace(**dict(zip(('width', 'height'), _check_image(member))))
+
+    cover = book_source.cover()
+    if cover:
+        cover = (cover.name, load(cover) if changed(cover) else None)
+    gallery = None
+    if book_source.has_gallery():
+        gallery = [
+            (member.name, load(member) if changed(member, previous['images']) else None)
+            for member in book_source.gallery()
+        ]
+    return PreparedBook(
+        book_source.name, metadata or {}, cover, gallery, size, digest, members, previous['images'], False,
+    )
+
+
+# 进程池中每个子进程打开一次资源包，之后按书名取图书
+_worker_sources = None
+_worker_stack = None
+_worker_overwrite = False
+
+
+def init_worker(path, overwrite):
+    global _worker_sources, _worker_stack, _worker_overwrite
+    _worker_stack = ExitStack()
+    sources = _worker_stack.enter_context(open_source(path))
+    _worker_sources = {source.name: source for source in sources}
+    _worker_overwrite = overwrite
+
+
+def prepare_in_worker(name, previous=None):
+    """子进程入口：返回 (书名, PreparedBook 或 None, 错误信息)"""
+    try:
+        return name, prepare_book(_worker_sources[name], _worker_overwrite, True, previous), None
+    except Exception as e:
+        return name, None, str(e)
+
+
+def store_book(prepared):
+    """把新增或变化的封面和轮播图写入存储，返回 StoredBook"""
+    cover = None
+    if prepared.cover and prepared.cover[1]:
+        member = prepared.cover[1]
+        ext = os.path.splitext(member.name)[1]
+        field = Book._meta.get_field('cover_image')
+        with member_file(member, f'{prepared.name}_cover{ext}') as f:
+            cover = (field.storage.save(field.generate_filename(None, f.name), f), member.width, member.height)
+
+    gallery = None
+    if prepared.gallery is not None:
+        field = BookImage._meta.get_field('image')
+        # 图片标题默认取文件名，图书信息中的 captions 可按文件名指定（导出的资源包使用）
+        captions = prepared.metadata.get('captions') or {}
+        gallery = []
+        for relpath, member in prepared.gallery:
+            name = width = height = None
+            if member:
+                with member_file(member) as f:
+                    name = field.storage.save(field.generate_filename(None, f.name), f)
+                width, height = member.width, member.height
+            filename = os.path.basename(relpath)
+            caption = captions.get(filename, os.path.splitext(filename)[0])
+            gallery.append((relpath, name, caption, width, height))
+    return StoredBook(
+        prepared.name, prepared.metadata, cover, gallery, prepared.digest, prepared.members, prepared.images,
+    )
+
+
+def import_batch(stored_books):
+    """在一个事务中写入一批图书及其导入清单，返回 (新建数, 更新数)
+
+    新图书连同副本、轮播图、检索索引一起批量插入，不逐本调用 Book.save()；
+    已存在的图书（按书名）只更新变化的封面和轮播图。封面衍生图和文字封面在提交后由后台任务生成。
+    """
+    existing = {}
+    for book in Book.objects.filter(title__in=[stored.name for stored in stored_books]).order_by('id'):
+        existing.setdefault(book.title, book)
+
+    new_books, updated_books, changed_images, reordered = [], [], [], []
+    kept_ids, replaced_books = [], []
+    for stored in stored_books:
+        book = existing.get(stored.name)
+        if book is None:
+            metadata = stored.metadata
+            copies = metadata.get('copies_count', 1)
+            book = Book(
+                title=stored.name,
+                author=metadata.get('author', '未知'),
+                description=metadata.get('description', ''),
+                keywords=metadata.get('keywords', ''),
+                recommended_age=metadata.get('recommended_age'),
+                copies_count=copies,
+                total_count=copies,
+                available_count=copies,
+            )
+            new_books.append(book)
+            existing[stored.name] = book
+        elif stored.gallery is not None:
+            replaced_books.append(book.pk)
+        if stored.cover:
+            book.cover_image, book.cover_width, book.cover_height = stored.cover
+            if book.pk:
+                updated_books.append(book)
+        for order, (relpath, name, caption, width, height) in enumerate(stored.gallery or []):
+            if name is None:
+                # 内容未变的图片保留原记录，只在顺序变化时更新
+                image = BookImage(id=stored.images[relpath], book=book, caption=caption, order=order)
+                kept_ids.append(image.id)
+                reordered.append(image)
+            else:
+                changed_images.append((stored, relpath, BookImage(
+                    book=book, image=name, caption=caption, order=order, width=width, height=height,
+                )))
+
+    with transaction.atomic():
+        Book.objects.bulk_create(new_books)
+        # 不是所有数据库都会为批量插入的对象回填主键，按书名查回后再作为副本、图片、清单的外键
+        missing = [book for book in new_books if book.pk is None]
+        if missing:
+            ids = dict(
+                Book.objects.filter(title__in=[book.title for book in missing])
+                .values_list('title', 'id')
+            )
+            for book in missing:
+                book.pk = ids[book.title]
+        Book.objects.bulk_update(updated_books, ['cover_image', 'cover_width', 'cover_height'])
+        BookCopy.objects.bulk_create(
+            [BookCopy(book=book) for book in new_books for _ in range(book.copies_count)],
+            batch_size=1000,
+        )
+        BookImage.objects.filter(book__in=replaced_books).exclude(id__in=kept_ids).delete()
+        BookImage.objects.bulk_update(reordered, ['order'], batch_size=1000)
+        BookImage.objects.bulk_create([image for _, _, image in changed_images], batch_size=1000)
+        if new_books:
+            search.index_books(new_books)
+
+        images = {stored.name: {} for stored in stored_books}
+        for stored in stored_books:
+            for relpath, name, *_ in stored.gallery or []:
+                if name is None:
+                    images[stored.name][relpath] = stored.images[relpath]
+        for stored, relpath, image in changed_images:
+            if image.pk:  # 不支持批量插入返回主键的数据库下次导入时整体替换
+                images[stored.name][relpath] = image.pk
+        ImportManifest.objects.bulk_create(
+            [
+                ImportManifest(
+                    name=stored.name, book=existing[stored.name], digest=stored.digest,
+                    members=stored.members, images=images[stored.name],
+                )
+                for stored in stored_books
+            ],
+            update_conflicts=True,
+            # MySQL 的 ON DUPLICATE KEY UPDATE 不能指定冲突字段
+            unique_fields=['name'] if connection.features.supports_update_conflicts_with_target else None,
+            update_fields=['book', 'digest', 'members', 'images', 'updated_at'],
+        )
+        # 批量写入不触发信号，手动使书目列表和已有图书的页面片段失效
+        pagecache.invalidate_books([book.pk for book in updated_books] + replaced_books)
+        for book in new_books + updated_books:
+            if book.cover_image:
+                tasks.defer(tasks.build_cover_derivatives, book.cover_image.name)
+            else:
+                tasks.defer(tasks.render_book_cover, book.pk)
+    return len(new_books), len(updated_books)
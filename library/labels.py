@@ -0,0 +1,166 @@
+# library/labels.py
+"""二维码标签页
+
+把大量副本的二维码标签排版到A4页面上，逐页渲染并以流的方式输出多页PDF，
+任何时刻内存中只保留一页图像，适合一次打印成千上万个标签。
+"""
+import zlib
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .models import BookCopy
+from .utils import get_font, get_qr_image
+
+# A4 @ 200 DPI
+PAGE_SIZE = (1654, 2339)
+PAGE_POINTS = (595.28, 841.89)
+MARGIN = 60
+COLUMNS = 3
+ROWS = 8
+LABELS_PER_PAGE = COLUMNS * ROWS
+TITLE_MAX_CHARS = 12
+
+
+def _label_font(size):
+    try:
+        return get_font(size)
+    except ValueError:
+        # 缺少中文字体时退回默认字体，保证标签仍可打印
+        return ImageFont.load_default(size)
+
+
+def iter_label_pages(copies):
+    """按页生成标签图像（灰度），copies 为包含 id 和 book.title 的副本可迭代对象"""
+    cell_width = (PAGE_SIZE[0] - 2 * MARGIN) // COLUMNS
+    cell_height = (PAGE_SIZE[1] - 2 * MARGIN) // ROWS
+    qr_size = cell_height - 20
+    title_font = _label_font(28)
+    id_font = _label_font(24)
+
+    page, draw, index = None, None, 0
+    for copy in copies:
+        if index == 0:
+            page = Image.new('L', PAGE_SIZE, 255)
+            draw = ImageDraw.Draw(page)
+        left = MARGIN + (index % COLUMNS) * cell_width
+        top = MARGIN + (index // COLUMNS) * cell_height
+
+        qr = Image.open(BytesIO(get_qr_image(copy.id))).convert('L')
+        page.paste(qr.resize((qr_size, qr_size), Image.NEAREST), (left + 10, top + 10))
+
+        title = copy.book.title
+        if len(title) > TITLE_MAX_CHARS:
+            title = title[:TITLE_MAX_CHARS] + '…'
+        text_left = left + qr_size + 20
+        draw.text((text_left, top + qr_size // 3), title, fill=0, font=title_font)
+        draw.text((text_left, top + qr_size // 3 + 50), f'副本ID: {copy.id}', fill=60, font=id_font)
+        draw.rectangle(
+            (left, top, left + cell_width - 1, top + cell_height - 1), outline=200
+        )
+
+        index += 1
+        if index == LABELS_PER_PAGE:
+            yield page
+            index = 0
+    if index:
+        yield page
+
+
+class StreamingPdfWriter:
+    """最小化的流式PDF写入器：每页为一张整页灰度图像，页对象写出后即释放"""
+
+    CATALOG, PAGES = 1, 2
+
+    def __init__(self):
+        self.offsets = {}
+        self.position = 0
+        self.next_object = 3
+        self.page_objects = []
+
+    def _emit(self, data):
+        self.position += len(data)
+        return data
+
+    def _object(self, number, body, stream=None):
+        self.offsets[number] = self.position
+        data = f'{number} 0 obj\n'.encode() + body
+        if stream is not None:
+            data += b'\nstream\n' + stream + b'\nendstream'
+        return self._emit(data + b'\nendobj\n')
+
+    def _allocate(self):
+        number = self.next_object
+        self.next_object += 1
+        return number
+
+    def header(self):
+        return self._emit(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def page(self, image):
+        """写出一页，返回该页的PDF字节"""
+        image_obj, content_obj, page_obj = self._allocate(), self._allocate(), self._allocate()
+        self.page_objects.append(page_obj)
+        pixels = zlib.compress(image.tobytes(), 6)
+        width, height = image.size
+        content = f'q {PAGE_POINTS[0]} 0 0 {PAGE_POINTS[1]} 0 0 cm /Im0 Do Q'.encode()
+        return b''.join([
+            self._object(image_obj, (
+                f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                f'/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode '
+                f'/Length {len(pixels)} >>'
+            ).encode(), pixels),
+            self._object(content_obj, f'<< /Length {len(content)} >>'.encode(), content),
+            self._object(page_obj, (
+                f'<< /Type /Page /Parent {self.PAGES} 0 R '
+                f'/MediaBox [0 0 {PAGE_POINTS[0]} {PAGE_POINTS[1]}] '
+                f'/Resources << /XObject << /Im0 {image_obj} 0 R >> >> '
+                f'/Contents {content_obj} 0 R >>'
+            ).encode()),
+        ])
+
+    def finish(self):
+        """写出页面树、目录和交叉引用表"""
+        kids = ' '.join(f'{number} 0 R' for number in self.page_objects)
+        data = self._object(
+            self.PAGES, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_objects)} >>'.encode()
+        )
+        data += self._object(self.CATALOG, f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>'.encode())
+
+        xref_offset = self.position
+        lines = [f'xref\n0 {self.next_object}\n', '0000000000 65535 f \n']
+        lines += [f'{self.offsets[number]:010d} 00000 n \n' for number in range(1, self.next_object)]
+        lines.append(f'trailer\n<< /Size {self.next_object} /Root {self.CATALOG} 0 R >>\n')
+        lines.append(f'startxref\n{xref_offset}\n%%EOF\n')
+        return data + self._emit(''.join(lines).encode())
+
+
+def stream_label_pdf(copies):
+    """以字节块的形式逐页生成标签PDF"""
+    writer = StreamingPdfWriter()
+    yield writer.header()
+    for page in iter_label_pages(copies):
+        yield writer.page(page)
+    yield writer.finish()
+
+
+def select_copies(book_id=None, start=None, end=None):
+    """按图书ID和/或副本ID范围（含两端）筛选副本"""
+    copies = BookCopy.objects.all()
+    if book_id is not None:
+        copies = copies.filter(book_id=book_id)
+    if start is not None:
+        copies = copies.filter(id__gte=start)
+    if end is not None:
+        copies = copies.filter(id__lte=end)
+    return copies
+
+
+def label_copies(queryset):
+    """标签所需的副本查询：只取副本ID和书名，按ID分块读取"""
+    return (
+        queryset.select_related('book')
+        .only('id', 'book__title')
+        .order_by('id')
+        .iterator(chunk_size=LABELS_PER_PAGE * 20)
+    )
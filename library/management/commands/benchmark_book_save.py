@@ -0,0 +1,41 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from library.models import Book
+from library.utils import generate_book_cover, get_font
+
+class Command(BaseCommand):
+    help = '对比封面同步渲染与延后渲染时 Book.save 的耗时（测试数据会回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-n', '--iterations',
+            type=int,
+            default=20,
+            help='每种方式保存的图书数量'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+
+        def inline_save(i):
+            # 改造前：保存时每次重新加载字体并同步渲染A4封面
+            get_font.cache_clear()
+            img = generate_book_cover(title=f'基准测试{i}', author='基准')
+            img.save(os.devnull, 'PNG')
+            Book.objects.create(title=f'基准测试{i}', author='基准', description='', cover_image='book_covers/benchmark.png')
+
+        def deferred_save(i):
+            # 改造后：保存只写数据库，封面在提交后由后台任务渲染
+            Book.objects.create(title=f'基准测试{i}', author='基准', description='')
+
+        for label, save in (('同步渲染', inline_save), ('延后渲染', deferred_save)):
+            with transaction.atomic():
+                started = time.perf_counter()
+                for i in range(iterations):
+                    save(i)
+                elapsed = time.perf_counter() - started
+                # 回滚测试数据，提交回调（后台渲染）不会执行
+                transaction.set_rollback(True)
+            self.stdout.write(f'{label}: 平均每次保存 {elapsed / iterations * 1000:.1f} ms')
@@ -1,10 +1,8 @@
-import os
-import json
-import zipfile
-from pathlib import Path
+import time
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
 from django.core.management.base import BaseCommand
-from django.core.files import File
-from library.models import Book, BookImage
+from library import importer, tasks
 
 class Command(BaseCommand):
     help = '批量上传图书资源（ZIP包或目录）'
@@ -12,163 +10,123 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('source', type=str, help='ZIP文件路径或目录路径')
         parser.add_argument('--overwrite', action='store_true', help='覆盖已存在的图书')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='并行解析和校验图片的进程数'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='忽略导入清单，重新导入全部图书和图片'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='每个事务写入的图书数量'
+        )
 
     def handle(self, *args, **options):
         source = options['source']
         overwrite = options['overwrite']
-
-        if zipfile.is_zipfile(source):
-            self.process_zip(source, overwrite)
-        elif os.path.isdir(source):
-            self.process_dir(source, overwrite)
-        else:
-            self.stdout.write(self.style.ERROR(f'无效的源路径: {source}'))
-
-    def process_zip(self, zip_path, overwrite):
-        with zipfile.ZipFile(zip_path) as z:
-            book_dirs = [name for name in z.namelist() 
-                        if name.endswith('/') and name.count('/') == 1]
-            
-            for book_dir in book_dirs:
-                book_name = book_dir.strip('/')
-                try:
-                    self.process_book_in_zip(z, book_dir, book_name, overwrite)
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'处理 {book_name} 失败: {str(e)}'))
-
-    def process_dir(self, dir_path, overwrite):
-        for entry in os.scandir(dir_path):
-            if entry.is_dir():
-                book_name = entry.name
-                try:
-                    self.process_book_in_dir(entry.path, book_name, overwrite)
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'处理 {book_name} 失败: {str(e)}'))
-
-    def process_book_in_zip(self, zipfile, book_dir, book_name, overwrite):
-        # 处理元数据
-        metadata = self._get_metadata_from_zip(zipfile, book_dir)
-        if not metadata and not overwrite:
-            raise Exception('无元数据且不覆盖已存在图书')
-
-        # 创建或获取图书
-        book, created = Book.objects.get_or_create(
-            title=book_name,
-            defaults={
-                'author': metadata.get('author', '未知'),
-                'description': metadata.get('description', ''),
-                'keywords': metadata.get('keywords', ''),
-                'recommended_age': metadata.get('recommended_age'),
-                'copies_count': metadata.get('copies_count', 1)
-            }
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        full = options['full']
+
+        self.success_count = 0
+        self.error_count = 0
+        self.skipped_count = 0
+        self.bytes_read = 0
+        started = time.perf_counter()
+
+        pool = None
+        try:
+            with importer.open_source(source) as books:
+                if workers > 1:
+                    # 子进程只读取资源包，不使用数据库
+                    pool = tasks.process_pool(workers, importer.init_worker, (source, overwrite))
+                while True:
+                    batch = list(islice(books, batch_size))
+                    if not batch:
+                        break
+                    # 上次导入的清单，内容未变的图书和图片不再处理
+                    names = [book.name for book in batch]
+                    manifest = {} if full else importer.manifest_entries(names)
+                    previous = [manifest.get(name) for name in names]
+                    results = None
+                    if pool:
+                        try:
+                            results = list(pool.map(importer.prepare_in_worker, names, previous))
+                        except BrokenProcessPool as e:
+                            # 子进程无法启动或异常退出时改为在当前进程处理
+                            self.stdout.write(self.style.WARNING(f'进程池不可用，改为单进程处理: {e}'))
+                            pool.shutdown()
+                            pool = None
+                    if results is None:
+                        results = (self.prepare(book, overwrite, prev) for book, prev in zip(batch, previous))
+                    prepared = []
+                    for name, book, error in results:
+                        if error:
+                            self.fail(name, error)
+                        elif book.unchanged:
+                            self.skipped_count += 1
+                        else:
+                            prepared.append(book)
+                    self.commit(prepared)
+        except ValueError as e:
+            self.stdout.write(self.style.ERROR(str(e)))
+            return
+        finally:
+            if pool:
+                pool.shutdown()
+
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        megabytes = self.bytes_read / (1024 * 1024)
+        self.stdout.write('\n' + '=' * 50)
+        self.stdout.write(
+            f'成功: {self.success_count}，失败: {self.error_count}，未变化跳过: {self.skipped_count}'
         )
-
-        # 处理封面
-        cover_ext = self._get_image_ext_in_zip(zipfile, book_dir, prefix='封面')
-        if cover_ext:
-            cover_path = f"{book_dir}封面.{cover_ext}"
-            book.cover_image.save(
-                f"{book_name}_cover.{cover_ext}",
-                File(zipfile.open(cover_path)),
-                save=False
-            )
-
-        # 处理轮播图片
-        gallery_dir = f"{book_dir}轮播/"
-        if any(name.startswith(gallery_dir) for name in zipfile.namelist()):
-            self._process_gallery_in_zip(zipfile, gallery_dir, book)
-
-        book.save()
-        self.stdout.write(self.style.SUCCESS(f'成功处理: {book_name}'))
-
-    def process_book_in_dir(self, book_path, book_name, overwrite):
-        # 处理元数据
-        metadata = self._get_metadata_from_dir(book_path)
-        if not metadata and not overwrite:
-            raise Exception('无元数据且不覆盖已存在图书')
-
-        # 创建或获取图书
-        book, created = Book.objects.get_or_create(
-            title=book_name,
-            defaults={
-                'author': metadata.get('author', '未知'),
-                'description': metadata.get('description', ''),
-                'keywords': metadata.get('keywords', ''),
-                'recommended_age': metadata.get('recommended_age'),
-                'copies_count': metadata.get('copies_count', 1)
-            }
+        self.stdout.write(
+            f'读取 {megabytes:.1f} MB，耗时 {elapsed:.1f} 秒，'
+            f'{self.success_count / elapsed:.1f} 本/秒，{megabytes / elapsed:.1f} MB/秒'
         )
 
-        # 处理封面
-        cover_path = self._find_cover_in_dir(book_path)
-        if cover_path:
-            with open(cover_path, 'rb') as f:
-                book.cover_image.save(
-                    f"{book_name}_cover{os.path.splitext(cover_path)[1]}",
-                    File(f),
-                    save=False
-                )
-
-        # 处理轮播图片
-        gallery_dir = os.path.join(book_path, '轮播')
-        if os.path.exists(gallery_dir):
-            self._process_gallery_in_dir(gallery_dir, book)
-
-        book.save()
-        self.stdout.write(self.style.SUCCESS(f'成功处理: {book_name}'))
-
-    def _get_metadata_from_zip(self, zipfile, book_dir):
-        for ext in ['.json', '.txt']:
-            meta_path = f"{book_dir}图书信息{ext}"
-            if meta_path in zipfile.namelist():
-                with zipfile.open(meta_path) as f:
-                    return json.load(f)
-        return None
-
-    def _get_metadata_from_dir(self, book_path):
-        for ext in ['.json', '.txt']:
-            meta_path = os.path.join(book_path, f'图书信息{ext}')
-            if os.path.exists(meta_path):
-                with open(meta_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        return None
-
-    def _get_image_ext_in_zip(self, zipfile, book_dir, prefix='封面'):
-        for ext in ['jpg', 'jpeg', 'png', 'webp']:
-            if f"{book_dir}{prefix}.{ext}" in zipfile.namelist():
-                return ext
-        return None
-
-    def _find_cover_in_dir(self, book_path):
-        for ext in ['jpg', 'jpeg', 'png', 'webp']:
-            for prefix in ['封面', 'cover']:
-                cover_path = os.path.join(book_path, f'{prefix}.{ext}')
-                if os.path.exists(cover_path):
-                    return cover_path
-        return None
-
-    def _process_gallery_in_zip(self, zipfile, gallery_dir, book):
-        BookImage.objects.filter(book=book).delete()
-        gallery_files = [name for name in zipfile.namelist() 
-                        if name.startswith(gallery_dir) and not name.endswith('/')]
-        
-        for i, img_path in enumerate(gallery_files):
-            BookImage.objects.create(
-                book=book,
-                image=File(zipfile.open(img_path)),
-                caption=os.path.basename(img_path).split('.')[0],
-                order=i
-            )
+    def prepare(self, book_source, overwrite, previous):
+        try:
+            return book_source.name, importer.prepare_book(book_source, overwrite, previous=previous), None
+        except Exception as e:
+            return book_source.name, None, str(e)
+
+    def fail(self, name, error):
+        self.error_count += 1
+        self.stdout.write(self.style.ERROR(f'处理 {name} 失败: {error}'))
+
+    def commit(self, prepared):
+        """写入图片并在一个事务中提交整批图书；整批失败时逐本重试以定位出错的图书"""
+        stored = []
+        for book in prepared:
+            try:
+                stored.append(importer.store_book(book))
+                self.bytes_read += book.size
+            except Exception as e:
+                self.fail(book.name, str(e))
+        if not stored:
+            return
+
+        try:
+            importer.import_batch(stored)
+            done = stored
+        except Exception:
+            done = []
+            for book in stored:
+                try:
+                    importer.import_batch([book])
+                    done.append(book)
+                except Exception as e:
+                    self.fail(book.name, str(e))
 
-    def _process_gallery_in_dir(self, gallery_dir, book):
-        BookImage.objects.filter(book=book).delete()
-        for i, filename in enumerate(sorted(os.listdir(gallery_dir))):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                img_path = os.path.join(gallery_dir, filename)
-                with open(img_path, 'rb') as f:
-                    BookImage.objects.create(
-                        book=book,
-                        image=File(f),
-                        caption=os.path.splitext(filename)[0],
-                        order=i
-                    )
+        self.success_count += len(done)
+        for book in done:
+            self.stdout.write(self.style.SUCCESS(f'成功处理: {book.name}'))
@@ -0,0 +1,60 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from library import exporter, tasks
+from library.models import Book
+
+class Command(BaseCommand):
+    help = '导出图书为资源包ZIP（与 bulk_upload_books 格式相同，可直接重新导入）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str, help='输出的ZIP文件路径')
+        parser.add_argument(
+            '--book-id',
+            type=int,
+            action='append',
+            dest='book_ids',
+            help='仅导出指定图书ID（可重复指定）'
+        )
+        parser.add_argument(
+            '--compress',
+            action='store_true',
+            help='压缩图片（图片本身已压缩，默认直接存储）'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='压缩时并行读取和压缩图片的进程数'
+        )
+
+    def handle(self, *args, **options):
+        output = options['output']
+        compress = options['compress']
+        workers = max(1, options['workers'])
+
+        books = Book.objects.all()
+        if options['book_ids']:
+            books = books.filter(id__in=options['book_ids'])
+        # 按ID分块预取轮播图，不一次加载全部图书
+        books = exporter.export_queryset(books).iterator(chunk_size=500)
+
+        started = time.perf_counter()
+        pool = None
+        if compress and workers > 1:
+            # 子进程只读取存储，不使用数据库
+            pool = tasks.process_pool(workers)
+        try:
+            with open(output, 'wb') as fp:
+                count = exporter.write_archive(fp, books, compress=compress, pool=pool)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        megabytes = os.path.getsize(output) / (1024 * 1024)
+        self.stdout.write(self.style.SUCCESS(f'导出完成! 图书: {count}，文件: {output}'))
+        self.stdout.write(
+            f'大小 {megabytes:.1f} MB，耗时 {elapsed:.1f} 秒，'
+            f'{count / elapsed:.1f} 本/秒，{megabytes / elapsed:.1f} MB/秒'
+        )
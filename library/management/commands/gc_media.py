@@ -0,0 +1,107 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from library import pagecache, tasks
+from library.models import Book
+from library.storage import is_hashed_name, is_referenced, media_fields, reference_counts
+from library.utils import COVER_FORMATS, COVER_SIZES, cover_derivative_name
+
+
+def walk(storage, path):
+    """递归列出存储目录下的全部文件"""
+    if not storage.exists(path):
+        return
+    dirs, files = storage.listdir(path)
+    for filename in files:
+        yield f'{path}/{filename}'
+    for dirname in dirs:
+        yield from walk(storage, f'{path}/{dirname}')
+
+
+class Command(BaseCommand):
+    help = '回收不再被图书或图片引用的封面、轮播图文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=float,
+            default=24,
+            help='只回收修改时间早于该小时数的文件，避免删除刚上传、尚未提交的文件'
+        )
+        parser.add_argument(
+            '--rehash',
+            action='store_true',
+            help='先把旧文件名的图片改为按内容哈希命名，合并内容相同的重复文件'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只统计，不删除或改名'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if options['rehash'] and not dry_run:
+            self.rehash()
+
+        counts = reference_counts()
+        # 被引用文件的封面衍生图一并保留
+        keep = set(counts)
+        keep.update(
+            cover_derivative_name(name, size, fmt)
+            for name in counts for size in COVER_SIZES for fmt in COVER_FORMATS
+        )
+        shared = sum(1 for refs in counts.values() if refs > 1)
+        self.stdout.write(f'被引用的文件: {len(counts)}，其中多条记录共用: {shared}')
+
+        cutoff = timezone.now() - timedelta(hours=options['min_age'])
+        deleted_count = 0
+        freed = 0
+        for model, field in media_fields():
+            model_field = model._meta.get_field(field)
+            storage = model_field.storage
+            for name in walk(storage, model_field.upload_to.rstrip('/')):
+                if name in keep or storage.get_modified_time(name) > cutoff:
+                    continue
+                # 统计引用之后可能有新记录重新引用了该文件
+                if is_referenced(name):
+                    continue
+                freed += storage.size(name)
+                deleted_count += 1
+                if not dry_run:
+                    storage.delete(name)
+
+        action = '可回收' if dry_run else '已回收'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {deleted_count} 个文件，{freed / (1024 * 1024):.1f} MB'
+        ))
+
+    def rehash(self):
+        """把旧文件名的图片重新保存为按内容哈希命名（内容相同的只保存一份），批量更新记录"""
+        renamed = {}
+        error_count = 0
+        for model, field in media_fields():
+            storage = model._meta.get_field(field).storage
+            rows = model.objects.exclude(**{field: ''}).filter(**{f'{field}__isnull': False})
+            updates = []
+            for pk, name in rows.order_by('id').values_list('id', field).iterator():
+                if is_hashed_name(name):
+                    continue
+                if name not in renamed:
+                    try:
+                        with storage.open(name, 'rb') as f:
+                            renamed[name] = storage.save(name, f)
+                    except OSError as e:
+                        error_count += 1
+                        self.stdout.write(self.style.ERROR(f'处理文件 {name} 失败: {e}'))
+                        continue
+                updates.append(model(id=pk, **{field: renamed[name]}))
+            model.objects.bulk_update(updates, [field], batch_size=1000)
+            if model is Book:
+                for name in {book.cover_image.name for book in updates}:
+                    tasks.defer(tasks.build_cover_derivatives, name)
+            self.stdout.write(f'{model._meta.verbose_name}: 重命名 {len(updates)} 条记录')
+        # 缓存的页面片段仍指向旧文件名，回收旧文件前全部失效
+        pagecache.invalidate_all()
+        if error_count:
+            self.stdout.write(self.style.ERROR(f'失败: {error_count}'))
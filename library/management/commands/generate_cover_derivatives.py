@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from library.models import Book
+from library.utils import generate_cover_derivatives, has_cover_derivatives
+
+class Command(BaseCommand):
+    help = '为已有封面生成多尺寸 WebP/JPEG 衍生图'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='重新生成已存在的衍生图'
+        )
+
+    def handle(self, *args, **options):
+        force = options['force']
+        names = (
+            Book.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+            .order_by().values_list('cover_image', flat=True).distinct()
+        )
+
+        success_count = 0
+        skipped_count = 0
+        error_count = 0
+        for name in names.iterator():
+            if not force and has_cover_derivatives(name):
+                skipped_count += 1
+                continue
+            try:
+                generate_cover_derivatives(name)
+                success_count += 1
+            except Exception as e:
+                error_count += 1
+                self.stdout.write(self.style.ERROR(f'处理封面 {name} 失败: {str(e)}'))
+
+        self.stdout.write(self.style.SUCCESS(f'衍生图生成完成! 成功: {success_count}, 跳过: {skipped_count}'))
+        if error_count > 0:
+            self.stdout.write(self.style.ERROR(f'失败: {error_count}'))
@@ -1,10 +1,37 @@
+import os
+import time
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db.models import Q
+from library import tasks
 from library.models import BookCopy
-from django.utils import timezone
+from library.utils import qr_code_filename, render_qr_png
+
+QR_UPLOAD_DIR = 'qr_codes'
+
+
+def render_qr_batch(copy_ids, media_root):
+    """渲染一批二维码并直接写入媒体目录（在子进程中执行，不访问数据库）
+
+    返回 (成功的副本ID列表, [(副本ID, 错误信息), ...])
+    """
+    output_dir = os.path.join(media_root, QR_UPLOAD_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    done, errors = [], []
+    for copy_id in copy_ids:
+        try:
+            path = os.path.join(output_dir, qr_code_filename(copy_id))
+            with open(path, 'wb') as f:
+                f.write(render_qr_png(copy_id))
+            done.append(copy_id)
+        except Exception as e:
+            errors.append((copy_id, str(e)))
+    return done, errors
+
 
 class Command(BaseCommand):
     help = '为所有图书副本生成二维码'
-    
+
     def add_arguments(self, parser):
         parser.add_argument(
             '--book-id',
@@ -16,11 +43,32 @@ class Command(BaseCommand):
             action='store_true',
             help='强制重新生成所有二维码'
         )
-    
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='并行渲染的进程数'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='每批处理并写回数据库的副本数量'
+        )
+        parser.add_argument(
+            '--after',
+            type=int,
+            default=0,
+            help='从该副本ID之后继续（用于中断后恢复）'
+        )
+
     def handle(self, *args, **options):
         book_id = options.get('book_id')
         force = options.get('force')
-        
+        workers = max(1, options['workers'])
+        chunk_size = max(1, options['chunk_size'])
+        last_id = options['after']
+
         # 构建查询集
         if book_id:
             copies = BookCopy.objects.filter(book_id=book_id)
@@ -28,48 +76,86 @@ class Command(BaseCommand):
         else:
             copies = BookCopy.objects.all()
             self.stdout.write('为所有图书副本生成二维码...')
-        
+
         if not force:
             # 只处理没有二维码的副本
-            copies = copies.filter(qr_code='') | copies.filter(qr_code__isnull=True)
-        
-        total = copies.count()
+            copies = copies.filter(Q(qr_code='') | Q(qr_code__isnull=True))
+
+        total = copies.filter(id__gt=last_id).count()
         if total == 0:
             self.stdout.write(self.style.WARNING('没有需要生成二维码的图书副本'))
             return
-        
-        self.stdout.write(f'需要处理 {total} 个图书副本')
-        
+
+        self.stdout.write(f'需要处理 {total} 个图书副本（{workers} 个进程）')
+
         success_count = 0
         error_count = 0
-        
-        for i, copy in enumerate(copies, 1):
-            try:
-                # 生成二维码
-                copy.generate_qr_code()
-                copy.save()
-                success_count += 1
-                
+        started = time.perf_counter()
+        media_root = str(settings.MEDIA_ROOT)
+
+        pool = None
+        if workers > 1:
+            # 子进程不使用数据库
+            pool = tasks.process_pool(workers)
+        try:
+            while True:
+                # 按ID游标分块读取，避免一次加载全部副本
+                ids = list(
+                    copies.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+                )
+                if not ids:
+                    break
+
+                if pool:
+                    step = -(-len(ids) // workers)
+                    batches = [ids[i:i + step] for i in range(0, len(ids), step)]
+                    results = pool.map(render_qr_batch, batches, [media_root] * len(batches))
+                else:
+                    results = [render_qr_batch(ids, media_root)]
+
+                done = []
+                for batch_done, batch_errors in results:
+                    done.extend(batch_done)
+                    for copy_id, error in batch_errors:
+                        error_count += 1
+                        self.stdout.write(self.style.ERROR(f'为副本 {copy_id} 生成二维码失败: {error}'))
+
+                # 批量写回二维码路径，不经过 BookCopy.save
+                BookCopy.objects.bulk_update(
+                    [BookCopy(id=copy_id, qr_code=f'{QR_UPLOAD_DIR}/{qr_code_filename(copy_id)}') for copy_id in done],
+                    ['qr_code'],
+                    batch_size=1000,
+                )
+                success_count += len(done)
+                last_id = ids[-1]
+
                 # 显示进度
-                if i % 10 == 0 or i == total:
-                    self.stdout.write(f'进度: {i}/{total} ({i/total*100:.1f}%)')
-                
-            except Exception as e:
-                error_count += 1
+                processed = success_count + error_count
+                elapsed = time.perf_counter() - started
                 self.stdout.write(
-                    self.style.ERROR(f'为副本 {copy.id} 生成二维码失败: {str(e)}')
+                    f'进度: {processed}/{total} ({processed/total*100:.1f}%), '
+                    f'{processed/elapsed:.0f} 个/秒, 已完成至副本ID {last_id}'
                 )
-        
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(f'\n已中断，使用 --after {last_id} 继续'))
+            raise
+        finally:
+            if pool:
+                pool.shutdown()
+
         # 输出结果
+        elapsed = time.perf_counter() - started
         self.stdout.write('\n' + '='*50)
         self.stdout.write(self.style.SUCCESS(f'二维码生成完成!'))
         self.stdout.write(f'成功: {success_count}')
+        self.stdout.write(f'耗时: {elapsed:.1f} 秒, 速度: {success_count/elapsed:.0f} 个/秒')
         if error_count > 0:
             self.stdout.write(self.style.ERROR(f'失败: {error_count}'))
-        
+
         # 统计信息
         if success_count > 0:
+            without_qr = BookCopy.objects.filter(Q(qr_code='') | Q(qr_code__isnull=True)).count()
             self.stdout.write(f'\n统计信息:')
             self.stdout.write(f'总副本数: {BookCopy.objects.count()}')
-            self.stdout.write(f'有二维码的副本: {BookCopy.objects.exclude(qr_code="").exclude(qr_code__isnull=True).count()}')
-            self.stdout.write(f'无二维码的副本: {BookCopy.objects.filter(qr_code="").filter(qr_code__isnull=True).count()}')
\ No newline at end of file
+            self.stdout.write(f'有二维码的副本: {BookCopy.objects.count() - without_qr}')
+            self.stdout.write(f'无二维码的副本: {without_qr}')
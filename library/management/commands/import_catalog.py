@@ -0,0 +1,78 @@
+import os
+import time
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from library import catalog
+
+class Command(BaseCommand):
+    help = '从 CSV 或 JSONL 文件批量导入书目（按 ISBN 新增或更新，不含图片）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=str, help='CSV 或 JSONL 文件路径')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='文件格式，默认按扩展名判断'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='每个事务写入的行数'
+        )
+
+    def handle(self, *args, **options):
+        source = options['source']
+        fmt = options['format'] or ('csv' if source.lower().endswith('.csv') else 'jsonl')
+        batch_size = max(1, options['batch_size'])
+        if not os.path.isfile(source):
+            raise CommandError(f'文件不存在: {source}')
+
+        created_count = 0
+        updated_count = 0
+        error_count = 0
+        started = time.perf_counter()
+
+        with open(source, encoding='utf-8-sig', newline='') as fp:
+            rows = catalog.read_rows(fp, fmt)
+            while True:
+                chunk = list(islice(rows, batch_size))
+                if not chunk:
+                    break
+                batch = []
+                for number, row in chunk:
+                    try:
+                        batch.append((number, catalog.clean_row(row)))
+                    except ValueError as e:
+                        error_count += 1
+                        self.stdout.write(self.style.ERROR(f'第 {number} 行: {e}'))
+                if not batch:
+                    continue
+                try:
+                    created, updated = catalog.upsert_batch([data for _, data in batch])
+                except DatabaseError:
+                    # 整批被数据库拒绝时逐行重试，只跳过出错的行
+                    created = updated = 0
+                    for number, data in batch:
+                        try:
+                            row_created, row_updated = catalog.upsert_batch([data])
+                        except DatabaseError as e:
+                            error_count += 1
+                            self.stdout.write(self.style.ERROR(f'第 {number} 行: {e}'))
+                            continue
+                        created += row_created
+                        updated += row_updated
+                created_count += created
+                updated_count += updated
+
+                processed = created_count + updated_count
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'已导入 {processed} 本, {processed / elapsed:.0f} 本/秒')
+
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        self.stdout.write('\n' + '=' * 50)
+        self.stdout.write(self.style.SUCCESS(
+            f'新增: {created_count}，更新: {updated_count}，失败: {error_count}'
+        ))
+        self.stdout.write(f'耗时: {elapsed:.1f} 秒')
@@ -0,0 +1,138 @@
+import os
+import time
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from PIL import Image
+from library import pagecache, tasks
+from library.models import Book, BookImage
+from library.utils import IMAGE_FORMATS, normalize_image
+
+
+def normalize_batch(names, model_name, field):
+    """规范化一批已保存的图片并写入新文件（在子进程中执行，不访问数据库）
+
+    已是目标格式、尺寸不超限且不含元数据的图片只读取宽高，不重新编码。
+    返回 ([(原路径, 新路径, 宽, 高), ...], [(原路径, 错误信息), ...])
+    """
+    storage = apps.get_model('library', model_name)._meta.get_field(field).storage
+    pil_format, _, _ = IMAGE_FORMATS[settings.LIBRARY_IMAGE_FORMAT]
+    done, errors = [], []
+    for name in names:
+        try:
+            with storage.open(name, 'rb') as f:
+                img = Image.open(f)
+                if (
+                    img.format == pil_format
+                    and max(img.size) <= settings.LIBRARY_IMAGE_MAX_DIMENSION
+                    and not {'exif', 'icc_profile'} & set(img.info)
+                ):
+                    done.append((name, name, *img.size))
+                    continue
+                f.seek(0)
+                normalized = normalize_image(f)
+            stem = os.path.splitext(name)[0]
+            new_name = storage.save(f'{stem}.{normalized.ext}', ContentFile(normalized.data))
+            done.append((name, new_name, normalized.width, normalized.height))
+        except Exception as e:
+            errors.append((name, str(e)))
+    return done, errors
+
+
+class Command(BaseCommand):
+    help = '规范化已上传的封面和轮播图（限制尺寸、去除元数据、转码），并记录宽高'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='并行处理图片的进程数'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='每批处理并写回数据库的图片数量'
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        chunk_size = max(1, options['chunk_size'])
+
+        # 已记录宽高的图片视为已规范化，中断后重跑会从未处理的图片继续
+        targets = [
+            ('封面', Book, 'cover_image', 'cover_width', 'cover_height',
+             Book.objects.exclude(cover_image='').filter(cover_image__isnull=False, cover_width__isnull=True)),
+            ('轮播图', BookImage, 'image', 'width', 'height',
+             BookImage.objects.filter(width__isnull=True)),
+        ]
+
+        self.success_count = 0
+        self.error_count = 0
+        started = time.perf_counter()
+
+        pool = None
+        if workers > 1:
+            # 子进程不使用数据库
+            pool = tasks.process_pool(workers)
+        try:
+            for label, model, field, width_field, height_field, queryset in targets:
+                total = queryset.count()
+                self.stdout.write(f'需要处理 {total} 张{label}（{workers} 个进程）')
+                last_id = 0
+                while True:
+                    rows = list(
+                        queryset.filter(id__gt=last_id).order_by('id').values_list('id', field)[:chunk_size]
+                    )
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+                    self.process(pool, workers, rows, model, field, width_field, height_field)
+        finally:
+            if pool:
+                pool.shutdown()
+
+        # 批量改写了图片路径，缓存的页面片段全部失效
+        pagecache.invalidate_all()
+        elapsed = max(time.perf_counter() - started, 1e-6)
+        self.stdout.write('\n' + '=' * 50)
+        self.stdout.write(self.style.SUCCESS(f'图片规范化完成! 成功: {self.success_count}'))
+        self.stdout.write('旧文件不会立即删除，请运行 gc_media 回收')
+        self.stdout.write(f'耗时: {elapsed:.1f} 秒, 速度: {self.success_count / elapsed:.1f} 张/秒')
+        if self.error_count > 0:
+            self.stdout.write(self.style.ERROR(f'失败: {self.error_count}'))
+
+    def process(self, pool, workers, rows, model, field, width_field, height_field):
+        names = sorted({name for _, name in rows})
+        model_name = model._meta.model_name
+        if pool:
+            step = -(-len(names) // workers)
+            batches = [names[i:i + step] for i in range(0, len(names), step)]
+            results = pool.map(normalize_batch, batches, [model_name] * len(batches), [field] * len(batches))
+        else:
+            results = [normalize_batch(names, model_name, field)]
+
+        converted = {}
+        for batch_done, batch_errors in results:
+            for name, new_name, width, height in batch_done:
+                converted[name] = (new_name, width, height)
+            for name, error in batch_errors:
+                self.error_count += 1
+                self.stdout.write(self.style.ERROR(f'处理图片 {name} 失败: {error}'))
+
+        # 批量写回新路径和宽高，不经过模型 save
+        updates = []
+        for pk, name in rows:
+            if name in converted:
+                new_name, width, height = converted[name]
+                updates.append(model(id=pk, **{field: new_name, width_field: width, height_field: height}))
+        model.objects.bulk_update(updates, [field, width_field, height_field], batch_size=1000)
+        self.success_count += len(updates)
+
+        # 旧文件可能仍被其他记录引用，统一由 gc_media 回收
+        if model is Book:
+            for name, (new_name, _, _) in converted.items():
+                if new_name != name:
+                    tasks.defer(tasks.build_cover_derivatives, new_name)
@@ -0,0 +1,44 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from library import labels
+
+class Command(BaseCommand):
+    help = '批量生成二维码标签页（多页PDF或逐页PNG）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', type=str, help='输出PDF文件路径，PNG格式时为输出目录')
+        parser.add_argument('--book-id', type=int, help='仅打印指定图书的副本')
+        parser.add_argument('--start', type=int, help='起始副本ID（含）')
+        parser.add_argument('--end', type=int, help='结束副本ID（含）')
+        parser.add_argument(
+            '--format',
+            choices=['pdf', 'png'],
+            default='pdf',
+            help='输出格式'
+        )
+
+    def handle(self, *args, **options):
+        output = options['output']
+        copies = labels.select_copies(options['book_id'], options['start'], options['end'])
+        total = copies.count()
+        if total == 0:
+            raise CommandError('没有符合条件的图书副本')
+
+        self.stdout.write(f'为 {total} 个副本生成标签（每页 {labels.LABELS_PER_PAGE} 个）...')
+        started = time.perf_counter()
+        pages = 0
+        if options['format'] == 'pdf':
+            with open(output, 'wb') as f:
+                for chunk in labels.stream_label_pdf(labels.label_copies(copies)):
+                    f.write(chunk)
+            pages = -(-total // labels.LABELS_PER_PAGE)
+        else:
+            os.makedirs(output, exist_ok=True)
+            for pages, page in enumerate(labels.iter_label_pages(labels.label_copies(copies)), 1):
+                page.save(os.path.join(output, f'qr_labels_{pages:04d}.png'), 'PNG', optimize=True)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'已生成 {pages} 页标签: {output}（耗时 {elapsed:.1f} 秒）'
+        ))
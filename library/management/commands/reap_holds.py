@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from library import holds
+
+class Command(BaseCommand):
+    help = '回收逾期未取书的预约，并把保留的副本转给下一位读者或恢复可借'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=holds.REAP_BATCH_SIZE,
+            help='每个事务处理的预约数量'
+        )
+
+    def handle(self, *args, **options):
+        reaped = holds.reap_expired_holds(batch_size=max(1, options['batch_size']))
+        if reaped:
+            self.stdout.write(self.style.SUCCESS(f'已回收 {reaped} 个逾期预约'))
+        else:
+            self.stdout.write('没有逾期未取书的预约')
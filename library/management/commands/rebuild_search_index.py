@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from library.search import rebuild_index
+
+class Command(BaseCommand):
+    help = '重建图书全文检索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批写入的索引项数量'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_index(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 本图书的检索索引，耗时 {elapsed:.1f} 秒'))
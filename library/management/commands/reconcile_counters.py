@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from library.models import Book
+
+class Command(BaseCommand):
+    help = '校正图书的副本总数/可借副本数计数字段'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='每批校正的图书数量'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='只报告计数不一致的图书，不做修改'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        # 只挑出计数与副本表不一致的图书
+        drifted_ids = list(
+            Book.objects.with_actual_counts()
+            .filter(~Q(total_count=F('actual_total')) | ~Q(available_count=F('actual_available')))
+            .values_list('id', flat=True)
+        )
+
+        if not drifted_ids:
+            self.stdout.write(self.style.SUCCESS('所有图书计数均准确'))
+            return
+
+        self.stdout.write(f'发现 {len(drifted_ids)} 本图书计数不一致')
+        if dry_run:
+            return
+
+        fixed = 0
+        for start in range(0, len(drifted_ids), batch_size):
+            batch = drifted_ids[start:start + batch_size]
+            fixed += Book.objects.filter(id__in=batch).refresh_counters()
+
+        self.stdout.write(self.style.SUCCESS(f'已校正 {fixed} 本图书'))
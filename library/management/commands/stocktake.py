@@ -0,0 +1,65 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from library.models import BookCopy
+from library import stocktake
+
+class Command(BaseCommand):
+    help = '书架盘点：核对扫描到的副本与系统记录'
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=str, help='扫描结果文件（每行一个副本ID或 bookcopy:N），"-" 表示标准输入')
+        parser.add_argument('--book-id', type=int, help='仅盘点指定图书的副本')
+        parser.add_argument('--output', type=str, help='把异常副本明细写入CSV文件')
+        parser.add_argument(
+            '--show',
+            type=int,
+            default=20,
+            help='每类异常在终端显示的副本ID数量'
+        )
+
+    def handle(self, *args, **options):
+        queryset = BookCopy.objects.all()
+        if options['book_id']:
+            queryset = queryset.filter(book_id=options['book_id'])
+
+        started = time.perf_counter()
+        if options['source'] == '-':
+            report = stocktake.reconcile(sys.stdin, queryset)
+        else:
+            try:
+                with open(options['source'], 'r', encoding='utf-8', errors='ignore') as f:
+                    report = stocktake.reconcile(f, queryset)
+            except OSError as e:
+                raise CommandError(f'无法读取扫描结果: {e}')
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'扫描副本: {report.scanned}（重复 {report.duplicates}，无法识别 {report.invalid}，'
+            f'预约保留 {len(report.held)}）'
+        )
+        for sample in report.invalid_samples:
+            self.stdout.write(self.style.WARNING(f'  无法识别: {sample}'))
+
+        show = options['show']
+        for category, label in stocktake.REPORT_CATEGORIES:
+            bitmap = getattr(report, category)
+            count = len(bitmap)
+            if category == 'unexpected':
+                count += report.out_of_range
+            style = self.style.ERROR if count else self.style.SUCCESS
+            self.stdout.write(style(f'{label}: {count}'))
+            if count and show:
+                ids = []
+                for copy_id in bitmap:
+                    if len(ids) >= show:
+                        break
+                    ids.append(str(copy_id))
+                self.stdout.write('  ' + ', '.join(ids) + (' ...' if count > len(ids) else ''))
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as f:
+                stocktake.write_report_csv(report, f)
+            self.stdout.write(f'明细已写入 {options["output"]}')
+
+        self.stdout.write(self.style.SUCCESS(f'盘点完成，耗时 {elapsed:.1f} 秒'))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:19
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    BookCopy = apps.get_model('library', 'BookCopy')
+
+    def count(**filters):
+        counts = (
+            BookCopy.objects
+            .filter(book=models.OuterRef('pk'), **filters)
+            .order_by()
+            .values('book')
+            .annotate(count=models.Count('id'))
+            .values('count')
+        )
+        return Coalesce(models.Subquery(counts), 0)
+
+    Book.objects.update(total_count=count(), available_count=count(is_available=True))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='可借副本数'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='副本总数'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
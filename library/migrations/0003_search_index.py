@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0002_book_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, verbose_name='检索词')),
+                ('weight', models.PositiveIntegerField(default=1, verbose_name='权重')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='library.book', verbose_name='所属图书')),
+            ],
+            options={
+                'verbose_name': '检索词',
+                'verbose_name_plural': '检索词',
+                'db_table': 'library_searchtoken',
+                'constraints': [models.UniqueConstraint(fields=('token', 'book'), name='library_searchtoken_token_book')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookcopy',
+            name='due_date',
+            field=models.DateField(blank=True, db_index=True, null=True, verbose_name='应还日期'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_bookcopy_due_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='任务')),
+                ('position', models.BigIntegerField(default=0, verbose_name='已处理至ID')),
+            ],
+            options={
+                'verbose_name': '汇总进度',
+                'verbose_name_plural': '汇总进度',
+                'db_table': 'library_rollupcheckpoint',
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='日期')),
+                ('borrows', models.PositiveIntegerField(default=0, verbose_name='借阅次数')),
+                ('returns', models.PositiveIntegerField(default=0, verbose_name='归还次数')),
+                ('on_loan', models.IntegerField(default=0, verbose_name='日终借出数')),
+                ('total_copies', models.PositiveIntegerField(default=0, verbose_name='副本总数')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='library.book', verbose_name='图书')),
+            ],
+            options={
+                'verbose_name': '借阅日统计',
+                'verbose_name_plural': '借阅日统计',
+                'db_table': 'library_loandailystat',
+                'indexes': [models.Index(fields=['date'], name='library_loandailystat_date')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'date'), name='library_loandailystat_book_date')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LoanEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, verbose_name='时间')),
+                ('action', models.PositiveSmallIntegerField(choices=[(1, '借阅'), (2, '归还')], verbose_name='操作')),
+                ('due_date', models.DateField(blank=True, null=True, verbose_name='应还日期')),
+                ('book', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='library.book', verbose_name='图书')),
+                ('copy', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='library.bookcopy', verbose_name='副本')),
+                ('user', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='读者')),
+            ],
+            options={
+                'verbose_name': '借还记录',
+                'verbose_name_plural': '借还记录',
+                'db_table': 'library_loanevent',
+                'indexes': [models.Index(fields=['book', 'timestamp'], name='library_loanevent_book_ts'), models.Index(fields=['user', 'timestamp'], name='library_loanevent_user_ts')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:35
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_loan_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, '排队中'), (2, '待取书'), (3, '已借出'), (4, '已取消'), (5, '已过期')], default=1, verbose_name='状态')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='预约时间')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='取书期限')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='library.book', verbose_name='图书')),
+                ('copy', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='library.bookcopy', verbose_name='保留副本')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to=settings.AUTH_USER_MODEL, verbose_name='读者')),
+            ],
+            options={
+                'verbose_name': '预约',
+                'verbose_name_plural': '预约',
+                'db_table': 'library_hold',
+                'indexes': [models.Index(fields=['book', 'status', 'id'], name='library_hold_queue'), models.Index(fields=['status', 'expires_at'], name='library_hold_expiry')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', [1, 2])), fields=('book', 'user'), name='library_hold_one_active_per_user')],
+            },
+        ),
+    ]
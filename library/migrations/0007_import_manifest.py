@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='图书目录')),
+                ('digest', models.CharField(max_length=40, verbose_name='内容摘要')),
+                ('members', models.JSONField(default=dict, verbose_name='文件哈希')),
+                ('images', models.JSONField(default=dict, verbose_name='轮播图记录')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book', verbose_name='图书')),
+            ],
+            options={
+                'verbose_name': '导入清单',
+                'verbose_name_plural': '导入清单',
+                'db_table': 'library_importmanifest',
+            },
+        ),
+    ]
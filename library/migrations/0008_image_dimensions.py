@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:49
+
+import library.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_import_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='封面高度'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='cover_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='封面宽度'),
+        ),
+        migrations.AddField(
+            model_name='bookimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='高度'),
+        ),
+        migrations.AddField(
+            model_name='bookimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='宽度'),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=library.models.NormalizedImageField(blank=True, dimension_fields=('cover_width', 'cover_height'), null=True, upload_to='book_covers/', verbose_name='封面'),
+        ),
+        migrations.AlterField(
+            model_name='bookimage',
+            name='image',
+            field=library.models.NormalizedImageField(dimension_fields=('width', 'height'), upload_to='book_gallery/', verbose_name='详情轮播图片'),
+        ),
+    ]
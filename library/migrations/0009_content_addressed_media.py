@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:54
+
+import library.models
+import library.storage
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='book',
+            name='cover_image',
+            field=library.models.NormalizedImageField(blank=True, dimension_fields=('cover_width', 'cover_height'), null=True, storage=library.storage.ContentAddressedStorage(), upload_to='book_covers/', verbose_name='封面'),
+        ),
+        migrations.AlterField(
+            model_name='bookimage',
+            name='image',
+            field=library.models.NormalizedImageField(dimension_fields=('width', 'height'), storage=library.storage.ContentAddressedStorage(), upload_to='book_gallery/', verbose_name='详情轮播图片'),
+        ),
+    ]
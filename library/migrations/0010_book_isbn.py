@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_content_addressed_media'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='isbn',
+            field=models.CharField(blank=True, max_length=13, null=True, unique=True, verbose_name='ISBN'),
+        ),
+    ]
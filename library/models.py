@@ -2,22 +2,63 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.utils import timezone
-from .utils import generate_book_cover
+from . import tasks
+from .storage import content_storage
+from .utils import normalize_image, qr_code_filename, render_qr_png
 import os
 from django.conf import settings
 from django.urls import reverse
+from django.templatetags.static import static
+from django.db.models.functions import Coalesce
 
-# 尝试导入qrcode，如果失败则提供替代方案
-try:
-    import qrcode
-    from io import BytesIO
-    from django.core.files.base import ContentFile
-    QRCODE_AVAILABLE = True
-except ImportError:
-    QRCODE_AVAILABLE = False
+from PIL import Image
+
+from django.core.files.base import ContentFile
+from importlib.util import find_spec
+
+# 检查是否安装了qrcode（由 utils.render_qr_png 使用），未安装时二维码功能受限
+QRCODE_AVAILABLE = find_spec('qrcode') is not None
+if not QRCODE_AVAILABLE:
     print("警告: qrcode库未安装，二维码功能将受限")
     print("请运行: pip install qrcode[pil]")
 
+COVER_PLACEHOLDER = 'img/cover_placeholder.svg'
+
+class NormalizedImageField(models.ImageField):
+    """保存前规范化新上传图片的 ImageField（旋正、限制尺寸、去除元数据、转码）
+
+    只处理尚未写入存储的文件，已保存的文件和直接赋值的存储路径原样保留。
+    dimension_fields 为记录宽高的两个字段名；不使用 ImageField 的 width_field/height_field，
+    那样每次从数据库加载实例都会打开图片文件。
+    """
+
+    def __init__(self, *args, dimension_fields=None, **kwargs):
+        self.dimension_fields = dimension_fields
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dimension_fields:
+            kwargs['dimension_fields'] = self.dimension_fields
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        file = getattr(model_instance, self.attname)
+        if file and not file._committed:
+            file.seek(0)
+            if settings.LIBRARY_IMAGE_NORMALIZE:
+                normalized = normalize_image(file)
+                stem = os.path.splitext(os.path.basename(file.name))[0]
+                file.save(f'{stem}.{normalized.ext}', ContentFile(normalized.data), save=False)
+                size = (normalized.width, normalized.height)
+            else:
+                size = Image.open(file).size
+                file.seek(0)
+            if self.dimension_fields:
+                for attname, value in zip(self.dimension_fields, size):
+                    setattr(model_instance, attname, value)
+        return super().pre_save(model_instance, add)
+
 class User(AbstractUser):
     is_admin = models.BooleanField(default=False, verbose_name='管理员')
     
@@ -47,35 +88,69 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+def copy_count_subquery(**filters):
+    """统计每本图书副本数量的相关子查询，用于批量刷新计数字段"""
+    counts = (
+        BookCopy.objects
+        .filter(book=models.OuterRef('pk'), **filters)
+        .order_by()
+        .values('book')
+        .annotate(count=models.Count('id'))
+        .values('count')
+    )
+    return Coalesce(models.Subquery(counts), 0)
+
+class BookQuerySet(models.QuerySet):
+    def with_actual_counts(self):
+        """附加按副本表实时统计的 actual_total / actual_available"""
+        return self.annotate(
+            actual_total=copy_count_subquery(),
+            actual_available=copy_count_subquery(is_available=True),
+        )
+
+    def refresh_counters(self):
+        """用一条 UPDATE 按副本表重新计算计数字段，返回更新行数"""
+        return self.update(
+            total_count=copy_count_subquery(),
+            available_count=copy_count_subquery(is_available=True),
+        )
+
 # 先定义Book模型，这样BookImage可以引用它
 class Book(models.Model):
     title = models.CharField(max_length=100, verbose_name='书名')
+    isbn = models.CharField(max_length=13, unique=True, null=True, blank=True, verbose_name='ISBN')
     author = models.CharField(max_length=100, verbose_name='作者')
     description = models.TextField(verbose_name='简介')
     keywords = models.CharField(max_length=200, blank=True, null=True, verbose_name='关键字')
     recommended_age = models.IntegerField(blank=True, null=True, verbose_name='推荐年龄')
-    cover_image = models.ImageField(
+    cover_image = NormalizedImageField(
         upload_to='book_covers/',
+        storage=content_storage,
         blank=True,
         null=True,
-        verbose_name='封面'
+        verbose_name='封面',
+        dimension_fields=('cover_width', 'cover_height'),
     )
+    cover_width = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='封面宽度')
+    cover_height = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='封面高度')
     copies_count = models.PositiveIntegerField(
         default=1,
         verbose_name='副本数量',
         help_text='保存时将自动创建指定数量的副本'
     )
+    # 冗余计数，由借还服务和副本增删维护，避免列表页逐行 COUNT
+    total_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='副本总数')
+    available_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='可借副本数')
+
+    objects = BookQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
-        if not self.pk and not self.cover_image:
-            cover_path = os.path.join(settings.MEDIA_ROOT, 'book_covers', f'{self.title}_cover.png')
-            generate_book_cover(
-                title=self.title,
-                author=self.author,
-                output_path=cover_path
-            )
-            self.cover_image = f'book_covers/{self.title}_cover.png'
+        is_new = not self.pk
         super().save(*args, **kwargs)
+
+        # 封面渲染较慢，提交后交给后台任务，完成前显示占位图
+        if is_new and not self.cover_image:
+            tasks.defer(tasks.render_book_cover, self.pk)
     
         # 创建指定数量的副本
         existing_copies = self.copies.count()
@@ -85,10 +160,27 @@ class Book(models.Model):
             BookCopy.objects.bulk_create([
                 BookCopy(book=self) for _ in range(needed_copies)
             ])
+        self.refresh_counters()
+
+    def refresh_counters(self):
+        """按副本表重新计算本书的计数字段"""
+        Book.objects.filter(pk=self.pk).refresh_counters()
+        self.total_count, self.available_count = (
+            Book.objects.filter(pk=self.pk).values_list('total_count', 'available_count').get()
+        )
 
     def __str__(self):
         return self.title
     
+    @property
+    def cover_url(self):
+        """封面URL，封面尚未生成时排队渲染并返回占位图"""
+        if self.cover_image:
+            return self.cover_image.url
+        if self.pk:
+            tasks.request_book_cover(self.pk)
+        return static(COVER_PLACEHOLDER)
+
     def get_gallery_images(self):
         """获取所有关联图片，至少包含封面"""
         images = list(self.images.all())
@@ -104,7 +196,10 @@ class Book(models.Model):
 
 class BookImage(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='images', verbose_name='所属图书')
-    image = models.ImageField(upload_to='book_gallery/', verbose_name='详情轮播图片')
+    image = NormalizedImageField(upload_to='book_gallery/', storage=content_storage, verbose_name='详情轮播图片',
+                                 dimension_fields=('width', 'height'))
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='宽度')
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False, verbose_name='高度')
     caption = models.CharField(max_length=200, blank=True, verbose_name='图片备注')
     order = models.PositiveIntegerField(default=0, verbose_name='排序')
 
@@ -122,49 +217,28 @@ class BookCopy(models.Model):
     is_available = models.BooleanField(default=True, verbose_name='可借状态')
     borrower = models.ForeignKey('User', on_delete=models.SET_NULL, null=True, blank=True, 
                                  related_name='borrowed_copies', verbose_name='借阅者')
-    due_date = models.DateField(null=True, blank=True, verbose_name='应还日期')
+    due_date = models.DateField(null=True, blank=True, db_index=True, verbose_name='应还日期')
     borrowed_date = models.DateField(null=True, blank=True, verbose_name='借阅日期')
     qr_code = models.ImageField(upload_to='qr_codes/', blank=True, null=True, verbose_name='二维码')
 
     def __str__(self):
         return f"{self.book.title} - 副本 {self.id}"
     
-    def save(self, *args, **kwargs):
-        # 如果是新创建的副本，生成二维码
-        if not self.pk or not self.qr_code:
-            self.generate_qr_code()
-        super().save(*args, **kwargs)
+    @property
+    def qr_code_url(self):
+        """按需渲染的二维码图片地址，无需为每个副本保存图片文件"""
+        return reverse('qr_code_png', kwargs={'bookcopy_id': self.id})
     
     def generate_qr_code(self):
-        """生成图书副本的二维码"""
+        """生成并保存图书副本的二维码图片文件（可选，页面使用 qr_code_url 按需渲染）"""
         if not QRCODE_AVAILABLE:
             # 如果没有安装qrcode，跳过生成
             return
             
         try:
-            # 创建二维码数据
-            qr_data = f"bookcopy:{self.id}"
-            
-            # 生成二维码
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_data)
-            qr.make(fit=True)
-            
-            # 创建二维码图片
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            # 将图片保存到内存
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            
+            png = render_qr_png(self.id)
             # 保存到模型字段
-            filename = f'qr_code_bookcopy_{self.id}.png'
-            self.qr_code.save(filename, ContentFile(buffer.getvalue()), save=False)
+            self.qr_code.save(qr_code_filename(self.id), ContentFile(png), save=False)
         except Exception as e:
             print(f"生成二维码失败: {e}")
     
@@ -175,4 +249,147 @@ class BookCopy(models.Model):
     class Meta:
         db_table = 'library_bookcopy'
         verbose_name = '副本'
-        verbose_name_plural = '副本'
\ No newline at end of file
+        verbose_name_plural = '副本'
+
+class SearchToken(models.Model):
+    """图书检索倒排索引项，由 library.search 维护"""
+    token = models.CharField(max_length=32, verbose_name='检索词')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='search_tokens', verbose_name='所属图书')
+    weight = models.PositiveIntegerField(default=1, verbose_name='权重')
+
+    class Meta:
+        db_table = 'library_searchtoken'
+        verbose_name = '检索词'
+        verbose_name_plural = '检索词'
+        constraints = [
+            models.UniqueConstraint(fields=['token', 'book'], name='library_searchtoken_token_book'),
+        ]
+class LoanEvent(models.Model):
+    """借还事件日志，只追加不修改，由 library.circulation 在借还的同一事务中写入
+
+    表结构保持紧凑，外键不建数据库约束（删除图书/副本不会级联修改日志），
+    按图书、读者查询时都带 timestamp 条件，走 (book, timestamp)、(user, timestamp) 索引。
+    """
+    BORROW = 1
+    RETURN = 2
+    ACTION_CHOICES = (
+        (BORROW, '借阅'),
+        (RETURN, '归还'),
+    )
+
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name='时间')
+    action = models.PositiveSmallIntegerField(choices=ACTION_CHOICES, verbose_name='操作')
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, db_constraint=False,
+                             related_name='+', verbose_name='图书')
+    copy = models.ForeignKey(BookCopy, on_delete=models.DO_NOTHING, db_constraint=False,
+                             related_name='+', verbose_name='副本')
+    user = models.ForeignKey('User', on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+                             related_name='+', verbose_name='读者')
+    due_date = models.DateField(null=True, blank=True, verbose_name='应还日期')
+
+    class Meta:
+        db_table = 'library_loanevent'
+        verbose_name = '借还记录'
+        verbose_name_plural = '借还记录'
+        indexes = [
+            models.Index(fields=['book', 'timestamp'], name='library_loanevent_book_ts'),
+            models.Index(fields=['user', 'timestamp'], name='library_loanevent_user_ts'),
+        ]
+
+class LoanDailyStat(models.Model):
+    """按天、按图书汇总的借还统计，由 rollup_loan_stats 命令增量维护"""
+    date = models.DateField(verbose_name='日期')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='daily_stats', verbose_name='图书')
+    borrows = models.PositiveIntegerField(default=0, verbose_name='借阅次数')
+    returns = models.PositiveIntegerField(default=0, verbose_name='归还次数')
+    on_loan = models.IntegerField(default=0, verbose_name='日终借出数')
+    total_copies = models.PositiveIntegerField(default=0, verbose_name='副本总数')
+
+    @property
+    def utilization(self):
+        """日终借出副本占比"""
+        return self.on_loan / self.total_copies if self.total_copies else 0
+
+    class Meta:
+        db_table = 'library_loandailystat'
+        verbose_name = '借阅日统计'
+        verbose_name_plural = '借阅日统计'
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'date'], name='library_loandailystat_book_date'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='library_loandailystat_date'),
+        ]
+
+class RollupCheckpoint(models.Model):
+    """增量汇总任务的进度（已处理到的源表最大ID）"""
+    name = models.CharField(max_length=50, unique=True, verbose_name='任务')
+    position = models.BigIntegerField(default=0, verbose_name='已处理至ID')
+
+    class Meta:
+        db_table = 'library_rollupcheckpoint'
+        verbose_name = '汇总进度'
+        verbose_name_plural = '汇总进度'
+
+class Hold(models.Model):
+    """图书预约，同一图书的等待中预约按ID先后排队，由 library.holds 维护
+
+    副本归还时分配给队首预约：副本保持不可借（borrower 为空），预约进入待取书状态，
+    读者在取书期限内借阅该副本，逾期未取的预约由 reap_holds 命令批量回收。
+    """
+    WAITING = 1
+    READY = 2
+    FULFILLED = 3
+    CANCELLED = 4
+    EXPIRED = 5
+    STATUS_CHOICES = (
+        (WAITING, '排队中'),
+        (READY, '待取书'),
+        (FULFILLED, '已借出'),
+        (CANCELLED, '已取消'),
+        (EXPIRED, '已过期'),
+    )
+    ACTIVE_STATUSES = (WAITING, READY)
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds', verbose_name='图书')
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='holds', verbose_name='读者')
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=WAITING, verbose_name='状态')
+    copy = models.ForeignKey(BookCopy, on_delete=models.SET_NULL, null=True, blank=True,
+                             related_name='+', verbose_name='保留副本')
+    created_at = models.DateTimeField(default=timezone.now, verbose_name='预约时间')
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name='取书期限')
+
+    def __str__(self):
+        return f"{self.book.title} - {self.user.username} ({self.get_status_display()})"
+
+    class Meta:
+        db_table = 'library_hold'
+        verbose_name = '预约'
+        verbose_name_plural = '预约'
+        indexes = [
+            # 队首查询和排队位置计数都只走该索引
+            models.Index(fields=['book', 'status', 'id'], name='library_hold_queue'),
+            models.Index(fields=['status', 'expires_at'], name='library_hold_expiry'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['book', 'user'], condition=models.Q(status__in=[1, 2]),
+                name='library_hold_one_active_per_user',
+            ),
+        ]
+
+class ImportManifest(models.Model):
+    """批量导入清单：记录每个图书目录上次导入时的内容哈希，由 library.importer 维护"""
+    name = models.CharField(max_length=100, unique=True, verbose_name='图书目录')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+', verbose_name='图书')
+    digest = models.CharField(max_length=40, verbose_name='内容摘要')
+    # {相对路径: [变化标识, 内容哈希]}
+    members = models.JSONField(default=dict, verbose_name='文件哈希')
+    # {轮播图相对路径: BookImage ID}
+    images = models.JSONField(default=dict, verbose_name='轮播图记录')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'library_importmanifest'
+        verbose_name = '导入清单'
+        verbose_name_plural = '导入清单'
@@ -0,0 +1,133 @@
+# library/overdue.py
+"""逾期扫描与还书提醒
+
+借阅状态的分类全部在数据库中完成：统计只需一条按 due_date 条件计数的聚合查询，
+提醒按借阅者分组流式读取，并分块通过同一个邮件连接批量发送。
+"""
+from collections import namedtuple
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Case, Count, DateField, DurationField, ExpressionWrapper, F, Q, Value, When
+from django.utils import timezone
+
+from .models import BookCopy
+
+# 距应还日期不超过该天数的借阅视为"即将到期"
+DUE_SOON_DAYS = 2
+
+# 每次通过邮件连接发送的提醒数量
+REMINDER_CHUNK_SIZE = 500
+
+BUCKETS = ('overdue', 'due_today', 'due_soon', 'not_due')
+BUCKET_LABELS = {
+    'overdue': '已逾期',
+    'due_today': '今日到期',
+    'due_soon': '即将到期',
+    'not_due': '未到期',
+}
+
+# 需要发送提醒的分类
+REMINDER_BUCKETS = ('overdue', 'due_today', 'due_soon')
+
+SweepResult = namedtuple('SweepResult', ['counts', 'sent', 'skipped'])
+
+
+def active_loans():
+    """所有处于借出状态的副本"""
+    return BookCopy.objects.filter(is_available=False, due_date__isnull=False)
+
+
+def bucket_filters(today, due_soon_days=DUE_SOON_DAYS):
+    """各分类对应的 due_date 条件"""
+    soon = today + timezone.timedelta(days=due_soon_days)
+    return {
+        'overdue': Q(due_date__lt=today),
+        'due_today': Q(due_date=today),
+        'due_soon': Q(due_date__gt=today, due_date__lte=soon),
+        'not_due': Q(due_date__gt=soon),
+    }
+
+
+def classify_loans(today=None, due_soon_days=DUE_SOON_DAYS):
+    """用一条聚合查询统计各分类的借阅数量，返回 {分类: 数量}"""
+    today = today or timezone.localdate()
+    filters = bucket_filters(today, due_soon_days)
+    return active_loans().aggregate(**{
+        bucket: Count('id', filter=filters[bucket]) for bucket in BUCKETS
+    })
+
+
+def with_loan_status(queryset, today=None):
+    """为副本查询附加借阅状态（status）以及逾期/剩余时长（timedelta），在SQL中计算"""
+    today = timezone.localdate() if today is None else today
+    today_value = Value(today, output_field=DateField())
+    return queryset.annotate(
+        status=Case(
+            When(due_date__lt=today, then=Value('overdue')),
+            When(due_date=today, then=Value('due_today')),
+            default=Value('not_due'),
+        ),
+        days_overdue=ExpressionWrapper(today_value - F('due_date'), output_field=DurationField()),
+        days_remaining=ExpressionWrapper(F('due_date') - today_value, output_field=DurationField()),
+    )
+
+
+def iter_reminders(bucket, today=None, due_soon_days=DUE_SOON_DAYS):
+    """按借阅者生成提醒 (用户名, 邮箱, [(书名, 应还日期), ...])，流式读取不加载全部借阅"""
+    today = today or timezone.localdate()
+    rows = (
+        active_loans()
+        .filter(bucket_filters(today, due_soon_days)[bucket], borrower__isnull=False)
+        .order_by('borrower_id', 'due_date', 'id')
+        .values_list('borrower_id', 'borrower__username', 'borrower__email', 'book__title', 'due_date')
+        .iterator(chunk_size=2000)
+    )
+    for _, loans in groupby(rows, key=lambda row: row[0]):
+        loans = list(loans)
+        username, email = loans[0][1], loans[0][2]
+        yield username, email, [(title, due_date) for _, _, _, title, due_date in loans]
+
+
+def build_reminder(bucket, username, email, loans):
+    """构造一封提醒邮件"""
+    lines = [f'{username}，您好：', '', f'以下借阅{BUCKET_LABELS[bucket]}，请按时归还：', '']
+    lines += [f'  《{title}》 应还日期 {due_date}' for title, due_date in loans]
+    return EmailMessage(
+        subject=f'图书借阅提醒：{len(loans)} 本{BUCKET_LABELS[bucket]}',
+        body='\n'.join(lines),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[email],
+    )
+
+
+def send_reminders(bucket, today=None, due_soon_days=DUE_SOON_DAYS, chunk_size=REMINDER_CHUNK_SIZE):
+    """分块发送某一分类的提醒，返回 (已发送数, 无邮箱跳过数)"""
+    sent = skipped = 0
+    chunk = []
+    connection = get_connection()
+    for username, email, loans in iter_reminders(bucket, today, due_soon_days):
+        if not email:
+            skipped += 1
+            continue
+        chunk.append(build_reminder(bucket, username, email, loans))
+        if len(chunk) >= chunk_size:
+            sent += connection.send_messages(chunk) or 0
+            chunk = []
+    if chunk:
+        sent += connection.send_messages(chunk) or 0
+    return sent, skipped
+
+
+def sweep_overdue(today=None, due_soon_days=DUE_SOON_DAYS, buckets=REMINDER_BUCKETS,
+                  chunk_size=REMINDER_CHUNK_SIZE, send=True):
+    """统计各分类借阅数量并发送提醒，返回 SweepResult"""
+    today = today or timezone.localdate()
+    counts = classify_loans(today, due_soon_days)
+    sent, skipped = {}, {}
+    if send:
+        for bucket in buckets:
+            if counts[bucket]:
+                sent[bucket], skipped[bucket] = send_reminders(bucket, today, due_soon_days, chunk_size)
+    return SweepResult(counts, sent, skipped)
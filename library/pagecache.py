@@ -0,0 +1,90 @@
+# library/pagecache.py
+"""书目页面的片段缓存
+
+缓存书目卡片网格、详情页正文和轮播图片段的渲染结果，缓存后端由 LIBRARY_PAGE_CACHE
+指定的缓存别名决定。管理命令、后台任务所在的进程也会使片段失效，多进程部署须使用 Redis 等
+共享缓存；进程内的 locmem 只在单进程的开发环境中能及时失效。
+
+缓存键带有作用域版本号：图书变化时只需改写对应作用域的版本号，旧键自然失效，
+不必枚举分页等具体的缓存键。作用域有 list（书目列表）、book:<id>（图书信息）、
+gallery:<id>（轮播图）以及全局的 gen。可借数量、借阅/预约按钮等随借还和读者变化的部分不缓存。
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+GLOBAL_SCOPE = 'gen'
+LIST_SCOPE = 'list'
+
+
+def _cache():
+    return caches[settings.LIBRARY_PAGE_CACHE]
+
+
+def book_scope(book_id):
+    return f'book:{book_id}'
+
+
+def gallery_scope(book_id):
+    return f'gallery:{book_id}'
+
+
+def _version_key(scope):
+    return f'pagecache:v:{scope}'
+
+
+def _versions(scopes):
+    """读取各作用域的版本号；缺失（从未写入或被淘汰）时写入新的随机版本号"""
+    cache = _cache()
+    keys = [_version_key(scope) for scope in (GLOBAL_SCOPE, *scopes)]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        version = found.get(key)
+        if version is None:
+            # 随机版本号不会与被淘汰前的版本号相同，不会读到过期的片段
+            cache.add(key, uuid.uuid4().hex[:12], None)
+            version = cache.get(key)
+        versions.append(version)
+    return versions
+
+
+def get_or_build(name, scopes, build, *key):
+    """按 (片段名, 键, 作用域版本) 读取缓存，未命中时调用 build() 生成并写入"""
+    cache = _cache()
+    cache_key = ':'.join(['pagecache', name, *map(str, key), *_versions(scopes)])
+    value = cache.get(cache_key)
+    if value is None:
+        value = build()
+        cache.set(cache_key, value, settings.LIBRARY_PAGE_CACHE_TTL)
+    return value
+
+
+def _bump(scopes):
+    _cache().set_many({_version_key(scope): uuid.uuid4().hex[:12] for scope in scopes}, None)
+
+
+def invalidate(*scopes):
+    """使作用域下的全部片段失效
+
+    立即失效一次，事务提交后再失效一次，避免提交前并发请求把旧数据重新写入缓存。
+    """
+    _bump(scopes)
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def invalidate_books(book_ids, gallery=True):
+    """图书信息变化：书目列表、图书详情（以及轮播图）失效"""
+    scopes = [LIST_SCOPE]
+    for book_id in book_ids:
+        scopes.append(book_scope(book_id))
+        if gallery:
+            scopes.append(gallery_scope(book_id))
+    invalidate(*scopes)
+
+
+def invalidate_all():
+    """批量改写文件路径等无法逐本跟踪的操作之后，使全部页面片段失效"""
+    invalidate(GLOBAL_SCOPE)
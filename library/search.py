@@ -0,0 +1,130 @@
+# library/search.py
+"""图书全文检索
+
+在数据库中维护一张倒排索引表（SearchToken）：中文按相邻两字切分为二元词，
+英文/数字按单词切分。检索只需在 token 索引上做一次分组聚合，
+不依赖任何外部搜索服务，SQLite/MySQL 均可使用。
+"""
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import Book, SearchToken
+
+CJK_RANGES = r'\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+TOKEN_RE = re.compile(f'[{CJK_RANGES}]+|[^\\W_{CJK_RANGES}]+')
+CJK_RE = re.compile(f'[{CJK_RANGES}]')
+
+# 各字段命中时的权重
+FIELD_WEIGHTS = {
+    'title': 10,
+    'author': 5,
+    'keywords': 3,
+    'description': 1,
+}
+INDEXED_FIELDS = tuple(FIELD_WEIGHTS)
+MAX_TOKEN_LENGTH = 32
+DEFAULT_LIMIT = 50
+
+
+def fold(text):
+    """统一全半角和大小写并去掉重音符号（café -> cafe，ß -> ss）
+
+    MySQL 默认的排序规则不区分重音和大小写，不折叠时 cafe/café 会在唯一约束上冲突。
+    """
+    text = unicodedata.normalize('NFKD', unicodedata.normalize('NFKC', text).casefold())
+    return unicodedata.normalize('NFKC', ''.join(c for c in text if not unicodedata.combining(c)))
+
+
+def tokenize(text, index=False):
+    """把文本切分为检索词：中文二元切分，其他文字按单词折叠为小写无重音形式
+
+    index 为真时（建立索引）另外收录每段中文的末字：单字检索按前缀匹配二元词，
+    只出现在段末的字（如"闪闪的红心"的"心"）没有以它开头的二元词。
+    """
+    tokens = []
+    for run in TOKEN_RE.findall(fold(text or '')):
+        if CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+                if index:
+                    tokens.append(run[-1])
+        else:
+            tokens.append(run[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+def build_tokens(book):
+    """计算一本图书的 {检索词: 权重}"""
+    weights = Counter()
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(getattr(book, field), index=True):
+            weights[token] += weight
+    return weights
+
+
+def index_book(book):
+    """重建单本图书的索引项"""
+    index_books([book])
+
+
+def index_books(books):
+    """批量重建多本图书的索引项（用于批量导入等不触发 post_save 的场景）
+
+    折叠后仍可能被数据库排序规则视为相同的检索词（如 æ/ae）忽略重复，不让图书保存失败。
+    """
+    with transaction.atomic():
+        SearchToken.objects.filter(book__in=[book.pk for book in books]).delete()
+        SearchToken.objects.bulk_create([
+            SearchToken(token=token, book_id=book.pk, weight=weight)
+            for book in books
+            for token, weight in build_tokens(book).items()
+        ], batch_size=1000, ignore_conflicts=True)
+
+
+def rebuild_index(batch_size=1000):
+    """清空并重建全部索引，返回已索引的图书数量
+
+    在一个事务中完成，重建期间检索仍使用旧索引。
+    """
+    count = 0
+    with transaction.atomic():
+        SearchToken.objects.all().delete()
+        books = Book.objects.only('id', *INDEXED_FIELDS).order_by('id')
+        pending = []
+        for book in books.iterator(chunk_size=batch_size):
+            pending.extend(
+                SearchToken(token=token, book_id=book.pk, weight=weight)
+                for token, weight in build_tokens(book).items()
+            )
+            count += 1
+            if len(pending) >= batch_size:
+                SearchToken.objects.bulk_create(pending, batch_size=batch_size, ignore_conflicts=True)
+                pending = []
+        SearchToken.objects.bulk_create(pending, batch_size=batch_size, ignore_conflicts=True)
+    return count
+
+
+def search_books(query, limit=DEFAULT_LIMIT):
+    """检索图书，按命中的检索词数量和权重排序，返回 Book 列表"""
+    tokens = set(tokenize(query))
+    if not tokens:
+        return []
+
+    postings = SearchToken.objects.filter(token__in=tokens)
+    if len(tokens) == 1 and CJK_RE.match(next(iter(tokens))):
+        # 单个汉字：前缀匹配二元词（token 索引同样适用）
+        postings = SearchToken.objects.filter(token__startswith=next(iter(tokens)))
+
+    ranked = list(
+        postings.values('book')
+        .annotate(matched=Count('token'), score=Sum('weight'))
+        .order_by('-matched', '-score', 'book')[:limit]
+    )
+    books = Book.objects.in_bulk([row['book'] for row in ranked])
+    return [books[row['book']] for row in ranked if row['book'] in books]
@@ -0,0 +1,42 @@
+# library/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import pagecache, search, tasks
+from .utils import has_cover_derivatives
+from .models import Book, BookCopy, BookImage
+
+
+@receiver(post_save, sender=BookCopy)
+@receiver(post_delete, sender=BookCopy)
+def refresh_book_counters(sender, instance, **kwargs):
+    """副本通过 save()/delete() 增删改时，同步刷新所属图书的计数字段"""
+    Book.objects.filter(pk=instance.book_id).refresh_counters()
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    """图书保存后更新检索索引（删除时由外键级联清理）"""
+    search.index_book(instance)
+
+
+@receiver(post_save, sender=Book)
+def ensure_cover_derivatives(sender, instance, **kwargs):
+    """封面上传或更换后（新文件名尚无衍生图），交给后台任务生成多尺寸衍生图"""
+    name = instance.cover_image.name
+    if name and not has_cover_derivatives(name):
+        tasks.defer(tasks.build_cover_derivatives, name)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def invalidate_book_pages(sender, instance, **kwargs):
+    """图书增删改后，书目列表和该书的详情、轮播图片段失效"""
+    pagecache.invalidate_books([instance.pk])
+
+
+@receiver(post_save, sender=BookImage)
+@receiver(post_delete, sender=BookImage)
+def invalidate_gallery(sender, instance, **kwargs):
+    """轮播图增删改后只有该书的轮播图片段失效"""
+    pagecache.invalidate(pagecache.gallery_scope(instance.book_id))
@@ -0,0 +1,176 @@
+# library/stocktake.py
+"""书架盘点核对
+
+把扫描得到的副本ID（或 bookcopy:N 二维码内容）与数据库中的副本状态比对。
+扫描结果和数据库状态都放进按副本ID索引的位图（每个副本 1 bit），
+核对只是几次位运算，百万级副本也只占用约百余KB内存。
+"""
+import csv
+from collections import namedtuple
+
+from django.db.models import Max
+
+from .models import BookCopy
+from .utils import parse_qr_payload
+
+# 报告中保留的无法识别扫描内容示例数量
+MAX_SAMPLES = 20
+
+
+class Bitmap:
+    """定长位图，按整数ID置位"""
+
+    def __init__(self, size, value=0):
+        self.size = size
+        self.value = value
+
+    @classmethod
+    def from_ids(cls, size, ids):
+        bits = bytearray((size + 7) // 8)
+        for i in ids:
+            bits[i >> 3] |= 1 << (i & 7)
+        return cls(size, int.from_bytes(bits, 'little'))
+
+    def __and__(self, other):
+        return Bitmap(self.size, self.value & other.value)
+
+    def __or__(self, other):
+        return Bitmap(self.size, self.value | other.value)
+
+    def __sub__(self, other):
+        return Bitmap(self.size, self.value & ~other.value)
+
+    def __len__(self):
+        return self.value.bit_count()
+
+    def __iter__(self):
+        """按从小到大的顺序返回所有置位的ID"""
+        data = self.value.to_bytes((self.size + 7) // 8, 'little')
+        for index, byte in enumerate(data):
+            while byte:
+                low = byte & -byte
+                yield (index << 3) + low.bit_length() - 1
+                byte ^= low
+
+
+class ScanResult:
+    """读取扫描流的结果：位图之外只保留计数和少量示例"""
+
+    def __init__(self):
+        self.total = 0
+        self.invalid = 0
+        self.invalid_samples = []
+        self.out_of_range = 0
+
+
+StocktakeReport = namedtuple('StocktakeReport', [
+    'scanned',          # 扫描到的不同副本数
+    'duplicates',       # 重复扫描次数
+    'invalid',          # 无法识别的扫描内容数
+    'invalid_samples',
+    'missing',          # 应在架（可借或为预约保留）但未扫描到的副本
+    'on_loan',          # 扫描到但系统记录为借出、本应不在架的副本
+    'held',             # 扫描到的为预约保留的副本（不可借但应在架，不算异常）
+    'unexpected',       # 扫描到但不在盘点范围内（或已不存在）的副本
+    'out_of_range',     # 超出现有最大副本ID的扫描数，同样视为意外
+])
+
+
+def read_scans(lines, size, chunk_size=100000):
+    """逐行读取扫描内容并构建位图，返回 (扫描位图, ScanResult)
+
+    lines 可以是文件对象或任意字符串可迭代对象，按块置位以限制内存。
+    """
+    result = ScanResult()
+    scanned = Bitmap(size)
+    pending = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'ignore')
+        line = line.strip()
+        if not line:
+            continue
+        result.total += 1
+        copy_id = parse_qr_payload(line)
+        if copy_id is None:
+            result.invalid += 1
+            if len(result.invalid_samples) < MAX_SAMPLES:
+                result.invalid_samples.append(line)
+            continue
+        if copy_id >= size:
+            result.out_of_range += 1
+            continue
+        pending.append(copy_id)
+        if len(pending) >= chunk_size:
+            scanned = scanned | Bitmap.from_ids(size, pending)
+            pending = []
+    if pending:
+        scanned = scanned | Bitmap.from_ids(size, pending)
+    return scanned, result
+
+
+def load_copy_bitmaps(queryset, size, chunk_size=100000):
+    """按ID游标分块读取副本状态，返回 (全部副本位图, 可借副本位图, 预约保留副本位图)
+
+    只读取ID小于 size 的副本：size 在读取前确定，之后新建的副本不在本次盘点范围内。
+    预约保留的副本不可借但没有借阅者，应在预约书架上。
+    """
+    existing = Bitmap(size)
+    available = Bitmap(size)
+    reserved = Bitmap(size)
+    last_id = 0
+    while True:
+        rows = list(
+            queryset.filter(id__gt=last_id, id__lt=size).order_by('id')
+            .values_list('id', 'is_available', 'borrower_id')[:chunk_size]
+        )
+        if not rows:
+            break
+        existing = existing | Bitmap.from_ids(size, (copy_id for copy_id, _, _ in rows))
+        available = available | Bitmap.from_ids(size, (copy_id for copy_id, ok, _ in rows if ok))
+        reserved = reserved | Bitmap.from_ids(
+            size, (copy_id for copy_id, ok, borrower_id in rows if not ok and borrower_id is None)
+        )
+        last_id = rows[-1][0]
+    return existing, available, reserved
+
+
+def reconcile(lines, queryset=None):
+    """核对扫描结果与数据库，返回 StocktakeReport
+
+    queryset 可限定盘点范围（如某本图书的副本），默认盘点全部副本。
+    """
+    if queryset is None:
+        queryset = BookCopy.objects.all()
+    size = (BookCopy.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+
+    scanned, scan = read_scans(lines, size)
+    existing, available, reserved = load_copy_bitmaps(queryset, size)
+    unique = len(scanned)
+    return StocktakeReport(
+        scanned=unique,
+        duplicates=scan.total - scan.invalid - scan.out_of_range - unique,
+        invalid=scan.invalid,
+        invalid_samples=scan.invalid_samples,
+        missing=(available | reserved) - scanned,
+        on_loan=(existing - available - reserved) & scanned,
+        held=reserved & scanned,
+        unexpected=scanned - existing,
+        out_of_range=scan.out_of_range,
+    )
+
+
+REPORT_CATEGORIES = (
+    ('missing', '应在架未扫到'),
+    ('on_loan', '记录为借出却在架'),
+    ('unexpected', '范围外或不存在'),
+)
+
+
+def write_report_csv(report, fp):
+    """把各类异常副本逐行写入CSV（分类, 副本ID）"""
+    writer = csv.writer(fp)
+    writer.writerow(['category', 'copy_id'])
+    for category, _ in REPORT_CATEGORIES:
+        for copy_id in getattr(report, category):
+            writer.writerow([category, copy_id])
@@ -0,0 +1,95 @@
+# library/storage.py
+"""按内容寻址的媒体存储
+
+封面和轮播图以内容哈希命名（<上传目录>/<哈希前两位>/<哈希>.<扩展名>），
+内容相同的上传共用同一个文件，重复导入同一资源包不会再产生 xxx_AbCd123.jpg 这样的副本。
+文件被多少条记录引用由 reference_counts 按数据库实时统计，
+删除图书或图片时不直接删文件，由 gc_media 命令回收不再被引用的文件。
+"""
+import hashlib
+import os
+from collections import Counter
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.db.models import Count
+from django.utils.deconstruct import deconstructible
+
+HASH_LENGTH = 32
+
+
+def content_hash(content):
+    """按块计算文件内容哈希，计算后把文件指针移回开头"""
+    digest = hashlib.blake2b(digest_size=HASH_LENGTH // 2)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def hashed_name(name, digest):
+    """保留上传目录和扩展名，文件名换为内容哈希"""
+    directory = os.path.dirname(name)
+    ext = os.path.splitext(name)[1].lower()
+    return '/'.join(part for part in (directory, digest[:2], f'{digest}{ext}') if part)
+
+
+def is_hashed_name(name):
+    """判断存储路径是否已按内容哈希命名"""
+    parts = (name or '').split('/')
+    stem = os.path.splitext(parts[-1])[0]
+    return (
+        len(parts) >= 2 and len(stem) == HASH_LENGTH and parts[-2] == stem[:2]
+        and all(c in '0123456789abcdef' for c in stem)
+    )
+
+
+@deconstructible(path='library.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """保存时以内容哈希命名，已存在相同内容的文件时直接返回其路径，不再写入"""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        validate_file_name(name, allow_relative_path=True)
+        name = hashed_name(name, content_hash(content))
+        if self.exists(name):
+            # 刷新修改时间：重新引用的孤立文件不会被正在运行的 gc_media 当作过期文件删除
+            os.utime(self.path(name))
+            return name
+        # 并发写入同一内容时 _save 会退回到带随机后缀的文件名，只是少去一次重，不影响正确性
+        name = self._save(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        return name
+
+
+content_storage = ContentAddressedStorage()
+
+
+def media_fields():
+    """使用内容寻址存储的 (模型, 字段名) 列表"""
+    from .models import Book, BookImage
+    return [(Book, 'cover_image'), (BookImage, 'image')]
+
+
+def reference_counts():
+    """统计各文件被引用的次数，返回 Counter({存储路径: 引用数})"""
+    counts = Counter()
+    for model, field in media_fields():
+        rows = (
+            model.objects.exclude(**{field: ''}).filter(**{f'{field}__isnull': False})
+            .order_by().values(field).annotate(refs=Count('pk'))
+        )
+        for row in rows:
+            counts[row[field]] += row['refs']
+    return counts
+
+
+def is_referenced(name):
+    """文件当前是否仍被任一记录引用（gc_media 删除前逐个复查）"""
+    return any(model.objects.filter(**{field: name}).exists() for model, field in media_fields())
@@ -0,0 +1,112 @@
+# library/tasks.py
+"""后台任务
+
+封面渲染等耗时操作不应阻塞请求：任务在事务提交后交给进程内的线程池执行，
+LIBRARY_ASYNC_TASKS = False 时（如测试环境）在提交后同步执行。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from . import pagecache
+from .utils import generate_book_cover, generate_cover_derivatives, has_cover_derivatives
+
+_executor = None
+
+# 按需渲染封面的排队标记有效期（秒），渲染失败时过期后再次排队
+COVER_REQUEST_TTL = 10 * 60
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.LIBRARY_TASK_WORKERS,
+            thread_name_prefix='library-task',
+        )
+    return _executor
+
+
+def _run(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception as e:
+        print(f"后台任务 {func.__name__} 失败: {e}")
+    finally:
+        connections.close_all()
+
+
+def defer(func, *args):
+    """在当前事务提交后执行任务"""
+    def submit():
+        if settings.LIBRARY_ASYNC_TASKS:
+            _get_executor().submit(_run, func, *args)
+        else:
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"后台任务 {func.__name__} 失败: {e}")
+    transaction.on_commit(submit)
+
+
+def init_process(initializer=None, *initargs):
+    """进程池子进程的初始化：spawn 方式（macOS、Windows 的默认方式）启动的子进程
+    不继承父进程状态，导入 library.models 之前须先初始化 Django。
+
+    initializer 以导入路径传入，在 django.setup() 之后才导入其所在模块。
+    """
+    import django
+    django.setup()
+    if initializer:
+        import_string(initializer)(*initargs)
+
+
+def process_pool(workers, initializer=None, initargs=()):
+    """创建管理命令使用的进程池；子进程不使用父进程的数据库连接，创建前先关闭"""
+    connections.close_all()
+    path = f'{initializer.__module__}.{initializer.__qualname__}' if initializer else None
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_process, initargs=(path, *initargs))
+
+
+def render_book_cover(book_id):
+    """为没有封面的图书渲染文字封面，随后生成衍生图"""
+    from .models import Book
+
+    book = Book.objects.filter(pk=book_id).only('title', 'author', 'cover_image').first()
+    if book is None or book.cover_image:
+        return
+    name = f'book_covers/{book.title}_cover.png'
+    generate_book_cover(
+        title=book.title,
+        author=book.author,
+        output_path=os.path.join(settings.MEDIA_ROOT, name)
+    )
+    # 直接更新字段，避免再次触发 Book.save 的信号
+    Book.objects.filter(Q(cover_image='') | Q(cover_image__isnull=True), pk=book_id).update(cover_image=name)
+    generate_cover_derivatives(name)
+    # 衍生图写入后再失效，期间缓存的片段不会一直停留在没有 srcset 的原图上
+    pagecache.invalidate_books([book_id], gallery=False)
+
+
+def request_book_cover(book_id):
+    """没有封面的图书首次显示时排队渲染文字封面，渲染完成前显示占位图
+
+    用页面缓存的 add 占位，同一本书在 COVER_REQUEST_TTL 内只排队一次。
+    """
+    if caches[settings.LIBRARY_PAGE_CACHE].add(f'cover-request:{book_id}', True, COVER_REQUEST_TTL):
+        defer(render_book_cover, book_id)
+
+
+def build_cover_derivatives(name):
+    """为上传的封面生成多尺寸衍生图，并使使用该封面的图书片段失效"""
+    from .models import Book
+
+    if not has_cover_derivatives(name):
+        generate_cover_derivatives(name)
+        pagecache.invalidate_books(Book.objects.filter(cover_image=name).values_list('id', flat=True), gallery=False)
@@ -0,0 +1,39 @@
+# library/templatetags/cover_tags.py
+from django import template
+from django.templatetags.static import static
+
+from library import tasks
+from library.models import COVER_PLACEHOLDER, Book
+from library.utils import COVER_SIZES, cover_derivative_name, has_cover_derivatives
+
+register = template.Library()
+
+
+@register.inclusion_tag('library/cover_picture.html')
+def cover_picture(image, alt='', size='card', sizes='18rem', style=''):
+    """输出带 srcset 的 <picture>，衍生图尚未生成时直接使用原图，没有封面时使用占位图
+
+    图书没有封面时同时排队渲染文字封面。
+    """
+    context = {'alt': alt, 'sizes': sizes, 'style': style, 'src': static(COVER_PLACEHOLDER)}
+    if not image:
+        book = getattr(image, 'instance', None)
+        if isinstance(book, Book) and book.pk:
+            tasks.request_book_cover(book.pk)
+        return context
+    if not has_cover_derivatives(image.name, image.storage):
+        context['src'] = image.url
+        return context
+
+    def srcset(fmt):
+        return ', '.join(
+            f'{image.storage.url(cover_derivative_name(image.name, name, fmt))} {width}w'
+            for name, width in COVER_SIZES.items()
+        )
+
+    context.update({
+        'src': image.storage.url(cover_derivative_name(image.name, size, 'jpeg')),
+        'webp_srcset': srcset('webp'),
+        'jpeg_srcset': srcset('jpeg'),
+    })
+    return context
@@ -1,3 +1,1332 @@
-from django.test import TestCase
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zipfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DataError, connection
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from PIL import Image
+
+from . import circulation, holds, importer, loanstats, overdue, search, stocktake, tasks
+from .storage import content_storage, is_hashed_name, reference_counts
+from .models import Book, BookCopy, BookImage, Hold, ImportManifest, LoanDailyStat, LoanEvent, SearchToken, User
+from .utils import cover_derivative_name, has_cover_derivatives
+
+logger = logging.getLogger(__name__)
+
+
+class IsolatedStorageMixin:
+    """每个测试类使用独立的临时 MEDIA_ROOT 和进程内缓存，不写入真实的媒体目录和缓存
+
+    幂等记录的数据库缓存表位于测试数据库中，无需替换。
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        test_caches = {
+            **settings.CACHES,
+            'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f'{cls.__name__}-default',
+            },
+            'pages': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': f'{cls.__name__}-pages',
+            },
+        }
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root, CACHES=test_caches))
+        super().setUpClass()
+
+    def mkdtemp(self):
+        """创建临时目录，测试结束后删除"""
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        return path
+
+
+def create_book(title='测试图书', copies=1, **kwargs):
+    """创建测试图书，提供封面以跳过封面生成"""
+    kwargs.setdefault('author', '测试作者')
+    kwargs.setdefault('description', '')
+    kwargs.setdefault('cover_image', f'book_covers/{title}_cover.png')
+    return Book.objects.create(title=title, copies_count=copies, **kwargs)
+
+
+def deferred_tasks(callbacks):
+    """提交后回调中由 tasks.defer 排入的后台任务（不含页面缓存失效等回调）"""
+    return [callback for callback in callbacks if callback.__qualname__.startswith('defer.')]
+
+
+class CirculationTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.book = create_book(copies=2)
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+
+    def test_borrow_and_return(self):
+        loan = circulation.borrow_available_copy(self.book.id, self.alice, days=3)
+        self.assertIsNotNone(loan)
+        copy = BookCopy.objects.get(pk=loan.copy_id)
+        self.assertFalse(copy.is_available)
+        self.assertEqual(copy.borrower, self.alice)
+        self.assertEqual(copy.due_date, loan.due_date)
+
+        self.assertIsNone(circulation.return_book_copy(self.book.id, self.bob))
+        self.assertEqual(circulation.return_book_copy(self.book.id, self.alice), loan.copy_id)
+        copy.refresh_from_db()
+        self.assertTrue(copy.is_available)
+        self.assertIsNone(copy.borrower)
+
+    def test_borrow_copy_only_once(self):
+        copy = self.book.copies.first()
+        self.assertIsNotNone(circulation.borrow_copy(copy.id, self.alice))
+        self.assertIsNone(circulation.borrow_copy(copy.id, self.bob))
+        self.assertFalse(circulation.return_copy(copy.id, self.bob))
+
+    def test_no_copy_left(self):
+        circulation.borrow_available_copy(self.book.id, self.alice)
+        circulation.borrow_available_copy(self.book.id, self.alice)
+        self.assertIsNone(circulation.borrow_available_copy(self.book.id, self.bob))
+
+    def test_scan_toggles_borrow_and_return(self):
+        copy = self.book.copies.first()
+        self.client.force_login(self.alice)
+        response = self.client.post(f'/scan/{copy.id}/').json()
+        self.assertEqual(response['action'], 'borrow')
+        response = self.client.post(f'/scan/{copy.id}/').json()
+        self.assertEqual(response['action'], 'return')
+
+        circulation.borrow_copy(copy.id, self.bob)
+        response = self.client.post(f'/scan/{copy.id}/').json()
+        self.assertFalse(response['success'])
+
+
+class LoanEventTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.book = create_book(copies=2)
+        self.alice = User.objects.create_user('alice', password='pw')
+
+    def test_events_follow_circulation(self):
+        loan = circulation.borrow_available_copy(self.book.id, self.alice)
+        circulation.return_book_copy(self.book.id, self.alice)
+        # 失败的借还不写日志
+        self.assertFalse(circulation.return_copy(loan.copy_id, self.alice))
+        events = list(LoanEvent.objects.order_by('id').values_list('action', 'book_id', 'copy_id', 'user_id'))
+        self.assertEqual(events, [
+            (LoanEvent.BORROW, self.book.id, loan.copy_id, self.alice.id),
+            (LoanEvent.RETURN, self.book.id, loan.copy_id, self.alice.id),
+        ])
+
+    def test_rollup_is_incremental(self):
+        copy_ids = list(self.book.copies.values_list('id', flat=True))
+        for copy_id in copy_ids:
+            circulation.borrow_copy(copy_id, self.alice)
+        # 刚写入的事件可能还有更小ID的事件未提交，等过了 lag 才汇总
+        loanstats.rollup_loan_stats(batch_size=1)
+        self.assertFalse(LoanDailyStat.objects.exists())
+        loanstats.rollup_loan_stats(batch_size=1, lag=timezone.timedelta(0))
+        circulation.return_copy(copy_ids[0], self.alice)
+        out = StringIO()
+        call_command('rollup_loan_stats', top=1, lag=0, stdout=out)
+        self.assertIn('测试图书', out.getvalue())
+
+        stat = LoanDailyStat.objects.get(book=self.book)
+        self.assertEqual((stat.borrows, stat.returns, stat.on_loan), (2, 1, 1))
+        self.assertEqual(stat.utilization, 0.5)
+        # 没有新事件时重跑不会重复计数
+        loanstats.rollup_loan_stats(lag=timezone.timedelta(0))
+        self.assertEqual(LoanDailyStat.objects.get(book=self.book).borrows, 2)
+
+        # 次日的事件写入新的汇总行，日终借出数接续前一天
+        event = LoanEvent.objects.create(
+            action=LoanEvent.RETURN, book=self.book, copy_id=copy_ids[1], user=self.alice,
+            timestamp=timezone.now() + timezone.timedelta(days=1),
+        )
+        loanstats.rollup_loan_stats(lag=timezone.timedelta(days=-2))
+        latest = LoanDailyStat.objects.filter(book=self.book).latest('date')
+        self.assertEqual(latest.date, timezone.localtime(event.timestamp).date())
+        self.assertEqual((latest.returns, latest.on_loan), (1, 0))
+
+    def test_first_rollup_seeds_loans_from_before_the_log(self):
+        first, second = self.book.copies.order_by('id')
+        # 事件日志启用前借出的副本
+        circulation.borrow_copy(first.id, self.alice)
+        LoanEvent.objects.all().delete()
+        circulation.borrow_copy(second.id, self.alice)
+        circulation.return_copy(first.id, self.alice)
+
+        loanstats.rollup_loan_stats(lag=timezone.timedelta(0))
+        baseline, today = LoanDailyStat.objects.filter(book=self.book).order_by('date')
+        self.assertEqual((baseline.borrows, baseline.on_loan), (0, 1))
+        self.assertEqual((today.borrows, today.returns, today.on_loan), (1, 1, 1))
+
+    def test_rollup_skips_deleted_books(self):
+        other = create_book(title='已删除', copies=1)
+        circulation.borrow_available_copy(other.id, self.alice)
+        circulation.borrow_available_copy(self.book.id, self.alice)
+        other.delete()
+        position, groups = loanstats.rollup_loan_stats(lag=timezone.timedelta(0))
+        self.assertEqual(position, LoanEvent.objects.latest('id').id)
+        self.assertEqual(groups, 1)
+        self.assertEqual(list(LoanDailyStat.objects.values_list('book_id', 'borrows')), [(self.book.id, 1)])
+
+
+class HoldQueueTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.book = create_book(copies=1)
+        self.copy_id = self.book.copies.get().id
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(name, password='pw') for name in ('alice', 'bob', 'carol')
+        )
+        circulation.borrow_copy(self.copy_id, self.alice)
+
+    def test_return_allocates_to_queue_head(self):
+        bob_hold, created = holds.place_hold(self.book.id, self.bob)
+        self.assertTrue(created)
+        self.assertEqual(holds.place_hold(self.book.id, self.bob), (bob_hold, False))
+        carol_hold, _ = holds.place_hold(self.book.id, self.carol)
+        with self.assertNumQueries(1):
+            self.assertEqual(holds.queue_position(carol_hold), 2)
+
+        circulation.return_copy(self.copy_id, self.alice)
+        bob_hold.refresh_from_db()
+        self.assertEqual((bob_hold.status, bob_hold.copy_id), (Hold.READY, self.copy_id))
+        self.assertEqual(holds.queue_position(carol_hold), 1)
+        # 保留的副本不计入可借，也不能被其他读者借走
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 0)
+        self.assertIsNone(circulation.borrow_available_copy(self.book.id, self.carol))
+
+        self.client.force_login(self.bob)
+        response = self.client.post(f'/book/{self.book.id}/borrow/')
+        self.assertTrue(response.json()['success'])
+        bob_hold.refresh_from_db()
+        self.assertEqual(bob_hold.status, Hold.FULFILLED)
+        self.assertEqual(BookCopy.objects.get(id=self.copy_id).borrower, self.bob)
+
+    def test_expired_hold_passes_copy_on(self):
+        bob_hold, _ = holds.place_hold(self.book.id, self.bob)
+        carol_hold, _ = holds.place_hold(self.book.id, self.carol)
+        circulation.return_copy(self.copy_id, self.alice)
+
+        Hold.objects.filter(pk=bob_hold.pk).update(expires_at=timezone.now() - timezone.timedelta(minutes=1))
+        out = StringIO()
+        call_command('reap_holds', stdout=out)
+        self.assertIn('已回收 1 个', out.getvalue())
+        carol_hold.refresh_from_db()
+        self.assertEqual(carol_hold.status, Hold.READY)
+
+        # 最后一位取消后副本恢复可借
+        self.assertTrue(holds.cancel_hold(carol_hold.id, self.carol))
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_count, 1)
+        self.assertTrue(BookCopy.objects.get(id=self.copy_id).is_available)
+
+    def test_hold_views(self):
+        self.client.force_login(self.bob)
+        response = self.client.get(f'/book/{self.book.id}/')
+        self.assertContains(response, '预约')
+        data = self.client.post(f'/book/{self.book.id}/hold/').json()
+        self.assertEqual((data['success'], data['position']), (True, 1))
+        self.assertContains(self.client.get(f'/book/{self.book.id}/'), '预约排队第 1 位')
+        self.assertTrue(self.client.post(f'/holds/{data["hold_id"]}/cancel/').json()['success'])
+
+
+class CirculationBatchTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('root', password='pw')
+        self.student = User.objects.create_user('student', password='pw')
+        self.books = [create_book(title=f'班级图书{i}', copies=2) for i in range(20)]
+        self.copy_ids = list(BookCopy.objects.order_by('id').values_list('id', flat=True))
+        self.client.force_login(self.admin)
+
+    def post(self, **data):
+        return self.client.post('/api/circulation/batch/', json.dumps(data), content_type='application/json')
+
+    def test_class_set_checkout_and_return(self):
+        # 读取副本 + 保存点2次 + 更新副本、更新计数、写入日志各1次，与副本数量无关
+        with self.assertNumQueries(6):
+            circulation.batch_borrow(self.copy_ids, self.student)
+        circulation.batch_return(self.copy_ids, self.student)
+
+        response = self.post(patron='student', action='borrow', copy_ids=self.copy_ids[:39] + [f'bookcopy:{self.copy_ids[39]}'])
+        data = response.json()
+        self.assertEqual(data['summary'], {'borrowed': 40})
+        self.assertEqual(BookCopy.objects.filter(borrower=self.student).count(), 40)
+        self.assertEqual(Book.objects.filter(available_count=0).count(), 20)
+
+        data = self.post(patron=self.student.id, action='return', copy_ids=self.copy_ids[:2] + ['x', 99999999]).json()
+        self.assertEqual(data['summary'], {'returned': 2, 'invalid': 1, 'missing': 1})
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].available_count, 2)
+        self.assertEqual(LoanEvent.objects.filter(action=LoanEvent.RETURN, user=self.student).count(), 42)
+
+    def test_partial_conflicts_and_holds(self):
+        other = User.objects.create_user('other', password='pw')
+        circulation.borrow_copy(self.copy_ids[0], other)
+        data = self.post(patron='student', action='borrow', copy_ids=self.copy_ids[:3]).json()
+        self.assertEqual([item['status'] for item in data['results']], ['unavailable', 'borrowed', 'borrowed'])
+
+        # 归还时有预约的图书直接保留给队首
+        holds.place_hold(self.books[0].id, other)
+        Book.objects.filter(pk=self.books[0].pk).update(available_count=0)
+        data = self.post(patron='student', action='return', copy_ids=self.copy_ids[:3]).json()
+        self.assertEqual(data['summary'], {'not_borrowed': 1, 'returned': 2})
+        self.assertEqual(Hold.objects.get(user=other).copy_id, self.copy_ids[1])
+        self.books[0].refresh_from_db()
+        self.assertEqual(self.books[0].available_count, 0)
+
+    def test_requires_admin_and_valid_body(self):
+        self.assertEqual(self.post(patron='student', action='steal', copy_ids=[]).status_code, 400)
+        self.assertEqual(self.post(patron='nobody', action='borrow', copy_ids=[]).status_code, 404)
+        self.client.force_login(self.student)
+        self.assertFalse(self.post(patron='student', action='borrow', copy_ids=self.copy_ids).json()['success'])
+
+
+class IdempotencyKeyTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        caches[settings.LIBRARY_IDEMPOTENCY_CACHE].clear()
+        self.book = create_book(copies=2)
+        self.copy_id = self.book.copies.order_by('id').first().id
+        self.alice = User.objects.create_user('alice', password='pw')
+        self.client.force_login(self.alice)
+
+    def test_retried_scan_does_not_toggle_back(self):
+        url = f'/scan/{self.copy_id}/'
+        first = self.client.post(url, headers={'Idempotency-Key': 'scan-1'})
+        self.assertEqual(first.json()['action'], 'borrow')
+        # 重试只读取会话、用户和幂等记录，不再执行借还
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.client.post(url, headers={'Idempotency-Key': 'scan-1'})
+        self.assertFalse([q['sql'] for q in queries if 'library_book' in q['sql']])
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(BookCopy.objects.get(id=self.copy_id).borrower, self.alice)
+        # 新的键才会执行归还
+        self.assertEqual(self.client.post(url, headers={'Idempotency-Key': 'scan-2'}).json()['action'], 'return')
+
+    def test_redirect_replay_and_key_reuse(self):
+        circulation.borrow_available_copy(self.book.id, self.alice)
+        url = f'/book/{self.book.id}/return/'
+        first = self.client.post(url, headers={'Idempotency-Key': 'ret-1'})
+        retry = self.client.post(url, headers={'Idempotency-Key': 'ret-1'})
+        self.assertEqual((retry.status_code, retry['Location']), (302, first['Location']))
+        self.assertEqual(LoanEvent.objects.filter(action=LoanEvent.RETURN).count(), 1)
+
+        borrow = f'/book/{self.book.id}/borrow/'
+        self.client.post(borrow, {'days': 7}, headers={'Idempotency-Key': 'b-1'})
+        response = self.client.post(borrow, {'days': 14}, headers={'Idempotency-Key': 'b-1'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(BookCopy.objects.filter(borrower=self.alice).count(), 1)
+
+
+class BookCounterTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.book = create_book(copies=3)
+        self.user = User.objects.create_user('alice', password='pw')
+
+    def assertCounters(self, total, available):
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.total_count, self.book.available_count), (total, available))
+
+    def test_counters_follow_circulation(self):
+        self.assertCounters(3, 3)
+        loan = circulation.borrow_available_copy(self.book.id, self.user)
+        self.assertCounters(3, 2)
+        circulation.return_copy(loan.copy_id, self.user)
+        self.assertCounters(3, 3)
+
+    def test_counters_follow_copy_create_and_delete(self):
+        BookCopy.objects.create(book=self.book, is_available=False)
+        self.assertCounters(4, 3)
+        self.book.copies.filter(is_available=True).first().delete()
+        self.assertCounters(3, 2)
+
+    def test_reconcile_counters_repairs_drift(self):
+        Book.objects.filter(pk=self.book.pk).update(total_count=10, available_count=0)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('已校正 1 本图书', out.getvalue())
+        self.assertCounters(3, 3)
+
+
+@override_settings(BOOK_LIST_PAGE_SIZE=2)
+class BookListPaginationTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.books = [create_book(title=f'图书{i}') for i in range(5)]
+
+    def test_api_walks_catalog_by_cursor(self):
+        seen = []
+        after = 0
+        while after is not None:
+            data = self.client.get('/api/books/', {'after': after}).json()
+            self.assertLessEqual(len(data['books']), 2)
+            seen.extend(book['id'] for book in data['books'])
+            after = data['next']
+        self.assertEqual(seen, [book.id for book in self.books])
+        self.assertEqual(set(data['books'][0]), {'id', 'title', 'author', 'cover_url', 'detail_url'})
+
+    def test_book_list_renders_one_page(self):
+        response = self.client.get('/')
+        self.assertEqual(len(response.context['books']), 2)
+        self.assertEqual(response.context['next_cursor'], self.books[1].id)
+        response = self.client.get('/', {'after': self.books[3].id})
+        self.assertEqual([book.id for book in response.context['books']], [self.books[4].id])
+        self.assertIsNone(response.context['next_cursor'])
+
+
+class PageCacheTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        caches[settings.LIBRARY_PAGE_CACHE].clear()
+        self.book = create_book('小熊', copies=1)
+
+    def test_book_list_cached_until_book_changes(self):
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get('/'), '小熊')
+        self.book.title = '大熊'
+        self.book.save()
+        self.assertContains(self.client.get('/'), '大熊')
+
+    def test_detail_body_and_gallery_cached(self):
+        url = f'/book/{self.book.id}/'
+        self.client.get(url)
+        # 命中缓存时只查询图书本身，不再查询轮播图
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get(url), '<span id="totalPages">1</span>', html=True)
+        BookImage.objects.create(book=self.book, image=SimpleUploadedFile('a.png', image_bytes()))
+        BookImage.objects.create(book=self.book, image=SimpleUploadedFile('b.png', image_bytes(color=(0, 0, 0))))
+        self.assertContains(self.client.get(url), '<span id="totalPages">2</span>', html=True)
+
+    def test_fragments_refreshed_after_cover_derivatives(self):
+        name = save_test_image('book_covers/late.png', fmt='PNG')
+        create_book('晚到的封面', cover_image=name)
+        self.assertNotIn(cover_derivative_name(name, 'thumb', 'webp'), self.client.get('/').content.decode())
+        # 后台任务写入衍生图后，缓存的书目列表换用 srcset
+        tasks.build_cover_derivatives(name)
+        self.assertIn(cover_derivative_name(name, 'thumb', 'webp'), self.client.get('/').content.decode())
+
+    def test_per_user_parts_not_cached(self):
+        url = f'/book/{self.book.id}/'
+        alice = User.objects.create_user('alice', password='pw')
+        self.client.force_login(alice)
+        self.assertContains(self.client.get(url), '可借副本: 1')
+        # 借还走条件 UPDATE，不触发信号，可借数量和按钮仍是最新的
+        circulation.borrow_available_copy(self.book.id, alice, days=7)
+        response = self.client.get(url)
+        self.assertContains(response, '可借副本: 0')
+        self.assertContains(response, 'handleReturn()')
+
+
+class SearchTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.dragon = create_book(title='小恐龙的大冒险', author='王小明', keywords='恐龙, 冒险')
+        self.candy = create_book(title='爱吃糖的大狮子', author='Anna Smith', description='A lion who loves candy')
+
+    def test_tokenize_mixes_cjk_bigrams_and_words(self):
+        self.assertEqual(search.tokenize('大狮子 Lion-King'), ['大狮', '狮子', 'lion', 'king'])
+
+    def test_single_character_at_end_of_run(self):
+        book = create_book(title='闪闪的红心')
+        for query in ('心', '红', '红心', '闪'):
+            self.assertEqual(search.search_books(query), [book], query)
+        # 末字只用于单字检索，不影响多字检索的词
+        self.assertEqual(search.tokenize('红心'), ['红心'])
+
+    def test_tokens_fold_accents_and_case(self):
+        # MySQL 不区分重音的排序规则下 cafe/café 是同一个值，索引前先折叠
+        self.assertEqual(search.tokenize('Café CAFE Straße ＡＢＣ'), ['cafe', 'cafe', 'strasse', 'abc'])
+        book = create_book(title='Café cafe', author='Straße Strasse')
+        self.assertEqual(
+            sorted(book.search_tokens.values_list('token', 'weight')), [('cafe', 20), ('strasse', 10)]
+        )
+        self.assertEqual(search.search_books('CAFÉ'), [book])
+
+    def test_search_ranks_title_matches_first(self):
+        self.assertEqual(search.search_books('恐龙'), [self.dragon])
+        self.assertEqual(search.search_books('candy'), [self.candy])
+        self.assertEqual(search.search_books('smith 狮子'), [self.candy])
+        self.assertEqual(set(search.search_books('大')), {self.dragon, self.candy})
+        self.assertEqual(search.search_books('   '), [])
+
+    def test_index_follows_save_and_delete(self):
+        self.candy.title = '会飞的大象'
+        self.candy.save()
+        self.assertEqual(search.search_books('狮子'), [])
+        self.assertEqual(search.search_books('大象'), [self.candy])
+        self.candy.delete()
+        self.assertEqual(search.search_books('大象'), [])
+
+    def test_rebuild_index(self):
+        SearchToken.objects.all().delete()
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(search.search_books('冒险'), [self.dragon])
+
+    def test_search_view(self):
+        response = self.client.get('/search/', {'q': '恐龙'})
+        self.assertEqual(list(response.context['books']), [self.dragon])
+
+
+def save_test_image(name, size=(1240, 1754), fmt='BMP'):
+    """向媒体存储写入一张测试图片，返回存储路径"""
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 100, 50)).save(buffer, fmt)
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+@override_settings(LIBRARY_ASYNC_TASKS=False)
+class CoverDerivativeTests(IsolatedStorageMixin, TestCase):
+    def test_derivatives_generated_after_commit(self):
+        name = save_test_image('book_covers/upload.bmp')
+        with self.captureOnCommitCallbacks(execute=True):
+            book = create_book(cover_image=name)
+        self.assertTrue(has_cover_derivatives(name))
+        with default_storage.open(cover_derivative_name(name, 'card', 'webp')) as f:
+            self.assertEqual(Image.open(f).size, (320, 452))
+
+        html = self.client.get('/').content.decode()
+        self.assertIn(cover_derivative_name(name, 'thumb', 'webp'), html)
+        self.assertIn('320w', html)
+        self.assertIn(book.title, html)
+
+    def test_backfill_command(self):
+        name = save_test_image('book_covers/legacy.png', fmt='PNG')
+        create_book(cover_image=name)
+        self.assertFalse(has_cover_derivatives(name))
+        out = StringIO()
+        call_command('generate_cover_derivatives', stdout=out)
+        self.assertTrue(has_cover_derivatives(name))
+        self.assertIn('成功: 1', out.getvalue())
+
+
+class DeferredCoverTests(IsolatedStorageMixin, TestCase):
+    def test_save_does_not_render_cover(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            book = Book.objects.create(title='无封面', author='作者', description='')
+        self.assertEqual(len(deferred_tasks(callbacks)), 1)
+        self.assertFalse(book.cover_image)
+        self.assertTrue(book.cover_url.endswith('img/cover_placeholder.svg'))
+        self.assertContains(self.client.get(f'/book/{book.id}/'), 'cover_placeholder.svg')
+
+
+class ImageNormalizationTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.book = create_book()
+
+    def test_upload_is_resized_and_transcoded(self):
+        upload = SimpleUploadedFile('big.bmp', image_bytes(size=(3200, 1000), fmt='BMP'))
+        image = BookImage.objects.create(book=self.book, image=upload)
+        self.assertTrue(image.image.name.startswith('book_gallery/'))
+        self.assertTrue(image.image.name.endswith('.webp'))
+        self.assertEqual((image.width, image.height), (1600, 500))
+        with image.image.open() as f:
+            self.assertEqual((Image.open(f).format, Image.open(f).size), ('WEBP', (1600, 500)))
+
+    def test_exif_orientation_applied_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # 需顺时针旋转90度
+        buffer = BytesIO()
+        Image.new('RGB', (300, 100)).save(buffer, 'JPEG', exif=exif)
+        self.book.cover_image = SimpleUploadedFile('photo.jpg', buffer.getvalue())
+        self.book.save()
+        self.assertEqual((self.book.cover_width, self.book.cover_height), (100, 300))
+        with self.book.cover_image.open() as f:
+            self.assertNotIn('exif', Image.open(f).info)
+
+    @override_settings(LIBRARY_IMAGE_NORMALIZE=False)
+    def test_disabled_keeps_original(self):
+        upload = SimpleUploadedFile('big.png', image_bytes(size=(2000, 100)))
+        image = BookImage.objects.create(book=self.book, image=upload)
+        self.assertTrue(image.image.name.endswith('.png'))
+        self.assertEqual((image.width, image.height), (2000, 100))
+
+    @override_settings(LIBRARY_ASYNC_TASKS=False)
+    def test_backfill_command(self):
+        cover = save_test_image('book_covers/legacy.png', size=(2000, 1000), fmt='PNG')
+        Book.objects.filter(pk=self.book.pk).update(cover_image=cover)
+        done = BookImage.objects.create(book=self.book, image='book_gallery/done.webp', width=10, height=10)
+        legacy = BookImage.objects.create(book=self.book, image=save_test_image('book_gallery/legacy.jpg', fmt='JPEG'))
+        self.assertIsNone(legacy.width)
+
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('normalize_media', stdout=out)
+        self.assertIn('成功: 2', out.getvalue())
+        self.book.refresh_from_db()
+        legacy.refresh_from_db()
+        self.assertTrue(is_hashed_name(self.book.cover_image.name))
+        self.assertTrue(self.book.cover_image.name.endswith('.webp'))
+        self.assertEqual((self.book.cover_width, self.book.cover_height), (1600, 800))
+        self.assertTrue(has_cover_derivatives(self.book.cover_image.name))
+        self.assertEqual((legacy.width, legacy.height), (1131, 1600))
+        self.assertEqual(BookImage.objects.get(pk=done.pk).image.name, 'book_gallery/done.webp')
+
+        out = StringIO()
+        call_command('normalize_media', stdout=out)
+        self.assertIn('成功: 0', out.getvalue())
+
+
+class MediaDedupTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.book = create_book()
+
+    def add_image(self, data, name='photo.png'):
+        return BookImage.objects.create(book=self.book, image=SimpleUploadedFile(name, data))
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.add_image(image_bytes(), 'a.png')
+        second = self.add_image(image_bytes(), 'b.png')
+        third = self.add_image(image_bytes(color=(0, 0, 0)), 'a.png')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, third.image.name)
+        self.assertTrue(is_hashed_name(first.image.name))
+        self.assertEqual(reference_counts()[first.image.name], 2)
+
+    def test_gc_removes_only_orphans(self):
+        shared = self.add_image(image_bytes())
+        self.add_image(image_bytes())
+        orphan = self.add_image(image_bytes(color=(0, 0, 0)))
+        shared.delete()
+        orphan.delete()
+        self.assertTrue(content_storage.exists(orphan.image.name))
+
+        out = StringIO()
+        call_command('gc_media', min_age=1, stdout=out)
+        self.assertIn('已回收 0 个文件', out.getvalue())
+        call_command('gc_media', min_age=0, dry_run=True, stdout=StringIO())
+        self.assertTrue(content_storage.exists(orphan.image.name))
+
+        call_command('gc_media', min_age=0, stdout=StringIO())
+        self.assertFalse(content_storage.exists(orphan.image.name))
+        self.assertTrue(content_storage.exists(shared.image.name))
+
+    def test_gc_keeps_files_referenced_again(self):
+        orphan = self.add_image(image_bytes(color=(0, 0, 0)))
+        orphan.delete()
+        path = content_storage.path(orphan.image.name)
+        old = time.time() - 48 * 3600
+        os.utime(path, (old, old))
+
+        # 相同内容再次上传时刷新修改时间，不会按过期文件回收
+        again = self.add_image(image_bytes(color=(0, 0, 0)))
+        self.assertEqual(again.image.name, orphan.image.name)
+        self.assertGreater(os.path.getmtime(path), old)
+
+        # 引用统计之后才出现的记录在删除前复查
+        os.utime(path, (old, old))
+        with mock.patch('library.management.commands.gc_media.reference_counts', return_value=Counter()):
+            call_command('gc_media', stdout=StringIO())
+        self.assertTrue(content_storage.exists(again.image.name))
+
+    @override_settings(LIBRARY_ASYNC_TASKS=False)
+    def test_rehash_merges_legacy_duplicates(self):
+        legacy = [save_test_image('book_gallery/闪闪的红心.jpeg', size=(40, 40), fmt='JPEG') for _ in range(2)]
+        self.assertNotEqual(legacy[0], legacy[1])
+        for name in legacy:
+            BookImage.objects.create(book=self.book, image=name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('gc_media', rehash=True, min_age=0, stdout=StringIO())
+        names = set(BookImage.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(is_hashed_name(names.pop()))
+        self.assertFalse(any(default_storage.exists(name) for name in legacy))
+
+
+def image_bytes(size=(64, 90), fmt='PNG', color=(200, 100, 50)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def write_book_archive(path, books):
+    """写入 bulk_upload_books 格式的ZIP：books 为 {书名: (元数据, 轮播图片数)}"""
+    with zipfile.ZipFile(path, 'w') as archive:
+        for title, (metadata, gallery) in books.items():
+            archive.writestr(f'{title}/', b'')
+            if metadata is not None:
+                archive.writestr(f'{title}/图书信息.json', json.dumps(metadata, ensure_ascii=False))
+            archive.writestr(f'{title}/封面.png', image_bytes())
+            for i in range(gallery):
+                archive.writestr(f'{title}/轮播/{i:02d}.jpg', image_bytes(fmt='JPEG', color=(i * 40, 0, 0)))
+        archive.writestr('说明.txt', '顶层文件会被忽略')
+
+
+class BulkUploadTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.archive = os.path.join(self.mkdtemp(), 'books.zip')
+        write_book_archive(self.archive, {
+            '小熊': ({'author': '甲', 'description': '', 'copies_count': 2}, 2),
+            '月亮': ({'author': '乙', 'description': ''}, 0),
+            '无信息': (None, 1),
+        })
+
+    def test_index_groups_members_by_book(self):
+        with zipfile.ZipFile(self.archive) as archive:
+            index = importer.index_zip(archive)
+        self.assertEqual(list(index), ['小熊', '月亮', '无信息'])
+        self.assertEqual(sorted(index['小熊']), ['图书信息.json', '封面.png', '轮播/00.jpg', '轮播/01.jpg'])
+
+    def test_zip_import(self):
+        with zipfile.ZipFile(self.archive, 'a') as archive:
+            # 图片损坏、元数据无效的图书各自失败，不影响同批的其他图书
+            archive.writestr('坏图/图书信息.json', '{"author": "丙"}')
+            archive.writestr('坏图/封面.png', b'not an image')
+            archive.writestr('坏数据/图书信息.json', '{"author": "丁", "copies_count": "两本"}')
+        out = StringIO()
+        call_command('bulk_upload_books', self.archive, batch_size=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn('处理 无信息 失败', output)
+        self.assertIn('处理 坏图 失败: 图片 封面.png 无法识别', output)
+        self.assertIn('处理 坏数据 失败', output)
+        self.assertIn('成功: 2，失败: 3，未变化跳过: 0', output)
+        self.assertIn('本/秒', output)
+
+        book = Book.objects.get(title='小熊')
+        self.assertEqual((book.author, book.total_count, book.available_count), ('甲', 2, 2))
+        self.assertTrue(book.cover_image.name.startswith('book_covers/'))
+        self.assertTrue(is_hashed_name(book.cover_image.name))
+        self.assertTrue(book.cover_image.name.endswith('.webp'))
+        self.assertEqual((book.cover_width, book.cover_height), (64, 90))
+        self.assertEqual(list(book.images.values_list('caption', flat=True)), ['00', '01'])
+        image = book.images.first()
+        self.assertEqual((image.width, image.height), (64, 90))
+        with image.image.open() as f:
+            self.assertEqual(Image.open(f).format, 'WEBP')
+        self.assertEqual([b.title for b in search.search_books('小熊')], ['小熊'])
+        self.assertFalse(Book.objects.filter(title__in=['无信息', '坏图', '坏数据']).exists())
+
+        # 再次导入已存在的图书时只替换封面和轮播图
+        call_command('bulk_upload_books', self.archive, stdout=StringIO())
+        self.assertEqual(Book.objects.filter(title='小熊').count(), 1)
+        self.assertEqual(BookImage.objects.filter(book__title='小熊').count(), 2)
+
+    def test_reimport_touches_only_changed_images(self):
+        source = self.mkdtemp()
+        with zipfile.ZipFile(self.archive) as archive:
+            archive.extractall(source)
+        call_command('bulk_upload_books', source, stdout=StringIO())
+        book = Book.objects.get(title='小熊')
+        cover = book.cover_image.name
+        first, second = book.images.order_by('order')
+
+        # 只修改一张轮播图并新增一张，其余图书不变
+        gallery = os.path.join(source, '小熊', '轮播')
+        with open(os.path.join(gallery, '01.jpg'), 'wb') as f:
+            f.write(image_bytes(fmt='JPEG', color=(0, 200, 0)))
+        with open(os.path.join(gallery, '02.jpg'), 'wb') as f:
+            f.write(image_bytes(fmt='JPEG', color=(0, 0, 200)))
+        out = StringIO()
+        call_command('bulk_upload_books', source, stdout=out)
+        self.assertIn('成功: 1，失败: 1，未变化跳过: 1', out.getvalue())
+
+        book.refresh_from_db()
+        self.assertEqual(book.cover_image.name, cover)
+        images = list(book.images.order_by('order'))
+        self.assertEqual([image.caption for image in images], ['00', '01', '02'])
+        self.assertEqual(images[0].pk, first.pk)
+        self.assertNotEqual(images[1].pk, second.pk)
+        self.assertFalse(BookImage.objects.filter(pk=second.pk).exists())
+
+        out = StringIO()
+        call_command('bulk_upload_books', source, stdout=out)
+        self.assertIn('成功: 0，失败: 1，未变化跳过: 2', out.getvalue())
+        call_command('bulk_upload_books', source, full=True, stdout=StringIO())
+        self.assertFalse(book.images.filter(pk=first.pk).exists())
+
+    def test_import_without_returned_pks(self):
+        # MySQL 批量插入不回填主键，副本、轮播图和清单仍要关联到新图书
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            call_command('bulk_upload_books', self.archive, stdout=StringIO())
+        book = Book.objects.get(title='小熊')
+        self.assertEqual(book.copies.count(), 2)
+        self.assertEqual(book.images.count(), 2)
+        self.assertTrue(ImportManifest.objects.filter(name='小熊', book=book).exists())
+        self.assertEqual([b.title for b in search.search_books('小熊')], ['小熊'])
+
+    def test_directory_import(self):
+        source = self.mkdtemp()
+        with zipfile.ZipFile(self.archive) as archive:
+            archive.extractall(source)
+        call_command('bulk_upload_books', source, overwrite=True, stdout=StringIO())
+        book = Book.objects.get(title='无信息')
+        self.assertEqual(book.author, '未知')
+        self.assertEqual(book.images.count(), 1)
+
+
+def spawn_pools():
+    """让管理命令的进程池以 spawn 方式启动子进程（macOS、Windows 的默认方式）"""
+    spawn = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn'))
+    return mock.patch.object(tasks, 'ProcessPoolExecutor', spawn)
+
+
+@override_settings(LIBRARY_ASYNC_TASKS=False)
+class ParallelBulkUploadTests(IsolatedStorageMixin, TransactionTestCase):
+    def test_workers_import(self):
+        archive = os.path.join(self.mkdtemp(), 'books.zip')
+        write_book_archive(archive, {f'图书{i}': ({'author': '作者'}, 2) for i in range(7)})
+        out = StringIO()
+        call_command('bulk_upload_books', archive, workers=2, batch_size=3, stdout=out)
+        self.assertIn('成功: 7，失败: 0，未变化跳过: 0', out.getvalue())
+        self.assertEqual(Book.objects.count(), 7)
+        self.assertEqual(BookImage.objects.count(), 14)
+        self.assertEqual(BookCopy.objects.count(), 7)
+        # 提交后为上传的封面生成衍生图
+        self.assertTrue(has_cover_derivatives(Book.objects.first().cover_image.name))
+
+    def test_spawned_workers_set_up_django(self):
+        # spawn 启动的子进程不继承已初始化的 Django（macOS、Windows 的默认方式）
+        archive = os.path.join(self.mkdtemp(), 'books.zip')
+        write_book_archive(archive, {f'图书{i}': ({'author': '作者'}, 1) for i in range(3)})
+        out = StringIO()
+        with spawn_pools():
+            call_command('bulk_upload_books', archive, workers=2, stdout=out)
+        self.assertIn('成功: 3，失败: 0', out.getvalue())
+        self.assertNotIn('进程池不可用', out.getvalue())
+
+    def test_broken_pool_falls_back_to_serial(self):
+        archive = os.path.join(self.mkdtemp(), 'books.zip')
+        write_book_archive(archive, {f'图书{i}': ({'author': '作者'}, 1) for i in range(3)})
+        pool = mock.Mock()
+        pool.map.side_effect = BrokenProcessPool('子进程异常退出')
+        out = StringIO()
+        with mock.patch.object(tasks, 'process_pool', return_value=pool):
+            call_command('bulk_upload_books', archive, workers=2, batch_size=2, stdout=out)
+        self.assertIn('进程池不可用，改为单进程处理', out.getvalue())
+        self.assertIn('成功: 3，失败: 0', out.getvalue())
+        self.assertEqual(pool.map.call_count, 1)
+
+
+def create_exportable_book():
+    book = create_book('小熊', copies=2, keywords='动物', recommended_age=5,
+                       cover_image=SimpleUploadedFile('cover.png', image_bytes()))
+    BookImage.objects.create(book=book, image=SimpleUploadedFile('b.png', image_bytes(color=(0, 0, 0))),
+                             caption='第二页', order=1)
+    BookImage.objects.create(book=book, image=SimpleUploadedFile('a.png', image_bytes(color=(9, 9, 9))),
+                             caption='第一页', order=0)
+    return book
+
+
+class ExportBooksTests(IsolatedStorageMixin, TestCase):
+    def test_export_round_trips_through_import(self):
+        create_exportable_book()
+        create_book('a/b', cover_image='')
+        output = os.path.join(self.mkdtemp(), 'export.zip')
+        out = StringIO()
+        call_command('export_books', output, stdout=out)
+        self.assertIn('图书: 2', out.getvalue())
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(sorted(archive.namelist()), [
+                'a_b/图书信息.json', '小熊/图书信息.json', '小熊/封面.webp', '小熊/轮播/000.webp', '小熊/轮播/001.webp',
+            ])
+            self.assertEqual(archive.getinfo('小熊/封面.webp').compress_type, zipfile.ZIP_STORED)
+
+        Book.objects.all().delete()
+        call_command('bulk_upload_books', output, stdout=StringIO())
+        book = Book.objects.get(title='小熊')
+        self.assertEqual((book.keywords, book.recommended_age, book.total_count), ('动物', 5, 2))
+        self.assertEqual(list(book.images.values_list('caption', flat=True)), ['第一页', '第二页'])
+        self.assertTrue(Book.objects.filter(title='a_b').exists())
+
+    def test_legacy_formats_exported_as_png(self):
+        book = create_book('旧格式', cover_image=save_test_image('book_covers/legacy.bmp', size=(40, 60)))
+        BookImage.objects.create(book=book, image=save_test_image('book_gallery/legacy.bmp', size=(40, 60)))
+        output = os.path.join(self.mkdtemp(), 'export.zip')
+        call_command('export_books', output, stdout=StringIO())
+        with zipfile.ZipFile(output) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['旧格式/图书信息.json', '旧格式/封面.png', '旧格式/轮播/000.png'])
+            self.assertEqual(Image.open(BytesIO(archive.read('旧格式/封面.png'))).format, 'PNG')
+
+        # 重新导入时封面和轮播图都不会丢失
+        Book.objects.all().delete()
+        call_command('bulk_upload_books', output, stdout=StringIO())
+        book = Book.objects.get(title='旧格式')
+        self.assertTrue(book.cover_image)
+        self.assertEqual(book.images.count(), 1)
+
+    def test_admin_action_streams_zip(self):
+        book = create_exportable_book()
+        self.client.force_login(User.objects.create_superuser('root', password='pw'))
+        response = self.client.post('/admin/library/book/', {
+            'action': 'export_books_action', '_selected_action': [book.pk],
+        })
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(json.loads(archive.read('小熊/图书信息.json'))['captions'],
+                             {'000.webp': '第一页', '001.webp': '第二页'})
+
+
+class ParallelExportTests(IsolatedStorageMixin, TransactionTestCase):
+    def test_compressed_export_with_workers(self):
+        book = create_exportable_book()
+        output = os.path.join(self.mkdtemp(), 'export.zip')
+        call_command('export_books', output, compress=True, workers=2, stdout=StringIO())
+        with zipfile.ZipFile(output) as archive:
+            self.assertIsNone(archive.testzip())
+            info = archive.getinfo('小熊/封面.webp')
+            self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+            with book.cover_image.open() as f:
+                self.assertEqual(archive.read(info), f.read())
+
+
+class ImportCatalogTests(IsolatedStorageMixin, TestCase):
+    def write(self, name, text):
+        path = os.path.join(self.mkdtemp(), name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_csv_import(self):
+        path = self.write('catalog.csv', (
+            'ISBN,书名,作者,推荐年龄,副本数量\n'
+            '978-7-02-000001-1,小王子,圣埃克苏佩里,8,2\n'
+            '123,坏数据,某人,,1\n'
+            '9787020000028,夏洛的网,怀特,,\n'
+            '9787020000028,夏洛的网（新版）,怀特,7,\n'
+        ))
+        out = StringIO()
+        with self.captureOnCommitCallbacks() as callbacks:
+            call_command('import_catalog', path, batch_size=3, stdout=out)
+        self.assertIn('新增: 2，更新: 1，失败: 1', out.getvalue())
+        self.assertIn('第 3 行: ISBN 无效', out.getvalue())
+        self.assertEqual(deferred_tasks(callbacks), [])
+
+        prince = Book.objects.get(isbn='9787020000011')
+        self.assertEqual((prince.recommended_age, prince.total_count, prince.available_count), (8, 2, 2))
+        self.assertEqual(prince.copies.count(), 2)
+        charlotte = Book.objects.get(isbn='9787020000028')
+        self.assertEqual((charlotte.title, charlotte.recommended_age, charlotte.copies.count()), ('夏洛的网（新版）', 7, 1))
+        self.assertEqual(search.search_books('新版'), [charlotte])
+
+    def test_jsonl_reimport_updates_and_adds_copies(self):
+        first = self.write('catalog.jsonl', '{"isbn": "9787020000011", "title": "小王子", "copies_count": 1}\n')
+        call_command('import_catalog', first, stdout=StringIO())
+        book = Book.objects.get()
+        circulation.borrow_available_copy(book.id, User.objects.create_user('alice'), days=7)
+
+        second = self.write('catalog.jsonl', (
+            '{"isbn": "9787020000011", "title": "小王子（插图本）", "copies_count": 3}\n'
+            'not json\n'
+        ))
+        out = StringIO()
+        call_command('import_catalog', second, stdout=out)
+        self.assertIn('新增: 0，更新: 1，失败: 1', out.getvalue())
+        book.refresh_from_db()
+        self.assertEqual((book.title, book.total_count, book.available_count), ('小王子（插图本）', 3, 2))
+        self.assertEqual(book.copies.count(), 3)
+
+    @override_settings(LIBRARY_ASYNC_TASKS=False)
+    def test_cover_is_rendered_on_first_display(self):
+        path = self.write('catalog.jsonl', '{"isbn": "9787020000011", "title": "小王子", "author": "圣埃克苏佩里"}\n')
+        call_command('import_catalog', path, stdout=StringIO())
+        book = Book.objects.get()
+        self.assertFalse(book.cover_image)
+
+        # 书目列表和详情页都显示占位图，封面只排队渲染一次
+        with mock.patch.object(tasks, 'render_book_cover') as render, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertContains(self.client.get('/'), 'cover_placeholder.svg')
+            self.assertContains(self.client.get(f'/book/{book.id}/'), 'cover_placeholder.svg')
+        render.assert_called_once_with(book.id)
+
+    def test_rejected_batch_retries_row_by_row(self):
+        path = self.write('catalog.jsonl', (
+            '{"isbn": "9787020000011", "title": "小王子"}\n'
+            '{"isbn": "9787020000028", "title": "坏行"}\n'
+            '{"isbn": "9787020000035", "title": "夏洛的网"}\n'
+        ))
+        index_books = search.index_books
+
+        def reject(books):
+            if any(book.title == '坏行' for book in books):
+                raise DataError('Data too long')
+            index_books(books)
+
+        out = StringIO()
+        with mock.patch.object(search, 'index_books', reject):
+            call_command('import_catalog', path, stdout=out)
+        self.assertIn('新增: 2，更新: 0，失败: 1', out.getvalue())
+        self.assertIn('第 2 行: Data too long', out.getvalue())
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ['夏洛的网', '小王子'])
+
+
+class AdminChangelistTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('root', password='pw'))
+        self.readers = [User.objects.create_user(f'reader{i}') for i in range(3)]
+
+    def add_books(self, count, start=0):
+        for i in range(start, start + count):
+            book = create_book(f'图书{i}', copies=2)
+            circulation.borrow_available_copy(book.id, self.readers[i % 3], days=7)
+
+    def changelist_queries(self, url='/admin/library/bookcopy/'):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_copy_changelist_query_count_independent_of_rows(self):
+        self.add_books(2)
+        few = self.changelist_queries()
+        self.add_books(8, start=2)
+        self.assertEqual(self.changelist_queries(), few)
+        self.assertEqual(self.changelist_queries('/admin/library/book/'), self.changelist_queries('/admin/library/book/'))
+
+    def test_book_input_filter(self):
+        self.add_books(3)
+        book = Book.objects.get(title='图书1')
+        response = self.client.get('/admin/library/bookcopy/', {'book': book.id})
+        self.assertEqual({copy.book_id for copy in response.context['cl'].result_list}, {book.id})
+        response = self.client.get('/admin/library/bookcopy/', {'book': '图书2', 'is_available__exact': '1'})
+        self.assertEqual([copy.book.title for copy in response.context['cl'].result_list], ['图书2'])
+        # 侧栏不再列出全部图书，只有输入框
+        self.assertContains(response, 'name="book" value="图书2"')
+        self.assertContains(response, 'name="is_available__exact" value="1"')
+        self.assertNotContains(response, 'book__id__exact')
+
+    def test_estimated_count_falls_back_to_exact_count(self):
+        from .admin import EstimatedCountPaginator
+        self.add_books(2)
+        # SQLite 没有可用的行数统计，使用精确计数
+        self.assertEqual(EstimatedCountPaginator(BookCopy.objects.order_by('id'), 10).count, 4)
+
+
+class QrCodeImageTests(IsolatedStorageMixin, TestCase):
+    def test_png_is_rendered_on_demand_and_cacheable(self):
+        book = create_book()
+        copy = book.copies.get()
+        self.assertFalse(copy.qr_code)
+
+        response = self.client.get(copy.qr_code_url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response.content.startswith(b'\x89PNG'))
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.client.get(copy.qr_code_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_svg_and_info_api(self):
+        copy = create_book().copies.get()
+        response = self.client.get(f'/qr/{copy.id}.svg')
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertIn(b'<svg', response.content)
+
+        data = self.client.get(f'/api/qr-info/{copy.id}/').json()
+        self.assertTrue(data['qr_code_url'].endswith(f'/qr/{copy.id}.png'))
+
+    def test_management_page_links_every_copy(self):
+        # 二维码按需渲染，未保存图片文件的副本同样显示二维码
+        book = create_book(copies=2)
+        response = self.client.get(f'/book/{book.id}/qr-management/')
+        for copy in book.copies.all():
+            self.assertFalse(copy.qr_code)
+            self.assertContains(response, f'src="{copy.qr_code_url}"')
+
+
+class QrInfoBatchTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('admin', password='pw', is_admin=True))
+
+    def test_batch_resolves_in_one_query(self):
+        book = create_book(copies=3)
+        user = User.objects.create_user('alice', password='pw')
+        first, second, third = book.copies.order_by('id')
+        circulation.borrow_copy(second.id, user)
+
+        codes = [first.id, f'bookcopy:{second.id}', str(third.id), 999999, 'hello']
+        # 会话和用户各一次，副本一次
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/qr-info/batch/', {'codes': codes}, content_type='application/json')
+        data = response.json()
+        self.assertEqual([item['status'] for item in data['results']],
+                         ['available', 'borrowed', 'available', 'missing', 'invalid'])
+        self.assertEqual(data['results'][1]['borrower'], 'alice')
+        self.assertEqual(data['summary'], {
+            'total': 5, 'available': 2, 'borrowed': 1, 'missing': [999999], 'invalid': ['hello'],
+        })
+
+    def test_rejects_malformed_body(self):
+        response = self.client.post('/api/qr-info/batch/', 'nope', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_requires_admin(self):
+        # 借阅者信息不对匿名用户和普通读者开放
+        self.client.logout()
+        body = {'codes': [1]}
+        self.assertEqual(self.client.post('/api/qr-info/batch/', body, content_type='application/json').status_code, 401)
+        self.client.force_login(User.objects.create_user('alice', password='pw'))
+        self.assertEqual(self.client.post('/api/qr-info/batch/', body, content_type='application/json').status_code, 403)
+
+
+class StocktakeTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.book = create_book(copies=5)
+        self.other = create_book(title='其他图书', copies=1)
+        self.user = User.objects.create_user('alice', password='pw')
+        self.ids = list(self.book.copies.order_by('id').values_list('id', flat=True))
+        circulation.borrow_copy(self.ids[4], self.user)
+        self.other_id = self.other.copies.get().id
+        # 副本0、1在架被扫到，副本2、3在架未扫到，副本4借出却被扫到
+        self.scans = [
+            str(self.ids[0]), f'bookcopy:{self.ids[1]}', str(self.ids[0]), str(self.ids[4]),
+            str(self.other_id), '99999999', 'garbage', '',
+        ]
+
+    def test_reconcile_classifies_copies(self):
+        report = stocktake.reconcile(self.scans, BookCopy.objects.filter(book=self.book))
+        self.assertEqual(report.scanned, 4)
+        self.assertEqual(report.duplicates, 1)
+        self.assertEqual(report.invalid_samples, ['garbage'])
+        self.assertEqual(list(report.missing), self.ids[2:4])
+        self.assertEqual(list(report.on_loan), [self.ids[4]])
+        self.assertEqual(list(report.unexpected), [self.other_id])
+        self.assertEqual(report.out_of_range, 1)
+
+    def test_held_copies_are_not_discrepancies(self):
+        # 副本4归还后保留给预约读者：扫到时不算借出却在架，未扫到时算缺失
+        waiting = User.objects.create_user('bob', password='pw')
+        holds.place_hold(self.book.id, waiting)
+        circulation.return_copy(self.ids[4], self.user)
+        self.assertEqual(Hold.objects.get(user=waiting).copy_id, self.ids[4])
+        report = stocktake.reconcile(self.scans, BookCopy.objects.filter(book=self.book))
+        self.assertEqual(list(report.on_loan), [])
+        self.assertEqual(list(report.held), [self.ids[4]])
+        report = stocktake.reconcile([str(self.ids[0])], BookCopy.objects.filter(book=self.book))
+        self.assertEqual(list(report.missing), self.ids[1:5])
+
+    def test_copies_created_after_size_are_ignored(self):
+        size = self.ids[2]
+        existing, available, _ = stocktake.load_copy_bitmaps(BookCopy.objects.all(), size)
+        self.assertEqual(list(existing), self.ids[:2])
+
+    def test_bitmap_set_operations(self):
+        a = stocktake.Bitmap.from_ids(100, [1, 8, 64, 99])
+        b = stocktake.Bitmap.from_ids(100, [8, 99])
+        self.assertEqual(list(a - b), [1, 64])
+        self.assertEqual(list(a & b), [8, 99])
+        self.assertEqual(len(a | b), 4)
+
+    def test_command_and_admin_view(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('\n'.join(self.scans))
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        call_command('stocktake', f.name, book_id=self.book.id, stdout=out)
+        self.assertIn('应在架未扫到: 2', out.getvalue())
+        self.assertIn('范围外或不存在: 2', out.getvalue())
+
+        admin = User.objects.create_superuser('root', password='pw')
+        self.client.force_login(admin)
+        with open(f.name, 'rb') as scan_file:
+            response = self.client.post('/admin/library/bookcopy/stocktake/', {'scan_file': scan_file})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['results']['categories'][0]['ids']), self.ids[2:4])
+
+    def test_admin_book_field_uses_autocomplete(self):
+        create_book('不应列出的图书')
+        self.client.force_login(User.objects.create_superuser('root', password='pw'))
+        response = self.client.get('/admin/library/bookcopy/stocktake/')
+        self.assertContains(response, 'admin-autocomplete')
+        self.assertNotContains(response, '不应列出的图书')
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'library', 'model_name': 'bookcopy', 'field_name': 'book', 'term': '不应',
+        })
+        self.assertEqual([item['text'] for item in response.json()['results']], ['不应列出的图书'])
+
+
+class OverdueSweepTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        book = create_book(copies=6)
+        self.alice = User.objects.create_user('alice', email='alice@example.com', password='pw')
+        self.bob = User.objects.create_user('bob', password='pw')
+        # alice: 两本逾期、一本今日到期；bob（无邮箱）：一本逾期；另有一本未到期
+        for user, days in ((self.alice, -3), (self.alice, -1), (self.alice, 0), (self.bob, -2), (self.alice, 10)):
+            circulation.borrow_available_copy(book.id, user, days=days)
+
+    def test_classify_in_one_query(self):
+        with self.assertNumQueries(1):
+            counts = overdue.classify_loans(self.today)
+        self.assertEqual(counts, {'overdue': 3, 'due_today': 1, 'due_soon': 0, 'not_due': 1})
+
+    def test_sweep_sends_one_reminder_per_borrower(self):
+        result = overdue.sweep_overdue(self.today)
+        self.assertEqual(result.sent, {'overdue': 1, 'due_today': 1})
+        self.assertEqual(result.skipped, {'overdue': 1, 'due_today': 0})
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, ['alice@example.com'])
+        self.assertEqual(mail.outbox[0].body.count('《测试图书》'), 2)
+
+    def test_command_and_borrowings_page(self):
+        out = StringIO()
+        call_command('sweep_overdue', '--dry-run', stdout=out)
+        self.assertIn('已逾期: 3', out.getvalue())
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.client.force_login(self.alice)
+        response = self.client.get('/my-borrowings/')
+        self.assertContains(response, '逾期 3 天')
+        self.assertContains(response, '剩余 10 天')
+        self.assertContains(response, '请于当天归还书籍')
+
+
+class QrLabelSheetTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        self.book = create_book(copies=30)
+        self.admin = User.objects.create_user('admin', password='pw', is_admin=True)
+
+    def test_view_streams_multi_page_pdf(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/qr/labels.pdf', {'book_id': self.book.id})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        pdf = b''.join(response.streaming_content)
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertIn(b'/Count 2', pdf)
+        self.assertTrue(pdf.endswith(b'%%EOF\n'))
+
+    def test_view_requires_admin(self):
+        self.client.force_login(User.objects.create_user('reader', password='pw'))
+        response = self.client.get('/qr/labels.pdf', {'book_id': self.book.id})
+        self.assertFalse(response.json()['success'])
+
+    def test_command_writes_copy_range(self):
+        ids = list(self.book.copies.order_by('id').values_list('id', flat=True))
+        with tempfile.TemporaryDirectory() as output:
+            out = StringIO()
+            call_command('print_qr_labels', output, start=ids[0], end=ids[4], format='png', stdout=out)
+            self.assertEqual(os.listdir(output), ['qr_labels_0001.png'])
+            self.assertIn('已生成 1 页标签', out.getvalue())
+
+
+@override_settings(LIBRARY_ASYNC_TASKS=False)
+class GenerateQrCodesCommandTests(IsolatedStorageMixin, TransactionTestCase):
+    def test_parallel_generation_and_resume(self):
+        book = create_book(copies=6)
+        BookCopy.objects.update(qr_code='')
+        ids = list(book.copies.order_by('id').values_list('id', flat=True))
+
+        out = StringIO()
+        call_command('generate_qr_codes', workers=2, chunk_size=4, after=ids[1], stdout=out)
+        self.assertIn('成功: 4', out.getvalue())
+        self.assertEqual(BookCopy.objects.filter(qr_code='').count(), 2)
+        self.assertTrue(default_storage.exists(f'qr_codes/qr_code_bookcopy_{ids[-1]}.png'))
+
+        # 未使用 --force 时只补齐剩余的副本
+        out = StringIO()
+        call_command('generate_qr_codes', stdout=out)
+        self.assertIn('成功: 2', out.getvalue())
+        self.assertFalse(BookCopy.objects.filter(qr_code='').exists())
+
+    def test_spawned_workers(self):
+        book = create_book(copies=2)
+        BookCopy.objects.update(qr_code='')
+        out = StringIO()
+        with spawn_pools():
+            call_command('generate_qr_codes', workers=2, stdout=out)
+        self.assertIn('成功: 2', out.getvalue())
+        self.assertFalse(book.copies.filter(qr_code='').exists())
+
+
+@override_settings(LIBRARY_ASYNC_TASKS=False)
+class ConcurrentBorrowTests(IsolatedStorageMixin, TransactionTestCase):
+    THREADS = 8
+    COPIES = 5
+    # 8 个并发借阅请求的总耗时上限（秒），远大于正常耗时，只用来发现锁等待或超时重试
+    MAX_SECONDS = 5
+
+    def setUp(self):
+        # 默认的 SQLite 测试库是文件库；若被改成内存库，多个连接共享缓存，并发写入直接报 table is locked
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('并发测试需要 MySQL 或文件型 SQLite 测试库')
+
+    def test_concurrent_borrow_never_double_allocates(self):
+        book = create_book(copies=self.COPIES)
+        users = [User.objects.create_user(f'reader{i}', password='pw') for i in range(self.THREADS)]
+        results = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def worker(user):
+            try:
+                barrier.wait()
+                results.append(circulation.borrow_available_copy(book.id, user))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        logger.info('并发借阅: %d 个请求耗时 %.3f 秒，%.0f 个/秒',
+                    self.THREADS, elapsed, self.THREADS / elapsed)
+
+        loans = [loan for loan in results if loan]
+        self.assertLess(elapsed, self.MAX_SECONDS)
+        self.assertEqual(len(results), self.THREADS)
+        self.assertEqual(len(loans), self.COPIES)
+        self.assertEqual(len({loan.copy_id for loan in loans}), self.COPIES)
+        self.assertEqual(book.copies.filter(is_available=True).count(), 0)
+        book.refresh_from_db()
+        self.assertEqual(book.available_count, 0)
+        self.assertEqual(
+            BookCopy.objects.filter(book=book, borrower__isnull=False).values('borrower').distinct().count(),
+            self.COPIES,
+        )
+
+    def test_concurrent_returns_allocate_each_hold_once(self):
+        book = create_book(copies=self.COPIES)
+        borrowers = [User.objects.create_user(f'borrower{i}', password='pw') for i in range(self.COPIES)]
+        waiting = [User.objects.create_user(f'waiting{i}', password='pw') for i in range(self.COPIES + 2)]
+        loans = [circulation.borrow_available_copy(book.id, user) for user in borrowers]
+        for user in waiting:
+            holds.place_hold(book.id, user)
+        barrier = threading.Barrier(self.COPIES)
+
+        def worker(user, loan):
+            try:
+                barrier.wait()
+                circulation.return_copy(loan.copy_id, user)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=pair) for pair in zip(borrowers, loans)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        ready = Hold.objects.filter(book=book, status=Hold.READY)
+        # 队列前几位各分到一个不同的副本，其余仍在排队，副本均未计入可借
+        self.assertEqual(sorted(ready.values_list('user__username', flat=True)),
+                         [f'waiting{i}' for i in range(self.COPIES)])
+        self.assertEqual(ready.values('copy').distinct().count(), self.COPIES)
+        self.assertEqual(Hold.objects.filter(book=book, status=Hold.WAITING).count(), 2)
+        book.refresh_from_db()
+        self.assertEqual(book.available_count, 0)
@@ -4,9 +4,14 @@ from . import views
 
 urlpatterns = [
     path('', views.book_list, name='book_list'),
+    path('api/books/', views.book_list_api, name='book_list_api'),
+    path('search/', views.book_search, name='book_search'),
     path('book/<int:book_id>/', views.book_detail, name='book_detail'),
     path('book/<int:book_id>/borrow/', views.borrow_book, name='borrow_book'),
     path('book/<int:book_id>/return/', views.return_book, name='return_book'),
+    path('book/<int:book_id>/hold/', views.place_hold, name='place_hold'),
+    path('holds/<int:hold_id>/cancel/', views.cancel_hold, name='cancel_hold'),
+    path('api/circulation/batch/', views.circulation_batch, name='circulation_batch'),
     path('my-borrowings/', views.my_borrowings, name='my_borrowings'),
     path('login/', views.user_login, name='login'),
     path('logout/', views.user_logout, name='logout'),
@@ -14,7 +19,11 @@ urlpatterns = [
     # 新增二维码相关路由
     path('scan/<int:bookcopy_id>/', views.scan_qr_code, name='scan_qr_code'),
     path('api/qr-info/<int:bookcopy_id>/', views.qr_code_info, name='qr_code_info'),
+    path('api/qr-info/batch/', views.qr_code_info_batch, name='qr_code_info_batch'),
     path('admin/generate-qr-codes/', views.generate_qr_codes, name='generate_qr_codes'),
+    path('qr/<int:bookcopy_id>.png', views.qr_code_image, {'fmt': 'png'}, name='qr_code_png'),
+    path('qr/<int:bookcopy_id>.svg', views.qr_code_image, {'fmt': 'svg'}, name='qr_code_svg'),
+    path('qr/labels.pdf', views.qr_label_sheet, name='qr_label_sheet'),
     path('qr/print/<int:bookcopy_id>/', views.qr_code_display, name='qr_code_display'),
     path('book/<int:book_id>/qr-management/', views.qr_management, name='qr_management'),
 ]
\ No newline at end of file
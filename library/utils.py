@@ -1,7 +1,101 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageOps
 import os
+from functools import lru_cache
+from io import BytesIO
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 import textwrap
+from collections import namedtuple
+
+# 封面衍生图尺寸（宽度像素），高度按A4比例缩放
+COVER_SIZES = {
+    'thumb': 160,
+    'card': 320,
+    'detail': 800,
+}
+COVER_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# 上传/导入图片规范化的输出格式：(PIL格式, 扩展名, 编码参数)
+IMAGE_FORMATS = {
+    'webp': ('WEBP', 'webp', {'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'optimize': True, 'progressive': True}),
+}
+
+NormalizedImage = namedtuple('NormalizedImage', ['data', 'ext', 'width', 'height'])
+
+QR_PAYLOAD_PREFIX = 'bookcopy:'
+
+def qr_payload(copy_id):
+    """图书副本二维码中编码的内容"""
+    return f"{QR_PAYLOAD_PREFIX}{copy_id}"
+
+def parse_qr_payload(code):
+    """解析扫描结果（副本ID或 bookcopy:N），无法识别时返回 None"""
+    if isinstance(code, int) and not isinstance(code, bool):
+        return code if code > 0 else None
+    if not isinstance(code, str):
+        return None
+    code = code.strip()
+    if code.startswith(QR_PAYLOAD_PREFIX):
+        code = code[len(QR_PAYLOAD_PREFIX):]
+    if code.isascii() and code.isdigit() and int(code) > 0:
+        return int(code)
+    return None
+
+def qr_code_filename(copy_id):
+    return f'qr_code_bookcopy_{copy_id}.png'
+
+def _make_qr(copy_id):
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(qr_payload(copy_id))
+    qr.make(fit=True)
+    return qr
+
+def render_qr_png(copy_id):
+    """渲染图书副本二维码，返回PNG字节（需要安装 qrcode）"""
+    img = _make_qr(copy_id).make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def render_qr_svg(copy_id):
+    """渲染图书副本二维码，返回SVG字节"""
+    from qrcode.image.svg import SvgPathImage
+
+    img = _make_qr(copy_id).make_image(image_factory=SvgPathImage)
+    buffer = BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+# 二维码内容只由副本ID决定，渲染结果可以放心缓存
+QR_RENDERERS = {
+    'png': render_qr_png,
+    'svg': render_qr_svg,
+}
+
+@lru_cache(maxsize=4096)
+def get_qr_image(copy_id, fmt='png'):
+    """带LRU缓存的二维码渲染（按进程缓存最近使用的 4096 张）"""
+    return QR_RENDERERS[fmt](copy_id)
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    """按字号缓存字体对象，每个进程每种字号只加载一次"""
+    font_path = os.path.join(settings.BASE_DIR, 'static', 'fonts', 'simsunb.ttf')
+    if not os.path.exists(font_path):
+        raise ValueError(f"字体文件未找到: {font_path}")
+    return ImageFont.truetype(font_path, size)
 
 def generate_book_cover(title, author=None, output_path=None):
     """生成无方框的纯文字封面"""
@@ -11,14 +105,9 @@ def generate_book_cover(title, author=None, output_path=None):
     img = Image.new('RGB', (width, height), (250, 250, 240))  # 米白背景
     draw = ImageDraw.Draw(img)
     
-    # 加载字体
-    font_path = os.path.join(settings.BASE_DIR, 'static', 'fonts', 'simsunb.ttf')
-    if not os.path.exists(font_path):
-        raise ValueError(f"字体文件未找到: {font_path}")
-    
     # 字体配置
-    title_font = ImageFont.truetype(font_path, 200)
-    author_font = ImageFont.truetype(font_path, 120)
+    title_font = get_font(200)
+    author_font = get_font(120)
 
     # --- 书名处理 ---
     max_line_width = width * 0.8
@@ -61,4 +150,80 @@ def generate_book_cover(title, author=None, output_path=None):
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         img.save(output_path, 'PNG', quality=100)
         return output_path
-    return img
\ No newline at end of file
+    return img
+
+
+def cover_derivative_name(name, size, fmt):
+    """封面衍生图的存储路径，与原封面放在同一目录"""
+    stem = os.path.splitext(name)[0]
+    ext = 'jpg' if fmt == 'jpeg' else fmt
+    return f'{stem}_{size}.{ext}'
+
+
+def has_cover_derivatives(name, storage=default_storage):
+    """判断封面衍生图是否已生成（以最大尺寸的最后一种格式为准）"""
+    return storage.exists(cover_derivative_name(name, 'detail', 'jpeg'))
+
+
+def cover_url(name, size='card', fmt='jpeg', storage=default_storage):
+    """返回封面衍生图URL，尚未生成时退回原图"""
+    if not name:
+        return None
+    if has_cover_derivatives(name, storage):
+        return storage.url(cover_derivative_name(name, size, fmt))
+    return storage.url(name)
+
+
+def _flatten(img):
+    """转换为RGB，透明背景铺白（JPEG不支持透明通道）"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    return img.convert('RGB')
+
+
+def normalize_image(fp, max_dimension=None, fmt=None, quality=None):
+    """规范化上传或导入的图片，返回 NormalizedImage
+
+    按 EXIF 方向旋正后限制最长边，丢弃 EXIF/ICC 等元数据，转码为 WebP 或 JPEG。
+    参数默认取 LIBRARY_IMAGE_* 设置；无法识别的图片抛出 PIL 的异常。
+    """
+    max_dimension = max_dimension or settings.LIBRARY_IMAGE_MAX_DIMENSION
+    fmt = fmt or settings.LIBRARY_IMAGE_FORMAT
+    quality = quality or settings.LIBRARY_IMAGE_QUALITY
+    pil_format, ext, options = IMAGE_FORMATS[fmt]
+
+    img = ImageOps.exif_transpose(Image.open(fp))
+    has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    if has_alpha and fmt == 'webp':
+        img = img.convert('RGBA')
+    else:
+        img = _flatten(img)
+    img.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    img.info = {}
+
+    buffer = BytesIO()
+    img.save(buffer, pil_format, quality=quality, **options)
+    return NormalizedImage(buffer.getvalue(), ext, img.width, img.height)
+
+
+def generate_cover_derivatives(name, storage=default_storage):
+    """为封面生成各尺寸的 WebP/JPEG 衍生图，返回生成的文件路径列表"""
+    with storage.open(name, 'rb') as f:
+        source = _flatten(ImageOps.exif_transpose(Image.open(f)))
+
+    saved = []
+    # 按尺寸从小到大生成，detail/jpeg 最后写入，作为"已生成"的标记
+    for size, width in sorted(COVER_SIZES.items(), key=lambda item: item[1]):
+        img = source.copy()
+        img.thumbnail((width, int(width * 1.414)), Image.LANCZOS)
+        for fmt, (pil_format, options) in COVER_FORMATS.items():
+            buffer = BytesIO()
+            img.save(buffer, pil_format, **options)
+            derivative = cover_derivative_name(name, size, fmt)
+            if storage.exists(derivative):
+                storage.delete(derivative)
+            saved.append(storage.save(derivative, ContentFile(buffer.getvalue())))
+    return saved
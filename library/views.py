@@ -1,80 +1,180 @@
 # book_management/library/views.py
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.utils import timezone
 from django.http import JsonResponse
+from django.conf import settings
+from django.urls import reverse
 from .models import Book, BookCopy, User
+from . import circulation, holds, labels, overdue, pagecache, search
+from .idempotency import idempotent
+from .utils import cover_url, get_qr_image, parse_qr_payload
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
 from django.utils.translation import gettext_lazy as _
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 import json
 
+def render_book_gallery(book):
+    """轮播图片段（图片列表只查询一次）"""
+    return pagecache.get_or_build(
+        'gallery', [pagecache.book_scope(book.id), pagecache.gallery_scope(book.id)],
+        lambda: render_to_string('library/book_gallery.html', {
+            'book': book, 'images': book.get_gallery_images(),
+        }),
+        book.id,
+    )
+
+def render_book_detail_body(book):
+    """详情页正文片段：轮播图和图书信息，不含随借还和读者变化的部分"""
+    return pagecache.get_or_build(
+        'detail', [pagecache.book_scope(book.id), pagecache.gallery_scope(book.id)],
+        lambda: render_to_string('library/book_detail_body.html', {
+            'book': book, 'gallery': mark_safe(render_book_gallery(book)),
+        }),
+        book.id,
+    )
+
 def book_detail(request, book_id):
     book = get_object_or_404(Book, id=book_id)
-    available_copies_count = book.copies.filter(is_available=True).count()
+    available_copies_count = book.available_count
     user_has_borrowed = False
+    user_hold = hold_position = None
     if request.user.is_authenticated:
         user_has_borrowed = book.copies.filter(borrower=request.user).exists()
+        user_hold = holds.active_hold(book.id, request.user)
+        if user_hold:
+            hold_position = holds.queue_position(user_hold)
     return render(request, 'library/book_detail.html', {
         'book': book,
+        'body': mark_safe(render_book_detail_body(book)),
         'available_copies_count': available_copies_count,
-        'user_has_borrowed': user_has_borrowed
+        'user_has_borrowed': user_has_borrowed,
+        'user_hold': user_hold,
+        'hold_position': hold_position,
     })
 
 def my_borrowings(request):
     if not request.user.is_authenticated:
         return redirect('login')
-    borrowed_copies = BookCopy.objects.filter(borrower=request.user)
-    today = timezone.now().date()
-    for copy in borrowed_copies:
-        if copy.due_date < today:
-            copy.status = 'overdue'
-            copy.days_overdue = (today - copy.due_date).days
-        elif copy.due_date == today:
-            copy.status = 'due_today'
-        else:
-            copy.status = 'not_due'
-            copy.days_remaining = (copy.due_date - today).days
+    today = timezone.localdate()
+    # 借阅状态与逾期/剩余天数在SQL中计算
+    borrowed_copies = overdue.with_loan_status(
+        BookCopy.objects.filter(borrower=request.user).select_related('book').order_by('due_date'), today
+    )
     return render(request, 'library/my_borrowings.html', {'borrowed_copies': borrowed_copies, 'today': today})
 
+# 书目卡片只需要这些字段
+BOOK_CARD_FIELDS = ('id', 'title', 'author', 'cover_image')
+MAX_BOOK_PAGE_SIZE = 100
+
+def get_page_params(request):
+    """解析分页参数，返回 (游标, 每页数量)"""
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+    try:
+        page_size = int(request.GET.get('page_size', settings.BOOK_LIST_PAGE_SIZE))
+    except ValueError:
+        page_size = settings.BOOK_LIST_PAGE_SIZE
+    return after, max(1, min(page_size, MAX_BOOK_PAGE_SIZE))
+
+def get_book_page(request):
+    """按 id 做游标（keyset）分页，返回 (本页图书, 下一页游标)"""
+    after, page_size = get_page_params(request)
+    # 多取一条用于判断是否还有下一页
+    books = list(
+        Book.objects.filter(id__gt=after).order_by('id').only(*BOOK_CARD_FIELDS)[:page_size + 1]
+    )
+    next_cursor = books[page_size - 1].id if len(books) > page_size else None
+    return books[:page_size], next_cursor
+
 def book_list(request):
-    books = Book.objects.all()
-    return render(request, 'library/book_list.html', {'books': books})
+    def build():
+        books, next_cursor = get_book_page(request)
+        return render_to_string('library/book_grid.html', {'books': books}), next_cursor
+
+    # 卡片网格与下一页游标一起缓存，命中时不查询数据库
+    grid, next_cursor = pagecache.get_or_build('grid', [pagecache.LIST_SCOPE], build, *get_page_params(request))
+    return render(request, 'library/book_list.html', {'grid': mark_safe(grid), 'next_cursor': next_cursor})
+
+def book_list_api(request):
+    """书目分页JSON接口（用于无限滚动）"""
+    books, next_cursor = get_book_page(request)
+    return JsonResponse({
+        'books': [{
+            'id': book.id,
+            'title': book.title,
+            'author': book.author,
+            'cover_url': cover_url(book.cover_image.name, 'card') or book.cover_url,
+            'detail_url': reverse('book_detail', args=[book.id]),
+        } for book in books],
+        'next': next_cursor,
+    })
+
+def book_search(request):
+    """图书全文检索"""
+    query = request.GET.get('q', '').strip()
+    books = search.search_books(query) if query else []
+    return render(request, 'library/search_results.html', {'books': books, 'query': query})
 
+@idempotent
 def borrow_book(request, book_id):
     if not request.user.is_authenticated:
         return JsonResponse({'success': False, 'error': '请先登录'})
     if request.method == 'POST':
         book = get_object_or_404(Book, id=book_id)
-        available_copy = book.copies.filter(is_available=True).first()
-        if available_copy:
-            days = int(request.POST.get('days', 7))
-            available_copy.borrower = request.user
-            available_copy.borrowed_date = timezone.now()
-            available_copy.due_date = timezone.now() + timezone.timedelta(days=days)
-            available_copy.is_available = False
-            available_copy.save()
+        days = int(request.POST.get('days', circulation.DEFAULT_LOAN_DAYS))
+        # 有为该读者保留的预约副本时优先借出
+        loan = (
+            circulation.borrow_held_copy(request.user, book_id=book.id, days=days)
+            or circulation.borrow_available_copy(book.id, request.user, days)
+        )
+        if loan:
             return JsonResponse({
                 'success': True,
                 'book_title': book.title,
                 'book_author': book.author,
-                'due_date': available_copy.due_date.strftime('%Y-%m-%d')
+                'due_date': loan.due_date.strftime('%Y-%m-%d')
             })
     return JsonResponse({'success': False, 'error': '租借失败'})
 
+@idempotent
 def return_book(request, book_id):
     if not request.user.is_authenticated:
         return redirect('login')
     book = get_object_or_404(Book, id=book_id)
-    borrowed_copy = book.copies.filter(borrower=request.user).first()
-    if borrowed_copy:
-        borrowed_copy.borrower = None
-        borrowed_copy.borrowed_date = None
-        borrowed_copy.due_date = None
-        borrowed_copy.is_available = True
-        borrowed_copy.save()
+    circulation.return_book_copy(book.id, request.user)
     return redirect('my_borrowings')
 
+@require_POST
+def place_hold(request, book_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': '请先登录'})
+    book = get_object_or_404(Book.objects.only('id', 'available_count'), id=book_id)
+    if book.available_count > 0:
+        return JsonResponse({'success': False, 'error': '当前有可借副本，请直接借阅'})
+    hold, created = holds.place_hold(book.id, request.user)
+    return JsonResponse({
+        'success': True,
+        'created': created,
+        'hold_id': hold.id,
+        'position': holds.queue_position(hold),
+    })
+
+@require_POST
+def cancel_hold(request, hold_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': '请先登录'})
+    if holds.cancel_hold(hold_id, request.user):
+        return JsonResponse({'success': True})
+    return JsonResponse({'success': False, 'error': '预约不存在或已结束'})
+
 def user_login(request):
     if request.method == 'POST':
         form = AuthenticationForm(request, data=request.POST)
@@ -119,9 +219,10 @@ def is_mobile_device(request):
     return False
 
 # 新增二维码相关功能
+@idempotent
 def scan_qr_code(request, bookcopy_id):
     """处理二维码扫描请求"""
-    book_copy = get_object_or_404(BookCopy, id=bookcopy_id)
+    book_copy = get_object_or_404(BookCopy.objects.select_related('book'), id=bookcopy_id)
     
     # 检测是否为移动设备
     if is_mobile_device(request):
@@ -148,46 +249,43 @@ def scan_qr_code(request, bookcopy_id):
                 'redirect_url': '/login/'
             })
         
-        if book_copy.is_available:
-            # 借阅图书
-            days = int(request.POST.get('days', 7))
-            book_copy.borrower = request.user
-            book_copy.borrowed_date = timezone.now()
-            book_copy.due_date = timezone.now() + timezone.timedelta(days=days)
-            book_copy.is_available = False
-            book_copy.save()
-            
-            return JsonResponse({
-                'success': True,
-                'action': 'borrow',
-                'message': f'成功借阅《{book_copy.book.title}》',
-                'due_date': book_copy.due_date.strftime('%Y-%m-%d'),
-                'book_title': book_copy.book.title,
-                'book_author': book_copy.book.author
-            })
-        else:
-            # 检查是否是当前用户借阅的
-            if book_copy.borrower == request.user:
-                # 归还图书
-                book_copy.borrower = None
-                book_copy.borrowed_date = None
-                book_copy.due_date = None
-                book_copy.is_available = True
-                book_copy.save()
-                
+        if book_copy.is_available or book_copy.borrower_id is None:
+            # 借阅可借副本，或借出为当前用户预约保留的副本（条件更新，被他人抢先时失败）
+            days = int(request.POST.get('days', circulation.DEFAULT_LOAN_DAYS))
+            if book_copy.is_available:
+                loan = circulation.borrow_copy(book_copy.id, request.user, days)
+            else:
+                loan = circulation.borrow_held_copy(request.user, copy_id=book_copy.id, days=days)
+            if loan:
                 return JsonResponse({
                     'success': True,
-                    'action': 'return',
-                    'message': f'成功归还《{book_copy.book.title}》',
+                    'action': 'borrow',
+                    'message': f'成功借阅《{book_copy.book.title}》',
+                    'due_date': loan.due_date.strftime('%Y-%m-%d'),
                     'book_title': book_copy.book.title,
                     'book_author': book_copy.book.author
                 })
-            else:
-                return JsonResponse({
-                    'success': False,
-                    'error': f'此书已被{book_copy.borrower.username}借阅，无法归还',
-                    'due_date': book_copy.due_date.strftime('%Y-%m-%d') if book_copy.due_date else None
-                })
+        elif circulation.return_copy(book_copy.id, request.user):
+            # 当前用户借阅的副本，归还图书
+            return JsonResponse({
+                'success': True,
+                'action': 'return',
+                'message': f'成功归还《{book_copy.book.title}》',
+                'book_title': book_copy.book.title,
+                'book_author': book_copy.book.author
+            })
+
+        # 副本已被他人借阅，重新读取最新状态用于提示
+        book_copy.refresh_from_db()
+        if book_copy.borrower is None:
+            if not book_copy.is_available:
+                return JsonResponse({'success': False, 'error': '此副本已为其他读者预约保留'})
+            return JsonResponse({'success': False, 'error': '副本状态已变化，请刷新后重试'})
+        return JsonResponse({
+            'success': False,
+            'error': f'此书已被{book_copy.borrower.username}借阅，无法归还',
+            'due_date': book_copy.due_date.strftime('%Y-%m-%d') if book_copy.due_date else None
+        })
 
 def qr_code_info(request, bookcopy_id):
     """获取图书副本信息的API接口（用于移动端扫描）"""
@@ -202,12 +300,121 @@ def qr_code_info(request, bookcopy_id):
         'borrower': book_copy.borrower.username if book_copy.borrower else None,
         'due_date': book_copy.due_date.strftime('%Y-%m-%d') if book_copy.due_date else None,
         'borrowed_date': book_copy.borrowed_date.strftime('%Y-%m-%d') if book_copy.borrowed_date else None,
-        'qr_code_url': book_copy.qr_code.url if book_copy.qr_code else None,
+        'qr_code_url': request.build_absolute_uri(book_copy.qr_code_url),
         'scan_url': request.build_absolute_uri(f'/scan/{book_copy.id}/')
     }
     
     return JsonResponse(data)
 
+MAX_QR_BATCH_SIZE = 1000
+
+@csrf_exempt
+@require_POST
+def qr_code_info_batch(request):
+    """批量查询副本信息（用于盘点扫描枪一次同步整排书架）
+
+    请求体为 JSON：{"codes": [12, "13", "bookcopy:14", ...]}
+    返回借阅者和应还日期，仅限管理员调用。
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': '需要登录'}, status=401)
+    if not (request.user.is_superuser or getattr(request.user, 'is_admin', False)):
+        return JsonResponse({'success': False, 'error': '需要管理员权限'}, status=403)
+
+    try:
+        codes = json.loads(request.body).get('codes')
+    except (ValueError, AttributeError):
+        codes = None
+    if not isinstance(codes, list):
+        return JsonResponse({'success': False, 'error': '请求格式错误，需要 {"codes": [...]}'}, status=400)
+    if len(codes) > MAX_QR_BATCH_SIZE:
+        return JsonResponse({'success': False, 'error': f'单次最多查询{MAX_QR_BATCH_SIZE}个副本'}, status=400)
+
+    parsed = [(code, parse_qr_payload(code)) for code in codes]
+    # 一次查询取回全部副本及其图书、借阅者
+    copies = (
+        BookCopy.objects.select_related('book', 'borrower')
+        .only('id', 'is_available', 'due_date', 'book__id', 'book__title', 'borrower__username')
+        .in_bulk({copy_id for _, copy_id in parsed if copy_id})
+    )
+
+    results = []
+    summary = {'total': len(codes), 'available': 0, 'borrowed': 0, 'missing': [], 'invalid': []}
+    for code, copy_id in parsed:
+        if copy_id is None:
+            summary['invalid'].append(code)
+            results.append({'code': code, 'status': 'invalid'})
+            continue
+        copy = copies.get(copy_id)
+        if copy is None:
+            summary['missing'].append(copy_id)
+            results.append({'id': copy_id, 'status': 'missing'})
+            continue
+        item = {
+            'id': copy.id,
+            'status': 'available' if copy.is_available else 'borrowed',
+            'book_id': copy.book.id,
+            'book_title': copy.book.title,
+        }
+        if not copy.is_available:
+            item['borrower'] = copy.borrower.username if copy.borrower else None
+            item['due_date'] = copy.due_date.strftime('%Y-%m-%d') if copy.due_date else None
+        summary[item['status']] += 1
+        results.append(item)
+
+    return JsonResponse({'success': True, 'results': results, 'summary': summary})
+
+MAX_CIRCULATION_BATCH_SIZE = 200
+
+@require_POST
+@idempotent
+def circulation_batch(request):
+    """借还台批量借出/归还（管理功能），所有副本在一个事务中处理
+
+    请求体为 JSON：{"patron": 读者ID或用户名, "action": "borrow"|"return",
+    "copy_ids": [12, "bookcopy:13", ...], "days": 7}
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': '需要登录'})
+    if not (request.user.is_superuser or getattr(request.user, 'is_admin', False)):
+        return JsonResponse({'success': False, 'error': '需要管理员权限'})
+
+    try:
+        data = json.loads(request.body)
+        action, codes = data['action'], data['copy_ids']
+        patron = data['patron']
+        days = int(data.get('days', circulation.DEFAULT_LOAN_DAYS))
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({'success': False, 'error': '请求格式错误'}, status=400)
+    if action not in ('borrow', 'return') or not isinstance(codes, list) or days < 1:
+        return JsonResponse({'success': False, 'error': '请求格式错误'}, status=400)
+    if len(codes) > MAX_CIRCULATION_BATCH_SIZE:
+        return JsonResponse({'success': False, 'error': f'单次最多处理{MAX_CIRCULATION_BATCH_SIZE}个副本'}, status=400)
+
+    lookup = {'pk': patron} if isinstance(patron, int) else {'username': patron}
+    user = User.objects.filter(**lookup).first()
+    if user is None:
+        return JsonResponse({'success': False, 'error': '读者不存在'}, status=404)
+
+    parsed = [(code, parse_qr_payload(code)) for code in codes]
+    copy_ids = [copy_id for _, copy_id in parsed if copy_id]
+    due_date = None
+    if action == 'borrow':
+        statuses, due_date = circulation.batch_borrow(copy_ids, user, days)
+    else:
+        statuses = circulation.batch_return(copy_ids, user)
+
+    results = []
+    summary = {}
+    for code, copy_id in parsed:
+        item = {'code': code, 'id': copy_id, 'status': statuses[copy_id] if copy_id else 'invalid'}
+        summary[item['status']] = summary.get(item['status'], 0) + 1
+        results.append(item)
+    response = {'success': True, 'action': action, 'patron': user.username, 'results': results, 'summary': summary}
+    if due_date and summary.get(circulation.BORROWED):
+        response['due_date'] = due_date.strftime('%Y-%m-%d')
+    return JsonResponse(response)
+
 def generate_qr_codes(request):
     """为所有没有二维码的图书副本生成二维码（管理功能）"""
     if not request.user.is_authenticated:
@@ -250,6 +457,45 @@ def generate_qr_codes(request):
         'count': count
     })
 
+QR_CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+QR_CACHE_MAX_AGE = 365 * 24 * 3600
+# 二维码样式变化时递增，使客户端缓存失效
+QR_ETAG_VERSION = 1
+
+def qr_code_etag(request, bookcopy_id, fmt):
+    return f'qr-{bookcopy_id}-{fmt}-v{QR_ETAG_VERSION}'
+
+@condition(etag_func=qr_code_etag)
+@cache_control(public=True, max_age=QR_CACHE_MAX_AGE, immutable=True)
+def qr_code_image(request, bookcopy_id, fmt):
+    """按需渲染副本二维码图片，内容只取决于副本ID，不查询数据库"""
+    return HttpResponse(get_qr_image(bookcopy_id, fmt), content_type=QR_CONTENT_TYPES[fmt])
+
+def qr_label_sheet(request):
+    """批量打印二维码标签：按图书ID或副本ID范围流式输出多页PDF（管理功能）"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': '需要登录'})
+    if not (request.user.is_superuser or getattr(request.user, 'is_admin', False)):
+        return JsonResponse({'success': False, 'error': '需要管理员权限'})
+
+    try:
+        book_id, start, end = (
+            int(request.GET[key]) if request.GET.get(key) else None
+            for key in ('book_id', 'start', 'end')
+        )
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '参数必须为整数'})
+    if book_id is None and start is None and end is None:
+        return JsonResponse({'success': False, 'error': '请指定图书ID或副本ID范围'})
+
+    copies = labels.label_copies(labels.select_copies(book_id, start, end))
+    response = StreamingHttpResponse(labels.stream_label_pdf(copies), content_type='application/pdf')
+    response['Content-Disposition'] = 'inline; filename="qr_labels.pdf"'
+    return response
+
 def qr_code_display(request, bookcopy_id):
     """显示图书二维码（用于打印）"""
     book_copy = get_object_or_404(BookCopy, id=bookcopy_id)
@@ -257,7 +503,7 @@ def qr_code_display(request, bookcopy_id):
     return render(request, 'library/qr_display.html', {
         'book_copy': book_copy,
         'book': book_copy.book,
-        'qr_code_url': book_copy.qr_code.url if book_copy.qr_code else None,
+        'qr_code_url': book_copy.qr_code_url,
     })
 
 def qr_management(request, book_id):
@@ -271,9 +517,10 @@ def qr_management(request, book_id):
     #     return redirect('login')
     
     book = get_object_or_404(Book, id=book_id)
-    available_copies_count = book.copies.filter(is_available=True).count()
+    available_copies_count = book.available_count
     
     return render(request, 'library/qr_management.html', {
         'book': book,
         'available_copies_count': available_copies_count,
+        'labels_per_page': labels.LABELS_PER_PAGE,
     })
\ No newline at end of file